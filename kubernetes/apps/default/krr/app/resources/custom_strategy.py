@@ -1,5 +1,23 @@
 # This is an example on how to create your own custom strategy
 
+import atexit
+import contextvars
+import functools
+import hashlib
+import json
+import math
+import os
+import sys
+import textwrap
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
 import pydantic as pd
 
 import robusta_krr
@@ -11,12 +29,215 @@ from robusta_krr.api.models import (
     RunResult,
 )
 from robusta_krr.api.strategies import BaseStrategy, StrategySettings
+from robusta_krr.core.abstract.strategies import PodsTimeData
 from robusta_krr.core.integrations.prometheus.metrics import (
+    CPUAmountLoader,
+    CPULoader,
     MaxMemoryLoader,
-    PercentileCPULoader,
+    MaxOOMKilledMemoryLoader,
+    MemoryAmountLoader,
+    PrometheusMetric,
 )
 
 
+class CPUQuantileSketch:
+    """
+    Mergeable quantile sketch for CPU usage (cores), a fixed-bucket
+    logarithmic histogram in the style of DDSketch.
+
+    Error bound: for values in [MIN_VALUE, MAX_VALUE], quantile(q) is within a
+    relative error of `relative_accuracy` of the exact nearest-rank q-th
+    percentile (np.percentile(..., method="inverted_cdf")). Values below
+    MIN_VALUE (including 0) are reported as 0, values above MAX_VALUE are
+    clamped to it.
+
+    Memory is fixed by the accuracy (about 1k buckets at 1%), independent of
+    the number of samples, and merging two sketches is an array addition.
+    """
+
+    MIN_VALUE = 1e-6  # 1 microcore
+    MAX_VALUE = 1e4  # cores
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._offset = math.floor(math.log(self.MIN_VALUE) / self._log_gamma)
+        n_buckets = math.ceil(math.log(self.MAX_VALUE) / self._log_gamma) - self._offset + 1
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+        self.zero_count = 0
+        self.max = float("-inf")
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, relative_accuracy: float = 0.01) -> "CPUQuantileSketch":
+        sketch = cls(relative_accuracy)
+        sketch.add(values)
+        return sketch
+
+    @property
+    def count(self) -> int:
+        return int(self.zero_count + self.counts.sum())
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+
+        small = values < self.MIN_VALUE
+        self.zero_count += int(np.count_nonzero(small))
+        values = np.minimum(values[~small], self.MAX_VALUE)
+        if values.size == 0:
+            self.max = max(self.max, 0.0)
+            return
+
+        idx = np.ceil(np.log(values) / self._log_gamma).astype(np.int64) - self._offset
+        self.counts += np.bincount(idx, minlength=self.counts.size)
+        self.max = max(self.max, float(values.max()))
+
+    def add_prometheus(self, buckets: PodsTimeData, maxes: PodsTimeData) -> None:
+        """
+        Add a sketch built server side: `buckets` is a CPUSketchLoader
+        result ("<pod>|<bucket>" -> sample count) and `maxes` the matching
+        PodMaxCPULoader result.
+        """
+        if buckets:
+            # bucket is ceil(log_gamma(value)), -Inf for values below MIN_VALUE
+            # and NaN for NaN samples, which add() drops
+            k = np.array([key.rpartition(BUCKET_SEPARATOR)[2] for key in buckets], dtype=np.float64)
+            sample_counts = np.array([values[0, 1] for values in buckets.values()])
+            keep = ~np.isnan(k)
+            k, sample_counts = k[keep], sample_counts[keep]
+            zero = np.isinf(k)
+            self.zero_count += int(sample_counts[zero].sum())
+            idx = np.clip(k[~zero].astype(np.int64) - self._offset, 0, self.counts.size - 1)
+            self.counts += np.bincount(
+                idx, weights=sample_counts[~zero], minlength=self.counts.size
+            ).astype(np.int64)
+
+        # max_over_time skips NaN samples unless there are only NaN samples
+        for values in maxes.values():
+            value = float(values[0, 1])
+            if not math.isnan(value):
+                self.max = max(self.max, 0.0 if value < self.MIN_VALUE else min(value, self.MAX_VALUE))
+
+    def merge(self, other: "CPUQuantileSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("cannot merge sketches with different relative_accuracy")
+        self.counts += other.counts
+        self.zero_count += other.zero_count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, percentile: float) -> float:
+        n = self.count
+        if n == 0:
+            return float("NaN")
+
+        rank = max(1, math.ceil(percentile / 100 * n))
+        if rank <= self.zero_count:
+            return 0.0
+
+        i = int(np.searchsorted(np.cumsum(self.counts), rank - self.zero_count))
+        # bucket k holds (gamma^(k-1), gamma^k]; this midpoint is within
+        # relative_accuracy of every value in it
+        k = i + self._offset
+        estimate = 2 * self.gamma**k / (self.gamma + 1)
+        return min(estimate, self.max)
+
+
+# Series of CPUSketchLoader are keyed "<pod>|<bucket>", one per pod and bucket
+BUCKET_SEPARATOR = "|"
+
+
+def cpu_usage_query(
+    namespace: str, pods_selector: str, container: str, step: str, cluster_label: str = ""
+) -> str:
+    """Per-pod CPU usage, the series krr's CPULoader downloads as a range query."""
+    return f"""
+        max(
+            rate(
+                container_cpu_usage_seconds_total{{
+                    namespace="{namespace}",
+                    pod=~"{pods_selector}",
+                    container="{container}"
+                    {cluster_label}
+                }}[{step}]
+            )
+        ) by (container, pod, job)
+    """
+
+
+def cpu_sketch_query(usage: str, relative_accuracy: float, duration: str, step: str) -> str:
+    """
+    CPUQuantileSketch buckets computed by Prometheus: for every pod, how many
+    samples of `usage` over the window fell into each bucket. Values below
+    MIN_VALUE are sent to ln(0) = -Inf (the zero count), like add() does.
+    """
+    sketch = CPUQuantileSketch(relative_accuracy)
+    return f"""
+        label_join(
+            sum_over_time(
+                count_values by (container, pod, job) (
+                    "bucket",
+                    ceil(
+                        ln(clamp_max({usage}, {sketch.MAX_VALUE!r}) >= {sketch.MIN_VALUE!r} or {usage} * 0)
+                        / {sketch._log_gamma!r}
+                    )
+                )[{duration}:{step}]
+            ),
+            "pod", "{BUCKET_SEPARATOR}", "pod", "bucket"
+        )
+    """
+
+
+def cpu_max_query(usage: str, duration: str, step: str) -> str:
+    """Peak of `usage` per pod over the window, the sketch's max."""
+    return f"""
+        max_over_time(
+            {usage}
+            [{duration}:{step}]
+        )
+    """
+
+
+def _object_cpu_usage(metric: PrometheusMetric, object: K8sObjectData, step: str) -> str:
+    pods_selector = "|".join(pod.name for pod in object.pods)
+    return cpu_usage_query(
+        object.namespace,
+        pods_selector,
+        object.container,
+        step,
+        metric.get_prometheus_cluster_label(),
+    )
+
+
+class PodMaxCPULoader(PrometheusMetric):
+    """Peak CPU usage of each pod over the history, one point per pod."""
+
+    def get_query(self, object: K8sObjectData, duration: str, step: str) -> str:
+        return cpu_max_query(_object_cpu_usage(self, object, step), duration, step)
+
+
+@functools.lru_cache
+def CPUSketchLoader(relative_accuracy: float) -> type[PrometheusMetric]:
+    """
+    Loader for the CPU sketch buckets (see cpu_sketch_query): a few dozen
+    series with one point each per pod, instead of every usage sample.
+    """
+
+    class CPUSketchLoader(PrometheusMetric):
+        def get_query(self, object: K8sObjectData, duration: str, step: str) -> str:
+            return cpu_sketch_query(
+                _object_cpu_usage(self, object, step), relative_accuracy, duration, step
+            )
+
+    # The class name is the key in history_data, so it has to carry the accuracy
+    CPUSketchLoader.__name__ = f"CPUSketchLoader_{relative_accuracy}"
+    return CPUSketchLoader
+
+
 # Providing description to the settings will make it available in the CLI help
 class CustomStrategySettings(StrategySettings):
     pcpu_percentile: float = pd.Field(
@@ -48,6 +269,36 @@ class CustomStrategySettings(StrategySettings):
         ge=0,
         description="What percentage to increase the memory when there are OOMKill events.",
     )
+    cpu_sketch_relative_accuracy: float = pd.Field(
+        0.01,
+        ge=0,
+        lt=1,
+        description="Relative error of the mergeable CPU percentile sketch. 0 computes the exact percentile instead (memory grows with history).",
+    )
+    cpu_prometheus_sketch: bool = pd.Field(
+        True,
+        description="Build the CPU sketch in Prometheus (sample count per bucket and max per pod) instead of downloading every CPU usage sample. Ignored when cpu_sketch_relative_accuracy is 0.",
+    )
+
+    result_cache_dir: Optional[str] = pd.Field(
+        None,
+        description="Directory (e.g. on the /data PVC) for per-workload partial aggregates. When set, each run only queries samples newer than the last run and merges them with the cached ones inside the history window (the full window when those do not reach back to its start). Needs the Prometheus CPU sketch.",
+    )
+
+    profile_path: Optional[str] = pd.Field(
+        None,
+        description="Record wall time, samples and bytes per object and phase (Prometheus queries, CPU/memory proposal, OOM lookup) and write them as JSON to this path (e.g. /data/krr.profile.json) plus OpenMetrics text next to it (.prom).",
+    )
+
+    @property
+    def prometheus_sketch(self) -> bool:
+        return self.cpu_prometheus_sketch and self.cpu_sketch_relative_accuracy > 0
+
+    @property
+    def cpu_loaders(self) -> list[type[PrometheusMetric]]:
+        if self.prometheus_sketch:
+            return [CPUSketchLoader(self.cpu_sketch_relative_accuracy), PodMaxCPULoader]
+        return [CPULoader]
 
     def calculate_memory_proposal(
         self, data: PodsTimeData, max_oomkill: float = 0
@@ -65,18 +316,406 @@ class CustomStrategySettings(StrategySettings):
         if len(data) == 0:
             return float("NaN")
 
-        if len(data) > 1:
-            data_ = np.concatenate([values[:, 1] for values in data.values()])
-        else:
-            data_ = list(data.values())[0][:, 1]
+        if self.cpu_sketch_relative_accuracy == 0:
+            return exact_cpu_percentile(data, self.pcpu_percentile)
+
+        # One sketch per pod, merged: memory stays bounded by the sketch size
+        # instead of concatenating every pod's samples into one array
+        sketch = CPUQuantileSketch(self.cpu_sketch_relative_accuracy)
+        for values in data.values():
+            sketch.merge(
+                CPUQuantileSketch.from_values(values[:, 1], self.cpu_sketch_relative_accuracy)
+            )
+        return sketch.quantile(self.pcpu_percentile)
 
-        return np.max(data_)
+    def calculate_cpu_proposal_from_prometheus(
+        self, buckets: PodsTimeData, maxes: PodsTimeData
+    ) -> float:
+        """calculate_cpu_proposal from the CPUSketchLoader and PodMaxCPULoader results."""
+        sketch = CPUQuantileSketch(self.cpu_sketch_relative_accuracy)
+        sketch.add_prometheus(buckets, maxes)
+        return sketch.quantile(self.pcpu_percentile)
 
     def history_range_enough(self, history_range: tuple[timedelta, timedelta]) -> bool:
         start, end = history_range
         return (end - start) >= timedelta(hours=3)
 
 
+def exact_cpu_percentile(data: PodsTimeData, percentile: float) -> float:
+    if len(data) > 1:
+        data_ = np.concatenate([values[:, 1] for values in data.values()])
+    else:
+        data_ = list(data.values())[0][:, 1]
+
+    return float(np.percentile(data_, percentile, method="inverted_cdf"))
+
+
+class ResultCache:
+    """
+    Per-workload partial aggregates kept between krr runs, one JSON file per
+    (cluster, namespace, kind, name, container) under `directory`.
+
+    Every run adds one slice holding the CPU sketch buckets, peak CPU and
+    memory, OOMKill max and point counts of the samples since the previous
+    run (the watermark). Only slices that lie entirely inside the history
+    window are kept, so merged slices never cover more than the window.
+    When the kept slices do not reach back to the window start (first runs,
+    or a boundary shifted by a manual run) the run gets the full window from
+    Prometheus instead, and the samples since the watermark are queried
+    separately just to extend the slices.
+    """
+
+    VERSION = 1
+    # Runs drift by seconds to minutes; slice boundaries this close to the
+    # window start count as on it
+    EXPIRY_SLACK = 3600
+
+    def __init__(self, directory: str, window: timedelta, cpu_sketch_loader: str):
+        self.directory = Path(directory)
+        self.window = window.total_seconds()
+        self.cpu_sketch_loader = cpu_sketch_loader
+        # Query time of the running fetch per workload, recorded by the loaders
+        # and consumed by update() as the new watermark
+        self._fetched_at: dict[tuple, float] = {}
+        # Samples since the watermark per workload and loader, from "refill" runs
+        self._increments: dict[tuple, MetricsPodData] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(object: K8sObjectData) -> tuple:
+        return (
+            getattr(object, "cluster", None),
+            object.namespace,
+            object.kind,
+            object.name,
+            object.container,
+        )
+
+    def _path(self, key: tuple) -> Path:
+        digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32]
+        return self.directory / f"{digest}.json"
+
+    def load(self, key: tuple) -> Optional[dict]:
+        try:
+            state = json.loads(self._path(key).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"WARNING: ignoring unreadable result cache for {key}: {e}", file=sys.stderr)
+            return None
+        if (
+            state.get("version") != self.VERSION
+            or state.get("cpu_sketch_loader") != self.cpu_sketch_loader
+        ):
+            return None
+        return state
+
+    def save(self, key: tuple, state: dict) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(state, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def plan(self, state: Optional[dict], now: float) -> tuple[str, list[dict]]:
+        """
+        How to fetch a workload with cached `state` at `now`, and the cached
+        slices still inside the window:
+
+        - "full": no usable state, query the full window and start over
+        - "incremental": the slices reach back to the window start, query
+          only the samples since the watermark
+        - "refill": query the full window for this run, plus the samples
+          since the watermark to extend the slices
+        """
+        if state is None or now - state["watermark"] >= self.window:
+            return "full", []
+        start = now - self.window
+        slices = [slice_ for slice_ in state["slices"] if slice_["start"] >= start - self.EXPIRY_SLACK]
+        if slices and slices[0]["start"] <= start + self.EXPIRY_SLACK:
+            return "incremental", slices
+        return "refill", slices
+
+    def durations(self, object: K8sObjectData) -> tuple[str, Optional[str]]:
+        """
+        Query durations for `object`: the one run() gets ("" for krr's full
+        window) and the one only kept for the cache (None when not needed).
+        """
+        key = self.key(object)
+        with self._lock:
+            now = self._fetched_at.setdefault(key, time.time())
+        state = self.load(key)
+        mode, _ = self.plan(state, now)
+        if mode == "full":
+            return "", None
+        since = f"{max(60, math.ceil(now - state['watermark']))}s"
+        return (since, None) if mode == "incremental" else ("", since)
+
+    def record_increment(self, object: K8sObjectData, loader: str, data: PodsTimeData) -> None:
+        """Keep a "refill" run's samples since the watermark for update()."""
+        with self._lock:
+            self._increments.setdefault(self.key(object), {})[loader] = data
+
+    def update(self, history_data: MetricsPodData, object_data: K8sObjectData) -> MetricsPodData:
+        """
+        Fold the freshly fetched `history_data` into the workload's cached
+        slices and return history in the same shape covering the whole window.
+        """
+        key = self.key(object_data)
+        with self._lock:
+            now = self._fetched_at.pop(key, None) or time.time()
+            increment = self._increments.pop(key, {})
+        state = self.load(key)
+        mode, slices = self.plan(state, now)
+        if mode == "incremental":
+            slices.append({"start": state["watermark"], "end": now, **self.summarize(history_data)})
+        elif mode == "refill" and {self.cpu_sketch_loader, "MaxMemoryLoader"} <= increment.keys():
+            slices.append({"start": state["watermark"], "end": now, **self.summarize(increment)})
+        else:
+            slices = []
+
+        try:
+            self.save(
+                key,
+                {
+                    "version": self.VERSION,
+                    "key": list(key),
+                    "cpu_sketch_loader": self.cpu_sketch_loader,
+                    "watermark": now,
+                    "slices": slices,
+                },
+            )
+        except OSError as e:
+            print(f"WARNING: failed to write result cache for {key}: {e}", file=sys.stderr)
+        if mode == "incremental":
+            return self.merged_history(slices, history_data)
+        return history_data
+
+    def summarize(self, history_data: MetricsPodData) -> dict[str, Any]:
+        """Partial aggregates of one fetch; None where the loader returned nothing."""
+
+        def first_points(name: str) -> Optional[np.ndarray]:
+            data = history_data.get(name, {})
+            return np.array([values[0, 1] for values in data.values()]) if data else None
+
+        buckets: dict[str, int] = {}
+        for pod, values in history_data[self.cpu_sketch_loader].items():
+            label = pod.rpartition(BUCKET_SEPARATOR)[2]
+            buckets[label] = buckets.get(label, 0) + int(values[0, 1])
+
+        memory = history_data["MaxMemoryLoader"]
+        cpu_max = first_points(PodMaxCPULoader.__name__)
+        cpu_points = first_points("CPUAmountLoader")
+        memory_points = first_points("MemoryAmountLoader")
+        oom = first_points("MaxOOMKilledMemoryLoader")
+        return {
+            "cpu_buckets": buckets or None,
+            "cpu_max": float(np.fmax.reduce(cpu_max)) if cpu_max is not None else None,
+            "memory_max": (
+                float(np.max([np.max(values[:, 1]) for values in memory.values()]))
+                if memory
+                else None
+            ),
+            "cpu_points": float(cpu_points.sum()) if cpu_points is not None else None,
+            "memory_points": float(memory_points.sum()) if memory_points is not None else None,
+            "oom_max": float(np.max(oom)) if oom is not None else None,
+        }
+
+    def merged_history(self, slices: list[dict], history_data: MetricsPodData) -> MetricsPodData:
+        """
+        History data for run(): the slices merged into a single "cached"
+        pod per loader, in the same one-point-per-pod shape the loaders
+        return, so the proposal code does not change.
+        """
+
+        def point(value: float) -> np.ndarray:
+            return np.array([[0.0, value]])
+
+        def merged(field: str, reduce) -> dict[str, np.ndarray]:
+            values = [slice_[field] for slice_ in slices if slice_[field] is not None]
+            return {"cached": point(reduce(values))} if values else {}
+
+        buckets: dict[str, int] = {}
+        for slice_ in slices:
+            for label, count in (slice_["cpu_buckets"] or {}).items():
+                buckets[label] = buckets.get(label, 0) + count
+
+        merged_data = dict(history_data)
+        merged_data[self.cpu_sketch_loader] = {
+            f"cached{BUCKET_SEPARATOR}{label}": point(count) for label, count in buckets.items()
+        }
+        merged_data[PodMaxCPULoader.__name__] = merged("cpu_max", np.fmax.reduce)
+        merged_data["MaxMemoryLoader"] = merged("memory_max", max)
+        merged_data["CPUAmountLoader"] = merged("cpu_points", sum)
+        merged_data["MemoryAmountLoader"] = merged("memory_points", sum)
+        if "MaxOOMKilledMemoryLoader" in history_data:
+            merged_data["MaxOOMKilledMemoryLoader"] = merged("oom_max", max)
+        return merged_data
+
+
+# Query duration an IncrementalLoader picked for the running load_data ("" for
+# krr's own), also set for the per-pod-batch load_data calls krr makes inside it
+_incremental_duration = contextvars.ContextVar("incremental_duration", default=None)
+
+
+@functools.lru_cache
+def IncrementalLoader(loader: type[PrometheusMetric], cache: ResultCache) -> type[PrometheusMetric]:
+    """`loader` querying only the samples the workload's cached slices lack."""
+
+    class IncrementalLoader(loader):
+        async def load_data(self, object: K8sObjectData, *args, **kwargs) -> PodsTimeData:
+            if _incremental_duration.get() is not None:
+                return await super().load_data(object, *args, **kwargs)
+            duration, increment = cache.durations(object)
+            token = _incremental_duration.set(duration)
+            try:
+                data = await super().load_data(object, *args, **kwargs)
+            finally:
+                _incremental_duration.reset(token)
+            if increment is not None:
+                token = _incremental_duration.set(increment)
+                try:
+                    cache.record_increment(
+                        object, loader.__name__, await super().load_data(object, *args, **kwargs)
+                    )
+                finally:
+                    _incremental_duration.reset(token)
+            return data
+
+        def get_query(self, object: K8sObjectData, duration: str, step: str) -> str:
+            return super().get_query(object, _incremental_duration.get() or duration, step)
+
+    # Keep the history_data key of the wrapped loader
+    IncrementalLoader.__name__ = loader.__name__
+    return IncrementalLoader
+
+
+class StrategyProfiler:
+    """
+    Per-object, per-phase wall time, sample count and bytes of the strategy,
+    written once at exit as JSON to `path` and as OpenMetrics text to the
+    same path with a .prom suffix.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        # (cluster, namespace, kind, name, container) -> phase -> [seconds, samples, bytes]
+        self.records: dict[tuple, dict[str, list]] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.write)
+
+    @staticmethod
+    def size(*data: PodsTimeData) -> tuple[int, int]:
+        """Samples and bytes of the loader results."""
+        samples = sum(values.shape[0] for pods in data for values in pods.values())
+        nbytes = sum(values.nbytes for pods in data for values in pods.values())
+        return samples, nbytes
+
+    def record(
+        self, object: K8sObjectData, phase: str, seconds: float, samples: int, nbytes: int
+    ) -> None:
+        with self._lock:
+            totals = self.records.setdefault(ResultCache.key(object), {}).setdefault(
+                phase, [0.0, 0, 0]
+            )
+            totals[0] += seconds
+            totals[1] += samples
+            totals[2] += nbytes
+
+    def write(self) -> None:
+        with self._lock:
+            records = sorted(self.records.items(), key=lambda item: [str(k) for k in item[0]])
+        keys = ("cluster", "namespace", "kind", "name", "container")
+        phases: dict[str, list] = {}
+        objects = []
+        for key, by_phase in records:
+            objects.append(
+                {
+                    **dict(zip(keys, key)),
+                    "phases": {
+                        phase: {"seconds": v[0], "samples": v[1], "bytes": v[2]}
+                        for phase, v in sorted(by_phase.items())
+                    },
+                }
+            )
+            for phase, v in by_phase.items():
+                total = phases.setdefault(phase, [0.0, 0, 0])
+                for i in range(3):
+                    total[i] += v[i]
+        payload = {
+            "objects": objects,
+            "totals": {
+                phase: {"seconds": v[0], "samples": v[1], "bytes": v[2]}
+                for phase, v in sorted(phases.items())
+            },
+        }
+
+        lines = []
+        for i, (name, unit, help_) in enumerate(
+            (
+                ("krr_strategy_phase_seconds", "seconds", "Wall time per object and strategy phase."),
+                ("krr_strategy_phase_samples", "", "Samples processed per object and strategy phase."),
+                ("krr_strategy_phase_bytes", "bytes", "Bytes processed per object and strategy phase."),
+            )
+        ):
+            lines.append(f"# TYPE {name} gauge")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help_}")
+            for key, by_phase in records:
+                labels = ",".join(
+                    f'{label}="{_openmetrics_escape(str(value))}"'
+                    for label, value in zip(keys, key)
+                    if value is not None
+                )
+                for phase, v in sorted(by_phase.items()):
+                    lines.append(f'{name}{{{labels},phase="{phase}"}} {v[i]}')
+        lines.append("# EOF")
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            for path, text in (
+                (self.path, json.dumps(payload, indent=2)),
+                (self.path.with_suffix(".prom"), "\n".join(lines) + "\n"),
+            ):
+                tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+                tmp.write_text(text, encoding="utf-8")
+                os.replace(tmp, path)
+        except OSError as e:
+            print(f"WARNING: failed to write strategy profile {self.path}: {e}", file=sys.stderr)
+
+
+def _openmetrics_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Set while a ProfiledLoader query runs, so the per-pod-batch load_data calls
+# krr makes from inside it are not counted twice
+_profiled_query = contextvars.ContextVar("profiled_query", default=False)
+
+
+@functools.lru_cache
+def ProfiledLoader(loader: type[PrometheusMetric], profiler: StrategyProfiler) -> type[PrometheusMetric]:
+    """`loader` recording its Prometheus query time and result size as a query phase."""
+
+    class ProfiledLoader(loader):
+        async def load_data(self, object: K8sObjectData, *args, **kwargs) -> PodsTimeData:
+            if _profiled_query.get():
+                return await super().load_data(object, *args, **kwargs)
+            token = _profiled_query.set(True)
+            try:
+                t0 = time.perf_counter()
+                data = await super().load_data(object, *args, **kwargs)
+                seconds = time.perf_counter() - t0
+            finally:
+                _profiled_query.reset(token)
+            profiler.record(object, f"query:{loader.__name__}", seconds, *profiler.size(data))
+            return data
+
+    ProfiledLoader.__name__ = loader.__name__
+    return ProfiledLoader
+
+
 class CustomStrategy(BaseStrategy[CustomStrategySettings]):
     """
     A custom strategy based off the simple default that tweaks the
@@ -88,7 +727,7 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
     @property
     def metrics(self) -> list[type[PrometheusMetric]]:
         metrics = [
-            PercentileCPULoader(self.settings.cpu_percentile),
+            *self.settings.cpu_loaders,
             MaxMemoryLoader,
             CPUAmountLoader,
             MemoryAmountLoader,
@@ -97,18 +736,41 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
         if self.settings.use_oomkill_data:
             metrics.append(MaxOOMKilledMemoryLoader)
 
+        if self.result_cache is not None:
+            metrics = [IncrementalLoader(loader, self.result_cache) for loader in metrics]
+        if self.profiler is not None:
+            metrics = [ProfiledLoader(loader, self.profiler) for loader in metrics]
+
         return metrics
 
+    @functools.cached_property
+    def profiler(self) -> Optional[StrategyProfiler]:
+        if self.settings.profile_path is None:
+            return None
+        return StrategyProfiler(self.settings.profile_path)
+
+    @functools.cached_property
+    def result_cache(self) -> Optional[ResultCache]:
+        if self.settings.result_cache_dir is None:
+            return None
+        if not self.settings.prometheus_sketch:
+            raise ValueError("result_cache_dir needs the Prometheus CPU sketch (cpu_prometheus_sketch)")
+        return ResultCache(
+            self.settings.result_cache_dir,
+            self.settings.history_timedelta,
+            self.settings.cpu_loaders[0].__name__,
+        )
+
     @property
     def description(self):
         s = textwrap.dedent(
             f"""\
-            CPU request: {self.settings.cpu_percentile}% percentile, limit: unset
+            CPU request: {self.settings.pcpu_percentile}% percentile (sketch accuracy: {self.settings.cpu_sketch_relative_accuracy:.0%}, built in Prometheus: {self.settings.prometheus_sketch}), limit: unset
             Memory request: max + {self.settings.memory_buffer_percentage}%, limit: max + {self.settings.memory_buffer_percentage}%
             History: {self.settings.history_duration} hours
             Step: {self.settings.timeframe_duration} minutes
 
-            All parameters can be customized. For example: `krr simple --cpu_percentile=90 --memory_buffer_percentage=15 --history_duration=24 --timeframe_duration=0.5`
+            All parameters can be customized. For example: `krr simple --pcpu_percentile=90 --memory_buffer_percentage=15 --history_duration=24 --timeframe_duration=0.5`
             """
         )
 
@@ -127,7 +789,7 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
     def __calculate_cpu_proposal(
         self, history_data: MetricsPodData, object_data: K8sObjectData
     ) -> ResourceRecommendation:
-        data = history_data["PercentileCPULoader"]
+        data = history_data[self.settings.cpu_loaders[0].__name__]
 
         if len(data) == 0:
             return ResourceRecommendation.undefined(info="No data")
@@ -150,30 +812,39 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
         ):
             return ResourceRecommendation.undefined(info="HPA detected")
 
-        cpu_usage = self.settings.calculate_cpu_proposal(data)
+        if self.settings.prometheus_sketch:
+            cpu_usage = self.settings.calculate_cpu_proposal_from_prometheus(
+                data, history_data[PodMaxCPULoader.__name__]
+            )
+        else:
+            cpu_usage = self.settings.calculate_cpu_proposal(data)
         return ResourceRecommendation(request=cpu_usage, limit=None)
 
+    def __max_oomkill(self, history_data: MetricsPodData) -> float:
+        if not self.settings.use_oomkill_data:
+            return 0
+
+        max_oomkill_data = history_data["MaxOOMKilledMemoryLoader"]
+        # NOTE: metrics for each pod are returned as list[values] where values is [timestamp, value]
+        # As MaxOOMKilledMemoryLoader returns only the last value (1 point), [0, 1] is used to get the value
+        # So each value is numpy array of shape (N, 2)
+        return (
+            np.max([values[0, 1] for values in max_oomkill_data.values()])
+            if len(max_oomkill_data) > 0
+            else 0
+        )
+
     def __calculate_memory_proposal(
-        self, history_data: MetricsPodData, object_data: K8sObjectData
+        self,
+        history_data: MetricsPodData,
+        object_data: K8sObjectData,
+        max_oomkill_value: Optional[float] = None,
     ) -> ResourceRecommendation:
         data = history_data["MaxMemoryLoader"]
 
-        oomkill_detected = False
-
-        if self.settings.use_oomkill_data:
-            max_oomkill_data = history_data["MaxOOMKilledMemoryLoader"]
-            # NOTE: metrics for each pod are returned as list[values] where values is [timestamp, value]
-            # As MaxOOMKilledMemoryLoader returns only the last value (1 point), [0, 1] is used to get the value
-            # So each value is numpy array of shape (N, 2)
-            max_oomkill_value = (
-                np.max([values[0, 1] for values in max_oomkill_data.values()])
-                if len(max_oomkill_data) > 0
-                else 0
-            )
-            if max_oomkill_value != 0:
-                oomkill_detected = True
-        else:
-            max_oomkill_value = 0
+        if max_oomkill_value is None:
+            max_oomkill_value = self.__max_oomkill(history_data)
+        oomkill_detected = max_oomkill_value != 0
 
         if len(data) == 0:
             return ResourceRecommendation.undefined(info="No data")
@@ -207,6 +878,10 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
     def run(
         self, history_data: MetricsPodData, object_data: K8sObjectData
     ) -> RunResult:
+        if self.profiler is not None:
+            return self.__run_profiled(history_data, object_data)
+        if self.result_cache is not None:
+            history_data = self.result_cache.update(history_data, object_data)
         return {
             ResourceType.CPU: self.__calculate_cpu_proposal(history_data, object_data),
             ResourceType.Memory: self.__calculate_memory_proposal(
@@ -214,8 +889,137 @@ class CustomStrategy(BaseStrategy[CustomStrategySettings]):
             ),
         }
 
+    def __run_profiled(
+        self, history_data: MetricsPodData, object_data: K8sObjectData
+    ) -> RunResult:
+        profiler = self.profiler
+        if self.result_cache is not None:
+            t0 = time.perf_counter()
+            history_data = self.result_cache.update(history_data, object_data)
+            profiler.record(object_data, "result_cache", time.perf_counter() - t0, 0, 0)
+
+        t0 = time.perf_counter()
+        cpu = self.__calculate_cpu_proposal(history_data, object_data)
+        cpu_data = [
+            history_data[name]
+            for name in (*(loader.__name__ for loader in self.settings.cpu_loaders), "CPUAmountLoader")
+        ]
+        profiler.record(
+            object_data, "cpu_proposal", time.perf_counter() - t0, *profiler.size(*cpu_data)
+        )
+
+        t0 = time.perf_counter()
+        max_oomkill_value = self.__max_oomkill(history_data)
+        oom_data = history_data.get("MaxOOMKilledMemoryLoader", {}) if self.settings.use_oomkill_data else {}
+        profiler.record(
+            object_data, "oom_lookup", time.perf_counter() - t0, *profiler.size(oom_data)
+        )
+
+        t0 = time.perf_counter()
+        memory = self.__calculate_memory_proposal(history_data, object_data, max_oomkill_value)
+        profiler.record(
+            object_data,
+            "memory_proposal",
+            time.perf_counter() - t0,
+            *profiler.size(history_data["MaxMemoryLoader"], history_data["MemoryAmountLoader"]),
+        )
+        return {ResourceType.CPU: cpu, ResourceType.Memory: memory}
+
+
+def benchmark_cpu_sketch(
+    pods: int = 10, points_per_pod: int = 200_000, percentile: float = 95
+) -> None:
+    """Compare the CPU sketch with the exact percentile on synthetic usage data."""
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(pods):
+        values = rng.lognormal(mean=-3, sigma=1.0, size=points_per_pod)
+        values[rng.random(points_per_pod) < 0.05] = 0  # idle samples
+        data[f"pod-{i}"] = np.column_stack([np.arange(points_per_pod, dtype=float), values])
+
+    t0 = time.perf_counter()
+    exact = exact_cpu_percentile(data, percentile)
+    exact_s = time.perf_counter() - t0
+    print(f"{pods} pod(s) x {points_per_pod} point(s), p{percentile:g}")
+    print(f"  exact        : {exact:.6f} cores in {exact_s:.3f}s")
+
+    for accuracy in (0.05, 0.01, 0.005):
+        settings = CustomStrategySettings(pcpu_percentile=percentile, cpu_sketch_relative_accuracy=accuracy)
+        t0 = time.perf_counter()
+        approx = settings.calculate_cpu_proposal(data)
+        took = time.perf_counter() - t0
+        err = abs(approx - exact) / exact
+        buckets = CPUQuantileSketch(accuracy).counts.size
+        print(
+            f"  sketch {accuracy:<6g}: {approx:.6f} cores in {took:.3f}s, "
+            f"relative error {err:.4%} (bound {accuracy:.2%}), {buckets} bucket(s)"
+        )
+
+
+def _prometheus_get(url: str, path: str, params: dict) -> tuple[list, int]:
+    query = urllib.parse.urlencode(params)
+    with urllib.request.urlopen(f"{url.rstrip('/')}{path}?{query}") as resp:
+        body = resp.read()
+    return json.loads(body)["data"]["result"], len(body)
+
+
+def compare_prometheus(
+    url: str,
+    namespace: str,
+    pods_selector: str,
+    container: str,
+    history_hours: float = 336,
+    step_minutes: float = 1.25,
+    percentile: float = 95,
+) -> None:
+    """
+    Compute one container's CPU proposal from the raw usage series and from
+    the sketch built in Prometheus, and compare payload size and time. Works
+    against any Prometheus-compatible HTTP API, a recorded or fake one too.
+    """
+    duration = f"{round(history_hours * 3600)}s"
+    step = f"{round(step_minutes * 60)}s"
+    usage = cpu_usage_query(namespace, pods_selector, container, step)
+    settings = CustomStrategySettings(pcpu_percentile=percentile)
+    end = time.time()
+
+    t0 = time.perf_counter()
+    result, raw_bytes = _prometheus_get(
+        url,
+        "/api/v1/query_range",
+        {"query": usage, "start": end - history_hours * 3600, "end": end, "step": step},
+    )
+    raw = {r["metric"]["pod"]: np.array(r["values"], dtype=np.float64) for r in result}
+    raw_cpu = settings.calculate_cpu_proposal(raw)
+    raw_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    server = []
+    server_bytes = 0
+    for query in (
+        cpu_sketch_query(usage, settings.cpu_sketch_relative_accuracy, duration, step),
+        cpu_max_query(usage, duration, step),
+    ):
+        result, size = _prometheus_get(url, "/api/v1/query", {"query": query, "time": end})
+        server.append({r["metric"]["pod"]: np.array([r["value"]], dtype=np.float64) for r in result})
+        server_bytes += size
+    server_cpu = settings.calculate_cpu_proposal_from_prometheus(*server)
+    server_s = time.perf_counter() - t0
+
+    samples = sum(values.shape[0] for values in raw.values())
+    print(f"{namespace}/{pods_selector}/{container}: {len(raw)} pod(s), {samples} sample(s), p{percentile:g}")
+    print(f"  raw series       : {raw_cpu:.6f} cores, {raw_bytes} byte(s) in {raw_s:.3f}s")
+    print(f"  prometheus sketch: {server_cpu:.6f} cores, {server_bytes} byte(s) in {server_s:.3f}s")
+
 
 # Running this file will register the strategy and make it available to the CLI
 # Run it as `python ./custom_strategy.py my_strategy`
+# `python ./custom_strategy.py benchmark-cpu-sketch` runs benchmark_cpu_sketch instead
+# `python ./custom_strategy.py compare-prometheus URL NAMESPACE POD_REGEX CONTAINER` runs compare_prometheus
 if __name__ == "__main__":
-    robusta_krr.run()
+    if sys.argv[1:2] == ["benchmark-cpu-sketch"]:
+        benchmark_cpu_sketch()
+    elif sys.argv[1:2] == ["compare-prometheus"]:
+        compare_prometheus(*sys.argv[2:6])
+    else:
+        robusta_krr.run()
@@ -0,0 +1,167 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Usage:
+#   allocator = ASNAllocator.Allocator(Path("barcodes"))
+#   start, end = allocator.allocate(1, 189)
+#   try:
+#       ...render start..end...
+#   except BaseException:
+#       allocator.finish(1, start, end, ok=False)
+#       raise
+#   allocator.finish(1, start, end)
+#
+# Hands out blocks of ASNs from the 100000-number ranges (range 01 is
+# 0100000-0199999, ...), so concurrent generators never print the same
+# ASN twice.
+#
+# state.json keeps the last ASN issued per two-digit range key, so the next
+# free block is a single lookup. Every change happens under an exclusive
+# flock on state.lock and goes to two files:
+#   journal.jsonl  append-only, one line per reservation and per outcome,
+#                  fsynced before state.json is touched
+#   state.json     rewritten to a temp file and renamed over the old one
+# A crash can therefore only leave the journal's last line, a reservation,
+# ahead of state.json. Whoever takes the lock next reads that line from the
+# end of the file and catches state.json up before appending anything, so
+# the block is never issued again.
+#
+# Blocks are reserved before rendering and never handed back: a failed
+# render leaves a gap in the numbering, recorded as "failed" in the journal.
+# Only state.json is committed; the journal is local (see .gitignore).
+
+RANGE_SIZE = 100_000
+
+
+class RangeExhausted(Exception):
+    pass
+
+
+class Allocator:
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.stateFile = self.directory / "state.json"
+        self.journalFile = self.directory / "journal.jsonl"
+        self.lockFile = self.directory / "state.lock"
+
+    @contextmanager
+    def locked(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.lockFile, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def loadState(self):
+        try:
+            with self.stateFile.open("r") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def saveState(self, state):
+        tmp_file = self.stateFile.with_name(f".{self.stateFile.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_file.open("w") as fh:
+                json.dump(state, fh, indent=2)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_file, self.stateFile)
+        finally:
+            if tmp_file.exists():
+                tmp_file.unlink()
+
+    # The journal's last complete line, read from the end of the file
+    def lastEntry(self):
+        try:
+            with self.journalFile.open("rb") as fh:
+                fh.seek(0, os.SEEK_END)
+                size = fh.tell()
+                fh.seek(max(0, size - 4096))
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            return None
+        for line in reversed(lines):
+            try:
+                return json.loads(line)
+            except ValueError:
+                # A line torn by a crash mid-append
+                continue
+        return None
+
+    def journal(self, **entry):
+        entry["time"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        entry["pid"] = os.getpid()
+        with self.journalFile.open("a+b") as fh:
+            # Start on a fresh line after a line torn by a crash mid-append
+            if fh.seek(0, os.SEEK_END):
+                fh.seek(-1, os.SEEK_END)
+                if fh.read(1) != b"\n":
+                    fh.write(b"\n")
+            fh.write(json.dumps(entry).encode() + b"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    # state.json with the journal's last reservation applied, saved if a
+    # crash left it behind. Called under the lock before every append, so
+    # only the last journal line can ever be ahead of state.json.
+    def recoveredState(self):
+        state = self.loadState()
+        entry = self.lastEntry()
+        if entry and entry.get("event") == "reserved":
+            key = entry["range"]
+            if state.get(key) is None or int(state[key]) < int(entry["end"]):
+                state[key] = int(entry["end"])
+                self.saveState(state)
+        return state
+
+    # First ASN not yet issued in range_id
+    def nextFree(self, range_id, state=None):
+        key = f"{int(range_id):02d}"
+        if state is None:
+            with self.locked():
+                state = self.recoveredState()
+        last = state.get(key)
+        return int(range_id) * RANGE_SIZE if last is None else int(last) + 1
+
+    # Reserves the next 'count' ASNs of range_id and returns (start, end),
+    # inclusive. 'count' may be a function of the first free ASN; it is
+    # called under the same lock, so the block it sizes is the one reserved.
+    # Raises RangeExhausted if the range cannot fit them.
+    def allocate(self, range_id, count):
+        key = f"{int(range_id):02d}"
+        with self.locked():
+            state = self.recoveredState()
+            start = self.nextFree(range_id, state)
+            if callable(count):
+                count = count(start)
+            if count < 1:
+                raise ValueError(f"Cannot allocate {count} ASNs")
+            end = start + count - 1
+            if end >= (int(range_id) + 1) * RANGE_SIZE:
+                raise RangeExhausted(
+                    f"Range {key} exhausted or insufficient space for {count} ASNs"
+                )
+            self.journal(event="reserved", range=key, start=start, end=end)
+            state[key] = end
+            self.saveState(state)
+        return start, end
+
+    # Records whether a reserved block was rendered; the block stays issued
+    # either way
+    def finish(self, range_id, start, end, ok=True):
+        with self.locked():
+            self.recoveredState()
+            self.journal(
+                event="rendered" if ok else "failed",
+                range=f"{int(range_id):02d}",
+                start=start,
+                end=end,
+            )
@@ -1,5 +1,9 @@
+import copy
 import os
+import shutil
+import tempfile
 from collections.abc import Iterator
+from itertools import islice
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import LETTER, A4, landscape
 from reportlab.lib.units import inch, mm, cm
@@ -15,6 +19,25 @@ from reportlab.pdfbase.ttfonts import TTFont
 # 'render' can either pass a callable, which receives the canvas object
 # (with X,Y=0,0 at the lower right) or a string "form" name of a form
 # previously created with canv.beginForm().
+#
+# Forms mode, for large sheets and multi-page runs:
+#   label = AveryLabels.AveryLabel(4731, forms=True, font=("Helvetica", 6),
+#                                  static=DrawStaticParts)
+# draws everything that is identical on every label (the debug frame and
+# the optional 'static' callback) once into a reportlab form placed with
+# doForm, selects 'font' once per page instead of once per label, and
+# emits whole pages at a time from precomputed label offsets. The render
+# callback then only draws the per-label content.
+#
+# Streaming mode, for runs too large to keep in memory:
+#   label = AveryLabels.AveryLabel(4731, stream=True, streamPages=50)
+# reportlab keeps every page of a canvas in memory until save(). Here the
+# canvas is saved to a temporary file every 'streamPages' pages and its
+# pages are copied into the output file right away (PdfPageStream, which
+# needs pypdf), so memory stays bounded by one batch whatever the label
+# count. Works with render and render_iterator, with or without forms.
+# Render with callables: a form made with canv.beginForm() only exists in
+# the batch it was made in (use forms mode's 'static' instead).
 
 
 # labels across
@@ -53,14 +76,47 @@ class AveryLabel:
         self.debug = False
         self.pagesize = A4  # Default of 'LETTER'
         self.position = 0
+        self.forms = False
+        self.font = None
+        self.static = None
+        self.stream = False
+        self.streamPages = 50
         self.__dict__.update(kwargs)
+        self.staticFormName = None
 
     def open(self, filename):
+        if self.stream:
+            self.output = PdfPageStream(filename)
+            self.batchDir = tempfile.mkdtemp(prefix="AveryLabel-")
+            self.batchFile = os.path.join(self.batchDir, "batch.pdf")
+            self.newCanvas(self.batchFile)
+        else:
+            self.newCanvas(filename)
+
+    def newCanvas(self, filename):
         self.canvas = canvas.Canvas(filename, pagesize=self.pagesize)
         if self.debug:
             self.canvas.setPageCompression(0)
         self.canvas.setLineJoin(1)
         self.canvas.setLineCap(1)
+        # Forms belong to the document they were drawn in
+        self.staticFormName = None
+        self.batchPages = 0
+
+    # Streaming mode: saves the current batch and moves its pages to the
+    # output file
+    def flushBatch(self):
+        self.canvas.save()
+        self.output.appendPdf(self.batchFile)
+        os.remove(self.batchFile)
+
+    def showPage(self):
+        self.canvas.showPage()
+        if self.stream:
+            self.batchPages += 1
+            if self.batchPages == self.streamPages:
+                self.flushBatch()
+                self.newCanvas(self.batchFile)
 
     def topLeft(self, x=None, y=None):
         if x == None:
@@ -79,13 +135,67 @@ class AveryLabel:
     def advance(self):
         self.position += 1
         if self.position == self.across * self.down:
-            self.canvas.showPage()
+            self.showPage()
             self.position = 0
 
+    # Forms mode: registers the static label parts as a form, once per
+    # document. Returns the form name, or None if there is nothing static.
+    def staticForm(self):
+        if self.staticFormName is None and (self.debug or self.static):
+            canv = self.canvas
+            w, h = self.size
+            # A little slack so the debug frame's line width is not clipped
+            canv.beginForm("AveryLabelStatic", -1, -1, w + 1, h + 1)
+            if self.debug:
+                canv.setLineWidth(0.25)
+                canv.rect(0, 0, w, h)
+            if self.static:
+                self.static(canv, w, h)
+            canv.endForm()
+            self.staticFormName = "AveryLabelStatic"
+        return self.staticFormName
+
+    # Forms mode: draws one label per item, a page at a time. 'draw'
+    # receives (canvas, width, height, item) for each label.
+    def renderPages(self, draw, items):
+        w, h = self.size
+        perPage = self.across * self.down
+        slots = [self.topLeft(i) for i in range(perPage)]
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, perPage - self.position))
+            if not chunk:
+                break
+            # Looked up per page: streaming mode starts a new canvas per batch
+            canv = self.canvas
+            form = self.staticForm()
+            # The page's graphics state carries the font into every label
+            if self.font:
+                canv.setFont(*self.font)
+            for (x, y), item in zip(slots[self.position :], chunk):
+                canv.saveState()
+                canv.translate(x, y)
+                if form:
+                    canv.doForm(form)
+                draw(canv, w, h, item)
+                canv.restoreState()
+            self.position += len(chunk)
+            if self.position == perPage:
+                self.showPage()
+                self.position = 0
+
     def close(self):
         if self.position:
             self.canvas.showPage()
-        self.canvas.save()
+            self.batchPages += 1
+            self.position = 0
+        if self.stream:
+            if self.batchPages:
+                self.flushBatch()
+            self.output.close()
+            shutil.rmtree(self.batchDir, ignore_errors=True)
+        else:
+            self.canvas.save()
         self.canvas = None
 
     # To render, you can either create a template and tell me
@@ -100,8 +210,15 @@ class AveryLabel:
         if isinstance(count, Iterator):
             return self.render_iterator(thing, count)
 
-        canv = self.canvas
+        if self.forms:
+            if callable(thing):
+                draw = lambda canv, w, h, _: thing(canv, w, h, *args)
+            else:
+                draw = lambda canv, w, h, _: canv.doForm(thing)
+            return self.renderPages(draw, range(count))
+
         for i in range(count):
+            canv = self.canvas
             canv.saveState()
             canv.translate(*self.topLeft())
             if self.debug:
@@ -115,8 +232,11 @@ class AveryLabel:
             self.advance()
 
     def render_iterator(self, func, iterator):
-        canv = self.canvas
+        if self.forms:
+            return self.renderPages(func, iterator)
+
         for chunk in iterator:
+            canv = self.canvas
             canv.saveState()
             canv.translate(*self.topLeft())
             if self.debug:
@@ -125,3 +245,100 @@ class AveryLabel:
             func(canv, self.size[0], self.size[1], chunk)
             canv.restoreState()
             self.advance()
+
+
+# Usage:
+#   out = AveryLabels.PdfPageStream("all.pdf")
+#   out.appendPdf("part1.pdf")
+#   out.appendPdf("part2.pdf")
+#   out.close()
+#
+# Concatenates PDFs page by page into 'filename', writing each page and the
+# objects it uses (content stream, fonts, forms) as soon as its source is
+# appended. Only the object offsets and the page list are kept for the
+# final xref and page tree, so memory does not grow with the page data.
+# Objects shared between pages are written once per source file.
+class PdfPageStream:
+
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.file.write(b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n")
+        self.offsets = [None]
+        self.pageNumbers = []
+        self.pagesNumber = self.newObject()
+
+    def newObject(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def writeObject(self, number, obj):
+        self.offsets[number] = self.file.tell()
+        self.file.write(b"%d 0 obj\n" % number)
+        obj.write_to_stream(self.file)
+        self.file.write(b"\nendobj\n")
+
+    def appendPdf(self, filename):
+        from pypdf import PdfReader
+        from pypdf.generic import (
+            ArrayObject,
+            DictionaryObject,
+            IndirectObject,
+            NameObject,
+        )
+
+        reader = PdfReader(filename)
+        numbers = {}
+        pending = []
+
+        # Copy of 'obj' with its references renumbered into this file;
+        # referenced objects are queued to be written after it
+        def renumber(obj):
+            if isinstance(obj, IndirectObject):
+                key = (obj.idnum, obj.generation)
+                if key not in numbers:
+                    numbers[key] = self.newObject()
+                    pending.append(obj)
+                return IndirectObject(numbers[key], 0, None)
+            if isinstance(obj, DictionaryObject):
+                new = copy.copy(obj)
+                for key, value in dict.items(obj):
+                    dict.__setitem__(new, key, renumber(value))
+                return new
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(renumber(value) for value in list.__iter__(obj))
+            return obj
+
+        for page in reader.pages:
+            raw = dict(dict.items(page))
+            raw.pop("/Parent", None)
+            new = renumber(DictionaryObject(raw))
+            new[NameObject("/Parent")] = IndirectObject(self.pagesNumber, 0, None)
+            number = self.newObject()
+            self.writeObject(number, new)
+            self.pageNumbers.append(number)
+            while pending:
+                ref = pending.pop()
+                self.writeObject(numbers[(ref.idnum, ref.generation)], renumber(ref.get_object()))
+
+    def close(self):
+        kids = " ".join("%d 0 R" % number for number in self.pageNumbers)
+        self.offsets[self.pagesNumber] = self.file.tell()
+        self.file.write(
+            b"%d 0 obj\n<< /Type /Pages /Kids [%s] /Count %d >>\nendobj\n"
+            % (self.pagesNumber, kids.encode(), len(self.pageNumbers))
+        )
+        catalog = self.newObject()
+        self.offsets[catalog] = self.file.tell()
+        self.file.write(
+            b"%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n"
+            % (catalog, self.pagesNumber)
+        )
+        xref = self.file.tell()
+        self.file.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets))
+        for offset in self.offsets[1:]:
+            self.file.write(b"%010d 00000 n \n" % offset)
+        self.file.write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(self.offsets), catalog, xref)
+        )
+        self.file.close()
@@ -3,20 +3,65 @@ import sys
 from pathlib import Path
 import argparse
 
+import ASNAllocator
 import AveryLabels
+import QRMatrix
 from reportlab.lib.units import mm, cm
 from reportlab_qrcode import QRCodeImage
 
 
-def render(c, x, y, barcode_value=None):
-    # If barcode_value provided, draw that; otherwise raise an error.
-    if barcode_value is None:
-        raise RuntimeError("render called without barcode_value")
+LABEL_FONT = ("Helvetica", 2 * mm)
 
-    # QR contains the full value (e.g. 'ASN0300000')
-    qr = QRCodeImage(barcode_value, size=y * 0.9)
-    qr.drawOn(c, 1 * mm, y * 0.05)
+# 'ASN' + 7 digits always fits QR version 1 (21x21 modules), which is what
+# QRCodeImage picks for it too, at qrcode's default error correction (M).
+# Pinning both keeps the codes identical to the ones printed so far, and the
+# function patterns at the same place on every label, so they can go in the
+# static form.
+QR_VERSION = 1
+QR_BORDER = 4  # QRCodeImage's default quiet zone, in modules
+QR_ENCODER = QRMatrix.Encoder(QR_VERSION)
+# Fails before anything is printed if QRMatrix no longer matches qrcode
+QR_ENCODER.check(["ASN0000000", "ASN0300000", "ASN1234567", "ASN9999999"])
+
+
+def qr_is_static(row, col, n):
+    # Finder patterns with their separators, the timing patterns and the
+    # always-dark module: identical in every QR code of the same version
+    return (
+        (row < 8 and (col < 8 or col >= n - 8))
+        or (row >= n - 8 and col < 8)
+        or row == 6
+        or col == 6
+        or (row, col) == (n - 8, 8)
+    )
 
+
+# qr_is_static as one bitmask per row, in QRMatrix's layout
+QR_STATIC_ROWS = [
+    sum(1 << col for col in range(n) if qr_is_static(row, col, n))
+    for n in [QR_ENCODER.size]
+    for row in range(n)
+]
+
+
+# Draws the dark modules in 'rows' (QRMatrix row bitmasks) with the same
+# geometry as QRCodeImage(size=size).drawOn(c, x, y), but as a single path:
+# one rectangle per horizontal run of dark modules, filled once, in module
+# units so the path operators stay short
+def draw_qr_rows(c, rows, size, x, y):
+    n = len(rows)
+    box = size / (n + 2 * QR_BORDER)
+    c.saveState()
+    c.translate(x + QR_BORDER * box, y + size - (n + QR_BORDER) * box)
+    c.scale(box, box)
+    p = c.beginPath()
+    for row, col, length in QRMatrix.runs(rows):
+        p.rect(col, n - 1 - row, length, 1)
+    c.drawPath(p, stroke=0, fill=1)
+    c.restoreState()
+
+
+def visible_text(barcode_value):
     # Visible text should be formatted as: 'ASN-<2digit range>-<last5>'
     # Expect barcode_value like 'ASN' + 7-digit number
     val = barcode_value
@@ -26,49 +71,186 @@ def render(c, x, y, barcode_value=None):
         num = num.zfill(7)[-7:]
         range_id = num[:2]
         tail = num[2:]
-        visible = f"ASN-{range_id}-{tail}"
-    else:
-        visible = barcode_value
+        return f"ASN-{range_id}-{tail}"
+    return barcode_value
+
+
+def render(c, x, y, barcode_value=None):
+    # If barcode_value provided, draw that; otherwise raise an error.
+    if barcode_value is None:
+        raise RuntimeError("render called without barcode_value")
+
+    # QR contains the full value (e.g. 'ASN0300000')
+    qr = QRCodeImage(barcode_value, size=y * 0.9)
+    qr.drawOn(c, 1 * mm, y * 0.05)
 
-    c.setFont("Helvetica", 2 * mm)
-    c.drawString(y, (y - 2 * mm) / 2, visible)
+    c.setFont(*LABEL_FONT)
+    c.drawString(y, (y - 2 * mm) / 2, visible_text(barcode_value))
 
 
-def main(start_asn: int):
-    count = 189
-    end_asn = start_asn + count - 1
+# The parts of render() that are the same on every label, drawn once into
+# AveryLabel's static form: the white background behind the QR code and
+# its function patterns
+def render_static(c, x, y):
+    size = y * 0.9
+    c.setFillColor("white")
+    c.rect(1 * mm, y * 0.05, size, size, stroke=0, fill=1)
+    c.setFillColor("black")
+    rows = QR_ENCODER.rows("ASN0000000")
+    static = [line & mask for line, mask in zip(rows, QR_STATIC_ROWS)]
+    draw_qr_rows(c, static, size, 1 * mm, y * 0.05)
 
-    # Determine 2-digit range identifier from start ASN (hundred-thousands)
-    range_id = start_asn // 100_000
-    range_key = f"{range_id:02d}"
 
-    res_dir = Path(__file__).resolve().parent
-    barcodes_dir = res_dir / "barcodes"
+# The per-label rest of render(), for AveryLabel's forms mode which draws
+# render_static once and selects LABEL_FONT once per page
+def render_variable(c, x, y, barcode_value):
+    rows = QR_ENCODER.rows(barcode_value)
+    variable = [line & ~mask for line, mask in zip(rows, QR_STATIC_ROWS)]
+    draw_qr_rows(c, variable, y * 0.9, 1 * mm, y * 0.05)
+    c.drawString(y, (y - 2 * mm) / 2, visible_text(barcode_value))
+
+
+# One Avery 4731 sheet: 7 across, 27 down
+SHEET_LABELS = 189
+
+
+def barcodes_directory():
+    barcodes_dir = Path(__file__).resolve().parent / "barcodes"
     barcodes_dir.mkdir(parents=True, exist_ok=True)
+    return barcodes_dir
+
+
+def out_file_name(start_asn, end_asn):
+    # Determine 2-digit range identifier from start ASN (hundred-thousands)
+    range_key = f"{start_asn // 100_000:02d}"
 
     # Filename: ASN-<2digit range>-<start tail 5 digits>-<end tail 5 digits>.pdf
     # For example start_asn=0300000 -> start_tail='00000', end_asn=0300188 -> end_tail='00188'
-    start_str = f"{start_asn:07d}"
-    end_str = f"{end_asn:07d}"
-    start_tail = start_str[-5:]
-    end_tail = end_str[-5:]
-    out_name = f"ASN-{range_key}-{start_tail}-{end_tail}.pdf"
-    out_path = barcodes_dir / out_name
+    start_tail = f"{start_asn:07d}"[-5:]
+    end_tail = f"{end_asn:07d}"[-5:]
+    return f"ASN-{range_key}-{start_tail}-{end_tail}.pdf"
 
+
+# Renders labels start_asn .. start_asn + count - 1 into out_path. Module
+# level so bulk() can run it in worker processes.
+def render_labels(out_path, start_asn, count):
     # Create an iterator of barcode strings for the labels
     def iterator():
         for n in range(start_asn, start_asn + count):
             yield f"ASN{n:07d}"
 
-    label = AveryLabels.AveryLabel(4731)
+    label = AveryLabels.AveryLabel(
+        4731, forms=True, font=LABEL_FONT, static=render_static
+    )
     label.open(str(out_path))
 
     # render_iterator expects a func(canv, width, height, chunk)
-    def render_chunk(canv, w, h, chunk):
-        render(canv, w, h, chunk)
-
-    label.render_iterator(render_chunk, iterator())
+    label.render_iterator(render_variable, iterator())
     label.close()
+    return out_path
+
+
+def main(start_asn: int):
+    count = SHEET_LABELS
+    end_asn = start_asn + count - 1
+    render_labels(barcodes_directory() / out_file_name(start_asn, end_asn), start_asn, count)
+
+
+# Renders 'count' labels from start_asn as sheet-sized chunks in a pool of
+# 'jobs' worker processes (default: one per CPU), into a temp dir next to
+# the output. Only once every chunk has rendered are they moved into
+# barcodes/: merged into one PDF (streamed, so memory does not grow with
+# the sheet count), or one file per sheet with per_sheet.
+# If any chunk fails nothing is written and the exception propagates.
+def bulk(start_asn, count, jobs=None, per_sheet=False):
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    barcodes_dir = barcodes_directory()
+    end_asn = start_asn + count - 1
+    chunks = [
+        (first, min(SHEET_LABELS, end_asn - first + 1))
+        for first in range(start_asn, end_asn + 1, SHEET_LABELS)
+    ]
+
+    with tempfile.TemporaryDirectory(prefix=".bulk-", dir=barcodes_dir) as tmp:
+        tmp = Path(tmp)
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [
+                pool.submit(render_labels, tmp / f"{i:05d}.pdf", first, n)
+                for i, (first, n) in enumerate(chunks)
+            ]
+            try:
+                parts = [future.result() for future in futures]
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+        if per_sheet:
+            outputs = [
+                barcodes_dir / out_file_name(first, first + n - 1) for first, n in chunks
+            ]
+            for part, out_path in zip(parts, outputs):
+                os.replace(part, out_path)
+            return outputs
+
+        merged = tmp / "merged.pdf"
+        output = AveryLabels.PdfPageStream(merged)
+        for part in parts:
+            output.appendPdf(part)
+        output.close()
+        out_path = barcodes_dir / out_file_name(start_asn, end_asn)
+        os.replace(merged, out_path)
+        return [out_path]
+
+
+# Compares the original path (a QRCodeImage per label, one rect per module)
+# with the forms + QRMatrix path used by main(), writing to a temp dir
+def benchmark(counts=(189, 10_000)):
+    import tempfile
+    import time
+
+    paths = (
+        ("QRCodeImage", lambda: AveryLabels.AveryLabel(4731), render),
+        (
+            "QRMatrix",
+            lambda: AveryLabels.AveryLabel(
+                4731, forms=True, font=LABEL_FONT, static=render_static
+            ),
+            render_variable,
+        ),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            for name, make_label, func in paths:
+                out_path = os.path.join(tmp, f"{name}-{count}.pdf")
+                started = time.perf_counter()
+                label = make_label()
+                label.open(out_path)
+                label.render_iterator(
+                    func, (f"ASN{n:07d}" for n in range(count))
+                )
+                label.close()
+                elapsed = time.perf_counter() - started
+                size = os.path.getsize(out_path)
+                print(
+                    f"{count:>6} labels  {name:<12} {elapsed:8.2f} s  {size / 1024:10.1f} KiB"
+                )
+
+
+# Labels to generate from 'start': up to --end, --sheets full sheets, or one sheet
+def label_count(args, start):
+    if args.end is not None:
+        if args.end < start:
+            print(f"--end {args.end} is before start ASN {start}", file=sys.stderr)
+            sys.exit(2)
+        return args.end - start + 1
+    if args.sheets is not None:
+        if args.sheets < 1:
+            print("--sheets must be at least 1", file=sys.stderr)
+            sys.exit(2)
+        return args.sheets * SHEET_LABELS
+    return SHEET_LABELS
 
 
 if __name__ == "__main__":
@@ -85,8 +267,42 @@ if __name__ == "__main__":
     parser.add_argument(
         "-s", "--start", dest="start_opt", type=int, help="Explicit start ASN number"
     )
+    parser.add_argument(
+        "-n",
+        "--sheets",
+        type=int,
+        help=f"Bulk mode: number of {SHEET_LABELS}-label sheets to generate",
+    )
+    parser.add_argument(
+        "-e",
+        "--end",
+        type=int,
+        help="Bulk mode: last ASN number to generate (inclusive)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Bulk mode: worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--per-sheet",
+        action="store_true",
+        help="Bulk mode: write one PDF per sheet instead of one merged PDF",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time the QR rendering paths for 189 and 10000 labels and exit",
+    )
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark()
+        sys.exit(0)
+
+    reserved = None
+
     # Priority: explicit --start -> positional start -> STARTASN env var -> --range -> default 190
     if args.start_opt is not None:
         start = args.start_opt
@@ -97,7 +313,8 @@ if __name__ == "__main__":
         if env is not None:
             start = int(env)
         elif args.range_id is not None:
-            # Resolve range start from state file
+            # Reserve the next free block of the range before rendering, so
+            # concurrent runs never get the same ASNs
             rid = args.range_id
             # normalize to integer then zero-pad two digits
             try:
@@ -105,56 +322,35 @@ if __name__ == "__main__":
             except ValueError:
                 print(f"Invalid range id: {rid}", file=sys.stderr)
                 sys.exit(2)
-            range_key = f"{rid_int:02d}"
 
             # Store state inside the barcodes directory under resources
-            state_file = Path(__file__).resolve().parent / "barcodes" / "state.json"
+            allocator = ASNAllocator.Allocator(barcodes_directory())
+            # The label count (--end) is resolved against the first free ASN
+            # under the allocator's lock, in the same step that reserves it
             try:
-                if state_file.exists():
-                    import json
-
-                    with state_file.open("r") as fh:
-                        state = json.load(fh)
-                else:
-                    state = {}
-            except Exception:
-                state = {}
-
-            base_start = rid_int * 100_000
-            base_end = base_start + 100_000 - 1
-
-            last = state.get(range_key)
-            if last is None:
-                start = base_start
-            else:
-                start = int(last) + 1
-
-            if start + 189 - 1 > base_end:
-                print(
-                    f"Range {range_key} exhausted or insufficient space for 189 ASNs",
-                    file=sys.stderr,
+                start, end = allocator.allocate(
+                    rid_int, lambda next_free: label_count(args, next_free)
                 )
+            except ASNAllocator.RangeExhausted as e:
+                print(e, file=sys.stderr)
                 sys.exit(1)
-
-            # will update state after successful run
-            update_state = True
-            update_state_path = state_file
-            update_state_key = range_key
+            reserved = rid_int
+            count = end - start + 1
         else:
             start = 190
 
     # Run
-    main(start)
-
-    # If we used range behavior, update the last generated ASN in state file
-    if "update_state" in locals() and update_state:
-        end_asn = start + 189 - 1
-        import json
-
-        state.update({update_state_key: end_asn})
-        try:
-            update_state_path.parent.mkdir(parents=True, exist_ok=True)
-            with update_state_path.open("w") as fh:
-                json.dump(state, fh, indent=2)
-        except Exception as e:
-            print(f"Warning: failed to update state file: {e}", file=sys.stderr)
+    if reserved is None:
+        count = label_count(args, start)
+    try:
+        if args.sheets is None and args.end is None and not args.per_sheet:
+            main(start)
+        else:
+            for out_path in bulk(start, count, jobs=args.jobs, per_sheet=args.per_sheet):
+                print(out_path)
+    except BaseException:
+        if reserved is not None:
+            allocator.finish(reserved, start, start + count - 1, ok=False)
+        raise
+    if reserved is not None:
+        allocator.finish(reserved, start, start + count - 1)
@@ -0,0 +1,180 @@
+import importlib.metadata
+
+import qrcode
+from qrcode import util
+from qrcode.constants import ERROR_CORRECT_M
+
+# Usage:
+#   encoder = QRMatrix.Encoder(1)
+#   rows = encoder.rows("ASN0300000")
+#   for row, col, length in QRMatrix.runs(rows):
+#       ...
+#
+# A QR encoder for a fixed version and error-correction level. It returns
+# the same modules as qrcode.QRCode(version, error_correction).get_matrix()
+# with border 0, including the mask pattern qrcode would pick. The function
+# patterns, the data module placement and the masks are precomputed once.
+# The matrix is kept as one int per row (bit c = column c), so applying a
+# mask and scoring it are a few integer operations per row, not a Python
+# loop per module.
+#
+# It builds on qrcode internals (QRCode.setup_*, util.create_data,
+# util.mask_func), so scripts/generate-paperless-asns.sh pins the qrcode
+# version this was checked against, and check() compares the result with
+# qrcode itself before any label is drawn.
+
+class Encoder:
+
+    def __init__(self, version, error_correction=ERROR_CORRECT_M):
+        self.version = version
+        self.error_correction = error_correction
+        self.size = n = version * 4 + 17
+        self.full = (1 << n) - 1
+
+        qr = qrcode.QRCode(version, error_correction, box_size=1, border=0)
+        qr.modules_count = n
+        qr.modules = [[None] * n for _ in range(n)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(n - 7, 0)
+        qr.setup_position_probe_pattern(0, n - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+
+        # qrcode scores the masks with format/version information all light
+        # (its "test" matrices), then draws the real ones for the winner
+        self.testRows = self.templateRows(qr, True, 0)
+        self.testCols = [
+            sum(1 << r for r, line in enumerate(self.testRows) if line >> c & 1) for c in range(n)
+        ]
+        self.finalRows = [self.templateRows(qr, False, mask) for mask in range(8)]
+
+        # Data modules in placement order, as in qrcode's QRCode.map_data
+        qr.setup_type_info(True, 0)
+        if version >= 7:
+            qr.setup_type_number(True)
+        self.placement = []
+        row, inc = n - 1, -1
+        for col in range(n - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while True:
+                for c in (col, col - 1):
+                    if qr.modules[row][c] is None:
+                        self.placement.append((row, c))
+                row += inc
+                if row < 0 or row >= n:
+                    row -= inc
+                    inc = -inc
+                    break
+
+        self.maskRows = []
+        self.maskCols = []
+        for mask in range(8):
+            func = util.mask_func(mask)
+            rows, cols = [0] * n, [0] * n
+            for r, c in self.placement:
+                if func(r, c):
+                    rows[r] |= 1 << c
+                    cols[c] |= 1 << r
+            self.maskRows.append(rows)
+            self.maskCols.append(cols)
+
+    def templateRows(self, qr, test, mask):
+        saved = [line[:] for line in qr.modules]
+        qr.setup_type_info(test, mask)
+        if self.version >= 7:
+            qr.setup_type_number(test)
+        rows = [sum(1 << c for c, dark in enumerate(line) if dark) for line in qr.modules]
+        qr.modules = saved
+        return rows
+
+    def rows(self, data):
+        # Same chunking as QRCode.add_data(data) with its default optimize=20
+        chunks = list(util.optimal_data_chunks(data, minimum=20))
+        codewords = util.create_data(self.version, self.error_correction, chunks)
+
+        n = self.size
+        dataRows, dataCols = [0] * n, [0] * n
+        bits = len(codewords) * 8
+        for i, (r, c) in enumerate(self.placement):
+            if i < bits and (codewords[i >> 3] >> (7 - (i & 7))) & 1:
+                dataRows[r] |= 1 << c
+                dataCols[c] |= 1 << r
+
+        best, bestPenalty = 0, None
+        for mask in range(8):
+            rows = [t | (d ^ m) for t, d, m in zip(self.testRows, dataRows, self.maskRows[mask])]
+            cols = [t | (d ^ m) for t, d, m in zip(self.testCols, dataCols, self.maskCols[mask])]
+            penalty = self.penalty(rows, cols)
+            if bestPenalty is None or penalty < bestPenalty:
+                best, bestPenalty = mask, penalty
+
+        return [t | (d ^ m) for t, d, m in zip(self.finalRows[best], dataRows, self.maskRows[best])]
+
+    # Raises if rows() differs from qrcode's get_matrix() for any of the
+    # payloads, e.g. after a qrcode upgrade changed one of its internals
+    def check(self, payloads):
+        for data in payloads:
+            qr = qrcode.QRCode(self.version, self.error_correction, box_size=1, border=0)
+            qr.add_data(data)
+            qr.make(fit=False)
+            expected = [sum(1 << c for c, dark in enumerate(line) if dark) for line in qr.get_matrix()]
+            if self.rows(data) != expected:
+                raise RuntimeError(
+                    f"QRMatrix.Encoder({self.version}) disagrees with qrcode {qrcode_version()} "
+                    f"for {data!r}; install the qrcode version pinned in "
+                    "scripts/generate-paperless-asns.sh"
+                )
+
+    # qrcode's util.lost_point, on row and column bitmasks
+    def penalty(self, rows, cols):
+        n, full = self.size, self.full
+        windows = (1 << (n - 10)) - 1
+        points = 0
+
+        for lines in (rows, cols):
+            for x in lines:
+                y = ~x & full
+                # Runs of 5+ equal modules score length - 2: one point per
+                # 5-module window in the run, plus 2 per run
+                for z in (x, y):
+                    w = z & (z >> 1) & (z >> 2) & (z >> 3) & (z >> 4)
+                    if w:
+                        points += w.bit_count() + 2 * (w & ~(w << 1)).bit_count()
+
+                # 1:1:3:1:1 (dark:light:dark:light:dark) with 4 light modules
+                # after it or before it
+                core = x & (y >> 1) & (x >> 2) & (x >> 3) & (x >> 4) & (y >> 5) & (x >> 6)
+                if core:
+                    light = y & (y >> 1) & (y >> 2) & (y >> 3)
+                    found = ((core & (light >> 7)) | (light & (core >> 4))) & windows
+                    points += 40 * found.bit_count()
+
+        # 2x2 blocks of one colour
+        inner = (1 << (n - 1)) - 1
+        for a, b in zip(rows, rows[1:]):
+            same = ~(a ^ b)
+            points += 3 * (same & (same >> 1) & ~(a ^ (a >> 1)) & inner).bit_count()
+
+        dark = sum(map(int.bit_count, rows))
+        percent = float(dark) / (n**2)
+        points += int(abs(percent * 100 - 50) / 5) * 10
+        return points
+
+
+def qrcode_version():
+    try:
+        return importlib.metadata.version("qrcode")
+    except importlib.metadata.PackageNotFoundError:
+        return "(unknown version)"
+
+
+# (row, col, length) of every run of dark modules, row by row
+def runs(rows):
+    for r, x in enumerate(rows):
+        while x:
+            start = (x & -x).bit_length() - 1
+            t = x >> start
+            length = (t ^ (t + 1)).bit_length() - 1
+            yield r, start, length
+            x &= ~(((1 << length) - 1) << start)
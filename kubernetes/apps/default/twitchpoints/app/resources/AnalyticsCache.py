@@ -0,0 +1,503 @@
+#  -*- coding: utf-8 -*-
+
+"""
+In-memory, downsampled backend for the miner's analytics web page.
+
+The miner's analytics server re-reads and re-serializes a streamer's whole
+point history (analytics/<username>/<streamer>.json) on every request, so
+each page refresh costs time and bytes in proportion to days_ago. This
+module keeps a rollup per streamer instead:
+
+    newer than RAW_SECONDS      every point, as written by the miner
+    newer than HOURLY_SECONDS   one bucket per hour
+    older                       one bucket per day
+
+A bucket keeps the lowest, the highest and the last point that fell into
+it, so drops and spikes survive downsampling. A poll thread notices
+rewritten files and folds only the points newer than the last one seen,
+then moves aged points down a tier. Requests are answered from memory;
+serialized responses are cached per streamer version with an ETag, and a
+matching If-None-Match (weak or "*" included) gets a 304.
+
+serve() puts this in front of the miner's own server: it answers
+/streamers, /json/<streamer> and /json_all itself and forwards everything
+else (the page, static files, /ping) to 'upstream', passing the request
+headers on and the caching headers (Cache-Control, ETag, Last-Modified, ...)
+back:
+
+    twitch_miner.analytics(host="127.0.0.1", port=5001, refresh=5, days_ago=180)
+    AnalyticsCache.serve(os.path.join("analytics", TWITCH_USERNAME), port=5000, upstream="http://127.0.0.1:5001")
+
+Run this file with --benchmark [STREAMERS] to compare it with re-reading
+the files on synthetic 5-minute histories.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+RAW_SECONDS = 24 * 3600
+HOURLY_SECONDS = 7 * 24 * 3600
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+POLL_INTERVAL = 30
+RESPONSE_CACHE_SIZE = 256
+
+# Request headers not passed on to 'upstream' (hop-by-hop ones, and the ones
+# urllib sets itself), and the response headers passed back from it
+FORWARD_SKIP_HEADERS = {
+    "connection",
+    "content-length",
+    "host",
+    "keep-alive",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+FORWARD_RESPONSE_HEADERS = (
+    "Cache-Control",
+    "Content-Encoding",
+    "ETag",
+    "Expires",
+    "Last-Modified",
+    "Vary",
+)
+
+
+# Folds 'point' into a bucket kept as [lowest, highest, last]
+def fold(bucket, point):
+    if bucket is None:
+        return [point, point, point]
+    if point["y"] < bucket[0]["y"]:
+        bucket[0] = point
+    if point["y"] > bucket[1]["y"]:
+        bucket[1] = point
+    bucket[2] = point
+    return bucket
+
+
+# The distinct points of a bucket, oldest first
+def bucket_points(bucket):
+    points = []
+    for point in sorted(bucket, key=lambda p: p["x"]):
+        if not points or points[-1] is not point:
+            points.append(point)
+    return points
+
+
+class Rollup:
+    def __init__(self):
+        self.raw = []
+        self.hourly = {}  # hour start (ms) -> bucket
+        self.daily = {}  # day start (ms) -> bucket
+        self.annotations = []
+        self.last = None
+        self.version = 0
+
+    def add(self, point, now_ms):
+        if self.last is not None and point["x"] <= self.last["x"]:
+            return
+        # The same cutoffs as compact(), so loading a history at once ends
+        # up in the same buckets as following it point by point
+        hour = point["x"] - point["x"] % HOUR_MS
+        if point["x"] >= now_ms - RAW_SECONDS * 1000:
+            self.raw.append(point)
+        elif hour + HOUR_MS > now_ms - HOURLY_SECONDS * 1000:
+            self.hourly[hour] = fold(self.hourly.get(hour), point)
+        else:
+            day = point["x"] - point["x"] % DAY_MS
+            self.daily[day] = fold(self.daily.get(day), point)
+        self.last = point
+        self.version += 1
+
+    # Moves points that aged out of their tier down to the next one
+    def compact(self, now_ms):
+        moved = 0
+
+        raw_cutoff = now_ms - RAW_SECONDS * 1000
+        keep = 0
+        while keep < len(self.raw) and self.raw[keep]["x"] < raw_cutoff:
+            point = self.raw[keep]
+            key = point["x"] - point["x"] % HOUR_MS
+            self.hourly[key] = fold(self.hourly.get(key), point)
+            keep += 1
+        if keep:
+            del self.raw[:keep]
+            moved += keep
+
+        hourly_cutoff = now_ms - HOURLY_SECONDS * 1000
+        for key in [key for key in self.hourly if key + HOUR_MS <= hourly_cutoff]:
+            day = key - key % DAY_MS
+            for point in bucket_points(self.hourly.pop(key)):
+                self.daily[day] = fold(self.daily.get(day), point)
+            moved += 1
+
+        if moved:
+            self.version += 1
+        return moved
+
+    def points(self, start_ms, end_ms):
+        series = []
+        for tier in (self.daily, self.hourly):
+            for bucket in tier.values():
+                for point in bucket_points(bucket):
+                    if start_ms <= point["x"] <= end_ms:
+                        series.append(point)
+        series.extend(p for p in self.raw if start_ms <= p["x"] <= end_ms)
+        return series
+
+    def data(self, start_ms, end_ms):
+        return {
+            "series": self.points(start_ms, end_ms),
+            "annotations": [a for a in self.annotations if start_ms <= a.get("x", 0) <= end_ms],
+        }
+
+
+class Store:
+    def __init__(self, directory):
+        self.directory = directory
+        self.rollups = {}
+        self.files = {}  # name -> (mtime_ns, size) last loaded
+        self.lock = threading.RLock()
+        self.responses = {}
+
+    # Loads analytics files that changed since the last call and moves
+    # aged points down a tier. Returns the number of files read.
+    def refresh(self, now_ms=None):
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json") and e.is_file()]
+        except FileNotFoundError:
+            entries = []
+
+        read = 0
+        for entry in entries:
+            name = entry.name[: -len(".json")]
+            stat = entry.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self.files.get(name) == signature:
+                continue
+            try:
+                with open(entry.path, "r") as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError) as e:
+                # Most likely caught mid-write by the miner; next poll
+                logger.debug("Skipping %s: %s", entry.path, e)
+                continue
+            self.files[name] = signature
+            read += 1
+            with self.lock:
+                self.ingest(name, data, now_ms)
+
+        with self.lock:
+            for rollup in self.rollups.values():
+                rollup.compact(now_ms)
+        return read
+
+    # Folds the points of a freshly read file that are newer than the last
+    # one seen; a file that no longer reaches that far is reloaded whole
+    def ingest(self, name, data, now_ms):
+        series = data.get("series") or []
+        rollup = self.rollups.get(name)
+        if rollup is None or (rollup.last is not None and (not series or series[-1]["x"] < rollup.last["x"])):
+            version = rollup.version + 1 if rollup is not None else 0
+            rollup = self.rollups[name] = Rollup()
+            rollup.version = version
+
+        first = len(series)
+        if rollup.last is None:
+            first = 0
+        else:
+            while first > 0 and series[first - 1]["x"] > rollup.last["x"]:
+                first -= 1
+        for point in series[first:]:
+            rollup.add(point, now_ms)
+
+        annotations = data.get("annotations") or []
+        if annotations != rollup.annotations:
+            rollup.annotations = annotations
+            rollup.version += 1
+
+    def streamers(self):
+        with self.lock:
+            return [
+                {
+                    "name": f"{name}.json",
+                    "points": rollup.last["y"] if rollup.last else 0,
+                    "last_activity": rollup.last["x"] if rollup.last else 0,
+                }
+                for name, rollup in sorted(self.rollups.items())
+            ]
+
+    # (etag, body) of a JSON response, serialized once per version of the
+    # data it covers
+    def response(self, key, versions, build):
+        with self.lock:
+            cached = self.responses.get(key)
+            if cached is not None and cached[0] == versions:
+                return cached[1], cached[2]
+            body = json.dumps(build()).encode()
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+            if len(self.responses) >= RESPONSE_CACHE_SIZE:
+                self.responses.clear()
+            self.responses[key] = (versions, etag, body)
+            return etag, body
+
+    def streamer_response(self, name, start_ms, end_ms):
+        with self.lock:
+            rollup = self.rollups.get(name)
+            if rollup is None:
+                return None
+            return self.response(
+                ("json", name, start_ms, end_ms),
+                rollup.version,
+                lambda: rollup.data(start_ms, end_ms),
+            )
+
+    def all_response(self, start_ms, end_ms):
+        with self.lock:
+            rollups = sorted(self.rollups.items())
+            return self.response(
+                ("json_all", start_ms, end_ms),
+                tuple((name, rollup.version) for name, rollup in rollups),
+                lambda: [{"name": name, "data": rollup.data(start_ms, end_ms)} for name, rollup in rollups],
+            )
+
+    def streamers_response(self):
+        with self.lock:
+            return self.response(
+                ("streamers",),
+                tuple((name, rollup.version) for name, rollup in sorted(self.rollups.items())),
+                self.streamers,
+            )
+
+
+# startDate/endDate (YYYY-MM-DD, local time) as an inclusive ms range,
+# read the way the miner's server reads them
+def date_range(query):
+    start = query.get("startDate", [""])[0]
+    end = query.get("endDate", [""])[0]
+    try:
+        start_ms = int(datetime.strptime(start, "%Y-%m-%d").timestamp() * 1000) if start else 0
+    except ValueError:
+        start_ms = 0
+    try:
+        end_day = datetime.strptime(end, "%Y-%m-%d") if end else None
+    except ValueError:
+        end_day = None
+    if end_day is None:
+        end_ms = 2**63 - 1
+    else:
+        end_ms = int((end_day + timedelta(days=1)).timestamp() * 1000) - 1
+    return start_ms, end_ms
+
+
+# If-None-Match against 'etag' with the weak comparison GET uses: "*"
+# matches anything, and W/ prefixes are ignored
+def etag_matches(if_none_match, etag):
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+class Handler(BaseHTTPRequestHandler):
+    store = None
+    upstream = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/") or "/"
+
+        if path == "/streamers":
+            result = self.store.streamers_response()
+        elif path == "/json_all":
+            result = self.store.all_response(*date_range(query))
+        elif path.startswith("/json/"):
+            name = unquote(path[len("/json/"):])
+            if name.endswith(".json"):
+                name = name[: -len(".json")]
+            result = self.store.streamer_response(name, *date_range(query))
+            if result is None:
+                return self.reply(404, b'{"error": "unknown streamer"}')
+        else:
+            return self.forward()
+
+        etag, body = result
+        if etag_matches(self.headers.get("If-None-Match", ""), etag):
+            return self.reply(304, b"", etag)
+        self.reply(200, body, etag)
+
+    def reply(self, status, body, etag=None, content_type="application/json", headers=()):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        for name, value in headers:
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def forward(self):
+        request = urllib.request.Request(
+            self.upstream + self.path,
+            headers={
+                name: value
+                for name, value in self.headers.items()
+                if name.lower() not in FORWARD_SKIP_HEADERS
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status, headers, body = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            # Includes 304 answers to a forwarded If-None-Match/If-Modified-Since
+            status, headers, body = e.code, e.headers, e.read()
+        except OSError as e:
+            return self.reply(502, str(e).encode(), content_type="text/plain")
+        self.reply(
+            status,
+            body,
+            content_type=headers.get("Content-Type", "application/octet-stream"),
+            headers=[(name, headers[name]) for name in FORWARD_RESPONSE_HEADERS if name in headers],
+        )
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+# Loads 'directory', keeps it polled and serves it on host:port; returns
+# the server, running on daemon threads
+def serve(directory, host="0.0.0.0", port=5000, upstream="http://127.0.0.1:5001", poll_interval=POLL_INTERVAL):
+    store = Store(directory)
+    store.refresh()
+
+    def poll():
+        while True:
+            time.sleep(poll_interval)
+            try:
+                store.refresh()
+            except Exception:
+                logger.exception("Refreshing analytics from %s failed", directory)
+
+    threading.Thread(target=poll, name="analytics-poll", daemon=True).start()
+
+    handler = type("AnalyticsHandler", (Handler,), {"store": store, "upstream": upstream.rstrip("/")})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="analytics-server", daemon=True).start()
+    return server
+
+
+# -----------------------------------------------------------------------------
+# Benchmark
+# -----------------------------------------------------------------------------
+
+def synthetic_history(days, now_ms, interval_s=300):
+    series = []
+    annotations = []
+    points = 10_000
+    x = now_ms - days * DAY_MS
+    n = 0
+    while x <= now_ms:
+        points += 10
+        reason = "WATCH"
+        if n % 97 == 0:
+            points += 50
+            reason = "CLAIM"
+        if n % 1009 == 0:
+            points = max(0, points - 2500)
+            annotations.append({"x": x, "borderColor": "#ff4560", "label": {"text": "BET_LOSE"}})
+        series.append({"x": x, "y": points, "z": reason})
+        x += interval_s * 1000
+        n += 1
+    return {"series": series, "annotations": annotations}
+
+
+# What every request costs without the rollups: read, filter, serialize
+def read_and_filter(path, start_ms, end_ms):
+    with open(path, "r") as fh:
+        data = json.load(fh)
+    data["series"] = [p for p in data["series"] if start_ms <= p["x"] <= end_ms]
+    data["annotations"] = [a for a in data["annotations"] if start_ms <= a["x"] <= end_ms]
+    return json.dumps(data).encode()
+
+
+def benchmark(streamers=10):
+    import tempfile
+
+    now_ms = int(time.time() * 1000)
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(streamers):
+            with open(os.path.join(directory, f"streamer{i}.json"), "w") as fh:
+                json.dump(synthetic_history(365, now_ms), fh)
+
+        store = Store(directory)
+        started = time.perf_counter()
+        store.refresh(now_ms)
+        print(f"{streamers} streamers x 365 days of 5-minute points, initial load {time.perf_counter() - started:.2f}s")
+
+        # One more point per streamer, as the miner appends them
+        for i in range(streamers):
+            path = os.path.join(directory, f"streamer{i}.json")
+            with open(path) as fh:
+                data = json.load(fh)
+            data["series"].append({"x": now_ms + 1000, "y": data["series"][-1]["y"] + 10, "z": "WATCH"})
+            with open(path, "w") as fh:
+                json.dump(data, fh)
+        started = time.perf_counter()
+        store.refresh(now_ms + 1000)
+        print(f"incremental refresh after one new point each: {time.perf_counter() - started:.2f}s")
+
+        print(f"{'days_ago':>8} {'re-read ms':>11} {'KiB':>8} {'cold ms':>8} {'cached ms':>10} {'KiB':>6}")
+        for days in (7, 30, 180, 365):
+            start_ms = now_ms - days * DAY_MS
+            end_ms = now_ms + DAY_MS
+
+            started = time.perf_counter()
+            sizes = [len(read_and_filter(os.path.join(directory, f"streamer{i}.json"), start_ms, end_ms)) for i in range(streamers)]
+            reread = (time.perf_counter() - started) / streamers
+
+            started = time.perf_counter()
+            for i in range(streamers):
+                store.streamer_response(f"streamer{i}", start_ms, end_ms)
+            cold = (time.perf_counter() - started) / streamers
+
+            started = time.perf_counter()
+            for _ in range(10):
+                bodies = [store.streamer_response(f"streamer{i}", start_ms, end_ms)[1] for i in range(streamers)]
+            cached = (time.perf_counter() - started) / streamers / 10
+
+            print(
+                f"{days:>8} {reread * 1000:>11.1f} {sum(sizes) / streamers / 1024:>8.0f}"
+                f" {cold * 1000:>8.1f} {cached * 1000:>10.3f} {sum(map(len, bodies)) / streamers / 1024:>6.0f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:2] == ["--benchmark"]:
+        raise SystemExit(benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10))
+    print(__doc__)
@@ -0,0 +1,347 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Coalescing, non-blocking Discord webhook hook for the miner.
+
+The miner's own Discord hook POSTs every event synchronously on the thread
+that logged it, so a burst of events (or Discord answering 429) stalls
+claims and bets. DiscordDispatcher is a drop-in replacement for it in
+LoggerSettings(hooks=[...]):
+
+    DiscordDispatcher(webhook_api=DISCORD_WEBHOOK, events=[...], flush_interval=10)
+
+send() only puts the message on a bounded queue and returns. A daemon
+thread per webhook drains the queue at most once per flush_interval and
+posts everything collected as one embed (more only when Discord's embed
+limits force it) through a pooled requests.Session. 429 answers are
+honored by waiting out retry_after on that thread, with the batch kept;
+other failures are retried with backoff and then dropped. stats() reports
+queue depth and the sent/dropped/failed/rate-limited counters; the worker
+logs them as a warning at most once per stats_interval while the dropped
+or failed counts keep growing.
+
+Run this file directly to exercise it against a local HTTP stub that
+rate-limits the first request.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from textwrap import dedent
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from TwitchChannelPointsMiner.classes.Discord import Discord
+
+logger = logging.getLogger(__name__)
+
+USERNAME = "Twitch Channel Points Miner"
+AVATAR_URL = "https://i.imgur.com/X9fEkhT.png"
+
+# Discord limits: characters per embed description, embeds per message and
+# characters across all embeds of a message
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_EMBED_CHARS = 6000
+
+
+class DiscordDispatcher(Discord):
+    def __init__(
+        self,
+        webhook_api: str,
+        events: list,
+        flush_interval: float = 10.0,
+        max_queue: int = 1000,
+        timeout: float = 10.0,
+        max_attempts: int = 5,
+        color: int = 0x9146FF,
+        stats_interval: float = 300.0,
+    ):
+        super().__init__(webhook_api, events)
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.color = color
+        self.stats_interval = stats_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._counters = {
+            "queued": 0,
+            "dropped": 0,
+            "sent_events": 0,
+            "sent_messages": 0,
+            "rate_limited": 0,
+            "failed": 0,
+        }
+        self._not_before = 0.0
+        self._stop = threading.Event()
+        self._stats_due = time.monotonic() + stats_interval
+        self._logged_losses = (0, 0)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._thread = threading.Thread(
+            target=self._run, name="discord-dispatcher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    # Called by the miner's logger on the thread that logged the event
+    def send(self, message: str, event) -> None:
+        if str(event) not in self.events:
+            return
+        try:
+            self._queue.put_nowait(dedent(message).strip())
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["queue_depth"] = self._queue.qsize()
+        counters["retry_in"] = max(0.0, self._not_before - time.monotonic())
+        return counters
+
+    # Posts what is queued (waiting out a pending 429 for up to 'timeout'
+    # seconds) and stops the worker thread
+    def close(self, timeout: float = 5.0) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._session.close()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    # Logs stats() when events were dropped or failed since the last log,
+    # at most once per stats_interval unless 'force'
+    def _log_stats(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now < self._stats_due:
+            return
+        self._stats_due = now + self.stats_interval
+        stats = self.stats()
+        losses = (stats["dropped"], stats["failed"])
+        if losses == self._logged_losses:
+            return
+        self._logged_losses = losses
+        logger.warning(
+            "Discord dispatcher: %d event(s) dropped (queue full), %d failed; "
+            "%d queued, %d sent in %d message(s), %d rate limit(s), %d waiting",
+            stats["dropped"],
+            stats["failed"],
+            stats["queued"],
+            stats["sent_events"],
+            stats["sent_messages"],
+            stats["rate_limited"],
+            stats["queue_depth"],
+        )
+
+    def _run(self) -> None:
+        try:
+            self._work()
+        finally:
+            self._log_stats(force=True)
+
+    def _work(self) -> None:
+        pending = []
+        attempts = 0
+        last_post = 0.0
+        while True:
+            self._log_stats()
+            if not pending:
+                try:
+                    pending.append(self._queue.get(timeout=0.5))
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+                    continue
+
+            # Coalesce: wait for the flush interval and any 429 to pass;
+            # stop cuts the interval short but not a rate limit
+            wake = max(last_post + self.flush_interval, self._not_before)
+            while not self._stop.is_set() and time.monotonic() < wake:
+                self._stop.wait(wake - time.monotonic())
+            delay = self._not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            pending = self._drain(pending)
+            payload, used = self._payload(pending)
+            last_post = time.monotonic()
+            result = self._post(payload)
+
+            if result == "ok":
+                del pending[:used]
+                attempts = 0
+                self._count("sent_events", used)
+                self._count("sent_messages")
+            elif result == "rate_limited":
+                self._count("rate_limited")
+            else:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.warning(
+                        "Discord webhook failed %d times, dropping %d event(s)",
+                        attempts,
+                        used,
+                    )
+                    del pending[:used]
+                    attempts = 0
+                    self._count("failed", used)
+                else:
+                    self._not_before = time.monotonic() + min(60.0, 2.0 ** attempts)
+
+            if self._stop.is_set() and not pending and self._queue.empty():
+                return
+
+    # Moves queued messages into 'pending' until one post's worth is there
+    def _drain(self, pending: list) -> list:
+        size = sum(len(m) + 1 for m in pending)
+        while size < MESSAGE_EMBED_CHARS:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(message)
+            size += len(message) + 1
+        return pending
+
+    # One webhook message from the head of 'pending': events packed into
+    # as few embeds as the limits allow. Returns (payload, events used).
+    def _payload(self, pending: list) -> tuple:
+        embeds = []
+        lines = []
+        length = 0
+        total = 0
+        used = 0
+        for message in pending:
+            if len(message) > EMBED_DESCRIPTION_LIMIT:
+                message = message[: EMBED_DESCRIPTION_LIMIT - 1] + "…"
+            extra = len(message) + (1 if lines else 0)
+            if lines and length + extra > EMBED_DESCRIPTION_LIMIT:
+                embeds.append("\n".join(lines))
+                lines, length, extra = [], 0, len(message)
+            if total + extra > MESSAGE_EMBED_CHARS or (
+                not lines and len(embeds) == EMBEDS_PER_MESSAGE
+            ):
+                break
+            lines.append(message)
+            length += extra
+            total += extra
+            used += 1
+        if lines:
+            embeds.append("\n".join(lines))
+
+        timestamp = datetime.now(timezone.utc).isoformat()
+        payload = {
+            "username": USERNAME,
+            "avatar_url": AVATAR_URL,
+            "embeds": [
+                {"description": description, "color": self.color, "timestamp": timestamp}
+                for description in embeds
+            ],
+        }
+        return payload, used
+
+    def _post(self, payload: dict) -> str:
+        try:
+            response = self._session.post(
+                self.webhook_api, json=payload, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            logger.debug("Discord webhook error: %s", e)
+            return "error"
+
+        if response.status_code == 429:
+            self._not_before = time.monotonic() + self._retry_after(response)
+            return "rate_limited"
+        if response.status_code >= 400:
+            logger.debug(
+                "Discord webhook answered %d: %s",
+                response.status_code,
+                response.text[:200],
+            )
+            return "error"
+
+        # Wait out an exhausted bucket before the next post instead of
+        # running into the 429
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                reset_after = float(response.headers.get("X-RateLimit-Reset-After", 0))
+            except ValueError:
+                reset_after = 0.0
+            self._not_before = max(self._not_before, time.monotonic() + reset_after)
+        return "ok"
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        try:
+            return float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            pass
+        try:
+            return float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            return 1.0
+
+
+if __name__ == "__main__":
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received = []
+
+    class Stub(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not received:
+                received.append(None)
+                reply = json.dumps({"message": "rate limited", "retry_after": 1.5})
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply.encode())
+                return
+            received.append(body)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    dispatcher = DiscordDispatcher(
+        webhook_api=f"http://127.0.0.1:{server.server_port}/webhook",
+        events=["GAIN_FOR_WATCH"],
+        flush_interval=0.5,
+        max_queue=5000,
+    )
+    started = time.perf_counter()
+    for i in range(2000):
+        dispatcher.send(f"+10 → streamer{i % 9} - Reason: WATCH", "GAIN_FOR_WATCH")
+    dispatcher.send("ignored", "BET_WIN")
+    print(f"2000 send() calls: {(time.perf_counter() - started) * 1000:.1f} ms")
+    print("right after:", dispatcher.stats())
+    dispatcher.close(timeout=30)
+    print("after close:", dispatcher.stats())
+    posts = [body for body in received if body]
+    print(
+        f"stub: 1 x 429, {len(posts)} post(s), "
+        f"{sum(len(e['description'].splitlines()) for b in posts for e in b['embeds'])} event line(s)"
+    )
+    server.shutdown()
@@ -6,6 +6,8 @@ from TwitchChannelPointsMiner import TwitchChannelPointsMiner
 from TwitchChannelPointsMiner.logger import LoggerSettings, ColorPalette
 from TwitchChannelPointsMiner.classes.Chat import ChatPresence
 from TwitchChannelPointsMiner.classes.Discord import Discord
+from DiscordDispatcher import DiscordDispatcher
+import AnalyticsCache
 from TwitchChannelPointsMiner.classes.Webhook import Webhook
 from TwitchChannelPointsMiner.classes.Telegram import Telegram
 from TwitchChannelPointsMiner.classes.Matrix import Matrix
@@ -58,8 +60,9 @@ twitch_miner = TwitchChannelPointsMiner(
             BET_FAILED=Fore.RED,
         ),
         hooks=[
-            Discord(
+            DiscordDispatcher(
                 webhook_api=DISCORD_WEBHOOK,  # Discord Webhook URL
+                flush_interval=30,  # Seconds between posts; events in between are batched into one embed
                 events=[
                     Events.STREAMER_ONLINE,
                     Events.STREAMER_OFFLINE,
@@ -81,8 +84,9 @@ twitch_miner = TwitchChannelPointsMiner(
                     Events.DROP_STATUS,
                 ],  # Only these events will be sent to the chat
             ),
-            Discord(
+            DiscordDispatcher(
                 webhook_api=DISCORD_CHAT_MENTION_WEBHOOK,  # Discord Chat Mention Webhook URL
+                flush_interval=2,  # Mentions are posted almost right away
                 events=[
                     Events.CHAT_MENTION,
                 ],  # Only these events will be sent to the chat
@@ -119,8 +123,10 @@ twitch_miner = TwitchChannelPointsMiner(
 )
 
 # Enable analytics webpage
+# The miner's own server only listens on localhost; AnalyticsCache answers the chart data on port 5000 from downsampled in-memory rollups and forwards the page itself
 
-twitch_miner.analytics(host="0.0.0.0", port=5000, refresh=5, days_ago=180)
+twitch_miner.analytics(host="127.0.0.1", port=5001, refresh=5, days_ago=180)
+AnalyticsCache.serve(os.path.join("analytics", TWITCH_USERNAME), host="0.0.0.0", port=5000, upstream="http://127.0.0.1:5001")
 
 # You can customize the settings for each streamer. If not settings were provided, the script would use the streamer_settings from TwitchChannelPointsMiner.
 # If no streamer_settings are provided in TwitchChannelPointsMiner the script will use default settings.
@@ -32,11 +32,18 @@ pip install --upgrade pip setuptools wheel
 # Install ReportLab pinned to a known working version
 pip install "reportlab==4.4.9"
 
+# QRMatrix.py reuses qrcode internals; keep qrcode at the version it was
+# checked against (GenerateASNs.py verifies the match at startup)
+pip install "qrcode==8.2"
+
 # Try to install reportlab_qrcode if the script needs it (safe to skip if not available)
 if ! python -c "import reportlab_qrcode" >/dev/null 2>&1; then
   pip install reportlab_qrcode 2>/dev/null || pip install reportlab-qrcode 2>/dev/null || true
 fi
 
+# pypdf merges the per-sheet chunks of bulk runs (--sheets/--end) into one PDF
+pip install pypdf
+
 # Ensure the resources directory is on PYTHONPATH so `import AveryLabels` works
 export PYTHONPATH="$RES_DIR"
 
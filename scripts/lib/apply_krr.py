@@ -0,0 +1,1659 @@
+"""
+Apply KRR resource recommendations to Flux HelmReleases using bjw-s
+app-template. Run through scripts/apply-krr.sh, which sets up a throwaway
+virtualenv with the dependencies; importable for apply_krr_bench.py.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from ruamel.yaml import YAML
+from ruamel.yaml.comments import CommentedMap
+
+
+# -----------------------------
+# Data types
+# -----------------------------
+
+@dataclass(frozen=True)
+class HrRef:
+	namespace: str
+	name: str
+
+
+@dataclass(frozen=True)
+class TargetKey:
+	hr: HrRef
+	controller: str
+	container: str
+
+
+@dataclass
+class RecommendedResources:
+	req_cpu_cores: Optional[float] = None
+	req_mem_bytes: Optional[float] = None
+	lim_cpu_cores: Optional[float] = None
+	lim_mem_bytes: Optional[float] = None
+
+
+@dataclass
+class HrDocLoc:
+	path: Path
+	doc_index: int
+
+
+@dataclass(frozen=True)
+class HrDocInfo:
+	"""The parts of a HelmRelease doc needed for indexing; independent of the file path."""
+	doc_index: int
+	name: str
+	# metadata.namespace as written ("" when missing)
+	namespace: str
+	chartref_kind: str
+	chartref_name: str
+	# spec.chart.spec.chart
+	chart: str
+
+
+@dataclass
+class FileIndex:
+	"""Per-file index result; cacheable by git blob SHA."""
+	ocirepos: List[Tuple[str, str]] = field(default_factory=list)
+	hrs: List[HrDocInfo] = field(default_factory=list)
+
+
+@dataclass
+class PrefilterStats:
+	excluded_files: int = 0
+	excluded_bytes: int = 0
+	skipped_files: int = 0
+	skipped_bytes: int = 0
+	candidate_files: int = 0
+	candidate_bytes: int = 0
+
+
+@dataclass
+class YamlIndex:
+	# OCIRepository name -> list of URLs
+	ocirepo_index: Dict[str, List[str]] = field(default_factory=dict)
+	# (path, doc info, namespace guessed from path) per HelmRelease doc
+	hr_candidates: List[Tuple[Path, HrDocInfo, Optional[str]]] = field(default_factory=list)
+	# parsed (raw, docs, yaml) for freshly parsed files holding a HelmRelease
+	loaded: Dict[Path, Tuple[str, List[Any], YAML]] = field(default_factory=dict)
+
+
+# -----------------------------
+# Git helpers
+# -----------------------------
+
+def _run(cmd: List[str], *, cwd: Path, check: bool = True) -> subprocess.CompletedProcess:
+	return subprocess.run(
+		cmd,
+		cwd=str(cwd),
+		check=check,
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+		text=True,
+	)
+
+
+def _git_root(repo: Path) -> Path:
+	p = _run(["git", "-C", str(repo), "rev-parse", "--show-toplevel"], cwd=repo)
+	return Path(p.stdout.strip())
+
+
+def _git_ls_yaml_files(repo_root: Path) -> List[Path]:
+	p = _run(
+		["git", "-C", str(repo_root), "ls-files", "-z", "--", "*.yml", "*.yaml"],
+		cwd=repo_root,
+	)
+	parts = [x for x in p.stdout.split("\0") if x]
+	return [repo_root / x for x in parts]
+
+
+def _git_yaml_blob_shas(repo_root: Path) -> Dict[Path, str]:
+	"""
+	Map tracked YAML files to their index blob SHA (`git ls-files -s`).
+	Files modified in the work tree are left out, since their blob SHA no
+	longer describes the content on disk.
+	"""
+	p = _run(
+		["git", "-C", str(repo_root), "ls-files", "-s", "-z", "--", "*.yml", "*.yaml"],
+		cwd=repo_root,
+	)
+	out: Dict[Path, str] = {}
+	for entry in p.stdout.split("\0"):
+		if not entry:
+			continue
+		meta, _, rel = entry.partition("\t")
+		fields = meta.split()
+		if len(fields) >= 2 and rel:
+			out[repo_root / rel] = fields[1]
+
+	m = _run(
+		["git", "-C", str(repo_root), "ls-files", "-m", "-z", "--", "*.yml", "*.yaml"],
+		cwd=repo_root,
+	)
+	for rel in m.stdout.split("\0"):
+		if rel:
+			out.pop(repo_root / rel, None)
+	return out
+
+
+# -----------------------------
+# Raw prefilter
+# -----------------------------
+
+# Never Flux HelmReleases/OCIRepositories we could patch: encrypted secrets and
+# templates that are rendered elsewhere.
+_EXCLUDED_SUFFIXES = (".sops.yaml", ".sops.yml", ".yaml.j2", ".yml.j2")
+
+# Both patterns must appear somewhere in a file before it is worth a ruamel
+# round-trip load. They are deliberately loose (a superset of real matches);
+# the parsed documents are still checked with _is_helmrelease/_is_ocirepository.
+_FLUX_KIND_RE = re.compile(rb"\bkind:[ \t]*[\"']?(?:HelmRelease|OCIRepository)\b")
+_FLUX_API_RE = re.compile(rb"\bapiVersion:[ \t]*[\"']?(?:helm|source)\.toolkit\.fluxcd\.io/")
+
+
+def _is_excluded_yaml(path: Path) -> bool:
+	return path.name.endswith(_EXCLUDED_SUFFIXES)
+
+
+def _prefilter_yaml_files(yaml_files: List[Path]) -> Tuple[List[Path], PrefilterStats]:
+	"""Return the files that may hold a Flux HelmRelease/OCIRepository, scanning raw bytes only."""
+	stats = PrefilterStats()
+	out: List[Path] = []
+	for fp in yaml_files:
+		if _is_excluded_yaml(fp):
+			stats.excluded_files += 1
+			try:
+				stats.excluded_bytes += fp.stat().st_size
+			except OSError:
+				pass
+			continue
+		try:
+			data = fp.read_bytes()
+		except OSError:
+			continue
+		if _FLUX_KIND_RE.search(data) and _FLUX_API_RE.search(data):
+			stats.candidate_files += 1
+			stats.candidate_bytes += len(data)
+			out.append(fp)
+		else:
+			stats.skipped_files += 1
+			stats.skipped_bytes += len(data)
+	return out, stats
+
+
+def _print_prefilter_report(stats: PrefilterStats) -> None:
+	total_files = stats.excluded_files + stats.skipped_files + stats.candidate_files
+	total_bytes = stats.excluded_bytes + stats.skipped_bytes + stats.candidate_bytes
+	print("Prefilter")
+	print(f"  Tracked  : {total_files} file(s), {total_bytes} byte(s)")
+	print(f"  Excluded : {stats.excluded_files} file(s), {stats.excluded_bytes} byte(s) (sops/jinja)")
+	print(f"  Skipped  : {stats.skipped_files} file(s), {stats.skipped_bytes} byte(s) (no Flux HelmRelease/OCIRepository)")
+	print(f"  Parsed   : {stats.candidate_files} file(s), {stats.candidate_bytes} byte(s)")
+
+
+# -----------------------------
+# YAML helpers
+# -----------------------------
+
+def _mk_yaml(explicit_start: bool) -> YAML:
+	yaml = YAML(typ="rt")
+	yaml.preserve_quotes = True
+	yaml.width = 4096
+	yaml.explicit_start = explicit_start
+	# keep mapping indentation sane; ruamel will still mostly preserve what exists
+	yaml.indent(mapping=2, sequence=4, offset=2)
+	return yaml
+
+
+def _read_all_yaml_docs(path: Path) -> Tuple[str, List[Any], YAML]:
+	raw = path.read_text(encoding="utf-8")
+	explicit_start = raw.lstrip().startswith("---")
+	yaml = _mk_yaml(explicit_start=explicit_start)
+	docs = list(yaml.load_all(raw))
+	return raw, docs, yaml
+
+
+def _dump_all_yaml_docs(yaml: YAML, docs: List[Any]) -> str:
+	from io import StringIO
+
+	buf = StringIO()
+	yaml.dump_all(docs, buf)
+	return buf.getvalue()
+
+
+def _insert_if_missing(m: CommentedMap, key: str, value: Any, *, after_keys: List[str]) -> None:
+	if key in m:
+		return
+	insert_at = len(m)
+	for ak in after_keys:
+		if ak in m:
+			insert_at = list(m.keys()).index(ak) + 1
+	m.insert(insert_at, key, value)
+
+
+# -----------------------------
+# KRR parsing
+# -----------------------------
+
+def _safe_float(v: Any) -> Optional[float]:
+	if v is None:
+		return None
+	if isinstance(v, str):
+		s = v.strip()
+		if s in ("", "?"):
+			return None
+		try:
+			return float(s)
+		except ValueError:
+			return None
+	try:
+		return float(v)
+	except (TypeError, ValueError):
+		return None
+
+
+RecValues = Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]
+
+
+def _extract_rec_values(scan: Dict[str, Any]) -> RecValues:
+	"""
+	Returns (req_cpu_cores, req_mem_bytes, lim_cpu_cores, lim_mem_bytes).
+
+	KRR structure we try to support:
+	- scan["recommended"]["requests"]["cpu"]["value"]
+	- scan["recommended"]["requests"]["memory"]["value"]
+	- scan["recommended"]["limits"]["cpu"]["value"]
+	- scan["recommended"]["limits"]["memory"]["value"]
+
+	Also handles value == "?" safely.
+	"""
+	rec = scan.get("recommended") or {}
+
+	def _num(section: str, resource: str) -> Optional[float]:
+		if not isinstance(rec, dict):
+			return None
+		sec = rec.get(section)
+		if not isinstance(sec, dict):
+			return None
+		res = sec.get(resource)
+		if not isinstance(res, dict):
+			return None
+		return _safe_float(res.get("value"))
+
+	return (
+		_num("requests", "cpu"),
+		_num("requests", "memory"),
+		_num("limits", "cpu"),
+		_num("limits", "memory"),
+	)
+
+
+def _extract_rec(scan: Dict[str, Any]) -> RecommendedResources:
+	return RecommendedResources(*_extract_rec_values(scan))
+
+
+def _merge_max(a: Optional[float], b: Optional[float]) -> Optional[float]:
+	if a is None:
+		return b
+	if b is None:
+		return a
+	return max(a, b)
+
+
+KrrSource = Union[Path, BinaryIO]
+
+
+def _iter_krr_scans(source: KrrSource, *, stream: bool) -> Iterator[Any]:
+	"""
+	Yield the elements of krr.json's top-level `scans` array.
+
+	`source` is a path or an already open binary stream (see _fetch_krr_from_pvc).
+	With stream=True the file is read incrementally with ijson, so only one
+	scan dict is alive at a time and memory stays flat as the file grows.
+	"""
+	if not stream:
+		if isinstance(source, Path):
+			data = json.loads(source.read_text(encoding="utf-8"))
+		else:
+			data = json.load(source)
+		yield from (data.get("scans") or [])
+		return
+
+	try:
+		import ijson
+	except ImportError:
+		raise SystemExit("ERROR: --stream-krr requires ijson (pip install ijson)")
+
+	if isinstance(source, Path):
+		with source.open("rb") as fh:
+			yield from ijson.items(fh, "scans.item", use_float=True)
+	else:
+		yield from ijson.items(source, "scans.item", use_float=True)
+
+
+def _iter_krr_targets(
+	source: KrrSource,
+	*,
+	min_severity: str,
+	stream: bool,
+	skipped_entries: Dict[Tuple[str, Optional[HrRef]], int],
+) -> Iterator[Tuple[str, str, str, str, RecValues]]:
+	"""
+	Yield (hr_namespace, hr_name, controller, container, rec values) for each
+	scan that passes the severity filter and has a non-empty recommendation.
+	Scans dropped by severity are counted into `skipped_entries`.
+
+	We rely on Flux labels:
+	- helm.toolkit.fluxcd.io/name
+	- helm.toolkit.fluxcd.io/namespace
+
+	And try to map controller using:
+	- app.kubernetes.io/controller
+	- app.kubernetes.io/name
+	- app.kubernetes.io/instance
+	- fallback to object.name
+	"""
+	severity_rank = {
+		"UNKNOWN": -1,
+		"OK": 0,
+		"GOOD": 0,
+		"WARNING": 1,
+		"CRITICAL": 2,
+	}
+	min_rank = severity_rank.get(min_severity.upper(), 1)
+
+	for scan in _iter_krr_scans(source, stream=stream):
+		if not isinstance(scan, dict):
+			continue
+		sev = str(scan.get("severity") or "UNKNOWN").upper()
+		if severity_rank.get(sev, -1) < min_rank:
+			obj = scan.get("object") or {}
+			labels = obj.get("labels") or {}
+			hr_name = labels.get("helm.toolkit.fluxcd.io/name") if isinstance(labels, dict) else None
+			hr_ns = labels.get("helm.toolkit.fluxcd.io/namespace") if isinstance(labels, dict) else None
+			hr_ref = HrRef(namespace=str(hr_ns), name=str(hr_name)) if hr_name and hr_ns else None
+			skipped_entries[(sev, hr_ref)] = skipped_entries.get((sev, hr_ref), 0) + 1
+			continue
+
+		obj = scan.get("object") or {}
+		labels = obj.get("labels") or {}
+		if not isinstance(labels, dict):
+			labels = {}
+
+		hr_name = labels.get("helm.toolkit.fluxcd.io/name")
+		hr_ns = labels.get("helm.toolkit.fluxcd.io/namespace")
+		if not hr_name or not hr_ns:
+			continue
+
+		controller = (
+			labels.get("app.kubernetes.io/controller")
+			or labels.get("app.kubernetes.io/name")
+			or labels.get("app.kubernetes.io/instance")
+			or obj.get("name")
+			or ""
+		)
+		controller = str(controller)
+
+		# container name is usually scan["container"]; sometimes it may exist under object
+		container = scan.get("container") or obj.get("container") or ""
+		container = str(container)
+
+		if not controller or not container:
+			continue
+
+		values = _extract_rec_values(scan)
+
+		# skip entirely empty recs (all unknown)
+		if all(v is None for v in values):
+			continue
+
+		yield str(hr_ns), str(hr_name), controller, container, values
+
+
+def _aggregate_krr(
+	source: KrrSource, *, min_severity: str, stream: bool = False
+) -> Tuple[Dict[TargetKey, RecommendedResources], Dict[Tuple[str, Optional[HrRef]], int]]:
+	"""
+	Returns a tuple of:
+	  - map: (HR ns/name, controller, container) -> max(recommended resources)
+	  - skipped_entries: (severity, HrRef|None) -> count of scans dropped by severity filter
+	    HrRef is None when the scan lacks Flux labels (can never match a HR).
+	"""
+	skipped_entries: Dict[Tuple[str, Optional[HrRef]], int] = {}
+	targets = _iter_krr_targets(source, min_severity=min_severity, stream=stream, skipped_entries=skipped_entries)
+	out: Dict[TargetKey, RecommendedResources] = {}
+	for hr_ns, hr_name, controller, container, values in targets:
+		rec = RecommendedResources(*values)
+		key = TargetKey(hr=HrRef(namespace=hr_ns, name=hr_name), controller=controller, container=container)
+
+		prev = out.get(key)
+		if prev is None:
+			out[key] = rec
+		else:
+			prev.req_cpu_cores = _merge_max(prev.req_cpu_cores, rec.req_cpu_cores)
+			prev.req_mem_bytes = _merge_max(prev.req_mem_bytes, rec.req_mem_bytes)
+			prev.lim_cpu_cores = _merge_max(prev.lim_cpu_cores, rec.lim_cpu_cores)
+			prev.lim_mem_bytes = _merge_max(prev.lim_mem_bytes, rec.lim_mem_bytes)
+
+	return out, skipped_entries
+
+
+# -----------------------------
+# KRR fetch (from PVC)
+# -----------------------------
+
+class _ExecStdout(io.RawIOBase):
+	"""
+	Blocking binary reader over the stdout channel of a Kubernetes exec
+	websocket. Raises TimeoutError once `timeout` seconds pass without any
+	output, however long the whole file takes to arrive.
+	"""
+
+	def __init__(self, resp: Any, *, timeout: float) -> None:
+		self._resp = resp
+		self._timeout = timeout
+		self._deadline = time.monotonic() + timeout
+		self._buf = b""
+		self.stderr = b""
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, b: Any) -> int:
+		while not self._buf:
+			if self._resp.peek_stdout():
+				self._buf = self._resp.read_stdout()
+				self._deadline = time.monotonic() + self._timeout
+				continue
+			if self._resp.peek_stderr():
+				self.stderr += self._resp.read_stderr()
+				self._deadline = time.monotonic() + self._timeout
+				continue
+			if not self._resp.is_open():
+				return 0
+			if time.monotonic() > self._deadline:
+				raise TimeoutError("timed out reading krr.json from exec stream")
+			self._resp.update(timeout=1)
+		n = min(len(b), len(self._buf))
+		b[:n] = self._buf[:n]
+		self._buf = self._buf[n:]
+		return n
+
+
+def _kube_clients() -> Tuple[Any, Any]:
+	try:
+		from kubernetes import client, config
+	except ImportError:
+		raise SystemExit("ERROR: --from-pvc requires the kubernetes package (pip install kubernetes)")
+	try:
+		config.load_kube_config()
+	except Exception:
+		config.load_incluster_config()
+	return client.CoreV1Api(), client.BatchV1Api()
+
+
+def _run_cronjob_once(core: Any, batch: Any, *, namespace: str, cronjob: str, timeout: float) -> None:
+	"""
+	Equivalent of `kubectl create job --from=cronjob/<name>` followed by waiting
+	for completion. Does nothing if the CronJob does not exist. The Job is
+	deleted afterwards; on failure or timeout its pod logs are printed first
+	and SystemExit(2) is raised.
+	"""
+	from kubernetes import client, watch
+	from kubernetes.client.rest import ApiException
+
+	try:
+		cj = batch.read_namespaced_cron_job(cronjob, namespace)
+	except ApiException as e:
+		if e.status == 404:
+			return
+		raise
+
+	job_name = f"{cronjob}-manual-{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+	template = cj.spec.job_template
+	tmeta = template.metadata
+	job = client.V1Job(
+		metadata=client.V1ObjectMeta(
+			name=job_name,
+			namespace=namespace,
+			labels=(tmeta.labels if tmeta else None),
+			annotations={**((tmeta.annotations or {}) if tmeta else {}), "cronjob.kubernetes.io/instantiate": "manual"},
+			owner_references=[
+				client.V1OwnerReference(
+					api_version="batch/v1",
+					kind="CronJob",
+					name=cj.metadata.name,
+					uid=cj.metadata.uid,
+					controller=True,
+				)
+			],
+		),
+		spec=template.spec,
+	)
+	print(f"Triggering cronjob {cronjob} as job/{job_name} in namespace {namespace}...", file=sys.stderr)
+	batch.create_namespaced_job(namespace, job)
+
+	outcome = None
+	deadline = time.monotonic() + timeout
+	try:
+		w = watch.Watch()
+		while outcome is None and time.monotonic() < deadline:
+			remaining = max(1, int(deadline - time.monotonic()))
+			for ev in w.stream(
+				batch.list_namespaced_job,
+				namespace,
+				field_selector=f"metadata.name={job_name}",
+				timeout_seconds=remaining,
+			):
+				for cond in (ev["object"].status.conditions or []):
+					if cond.status == "True" and cond.type in ("Complete", "Failed"):
+						outcome = cond.type
+				if outcome is not None:
+					w.stop()
+					break
+
+		if outcome != "Complete":
+			what = "failed" if outcome == "Failed" else f"did not complete within {timeout:g}s"
+			print(f"ERROR: job {job_name} {what}", file=sys.stderr)
+			pods = core.list_namespaced_pod(namespace, label_selector=f"job-name={job_name}")
+			for pod in pods.items:
+				with contextlib.suppress(ApiException):
+					print(core.read_namespaced_pod_log(pod.metadata.name, namespace), file=sys.stderr)
+			raise SystemExit(2)
+		print(f"Job {job_name} completed; cleaning up job resource...", file=sys.stderr)
+	finally:
+		with contextlib.suppress(ApiException):
+			batch.delete_namespaced_job(job_name, namespace, propagation_policy="Background")
+
+
+@contextlib.contextmanager
+def _fetch_krr_from_pvc(
+	*,
+	namespace: str,
+	pvc: str,
+	cronjob: str,
+	job_timeout: float,
+	pod_timeout: float,
+	read_timeout: float,
+) -> Iterator[BinaryIO]:
+	"""
+	Run the krr CronJob once, then yield /data/krr.json from the PVC as a
+	binary stream. The file is read through a single exec (`cat`) in a
+	short-lived pod, with no tar/`kubectl cp` round trip or local copy. The
+	pod is deleted when the context exits.
+	"""
+	from kubernetes import client, watch
+	from kubernetes.client.rest import ApiException
+	from kubernetes.stream import stream
+
+	core, batch = _kube_clients()
+	_run_cronjob_once(core, batch, namespace=namespace, cronjob=cronjob, timeout=job_timeout)
+
+	pod = client.V1Pod(
+		metadata=client.V1ObjectMeta(generate_name="krr-fetch-", namespace=namespace),
+		spec=client.V1PodSpec(
+			restart_policy="Never",
+			containers=[
+				client.V1Container(
+					name="krr",
+					image="alpine:latest",
+					command=["sh", "-c", "sleep 3600"],
+					volume_mounts=[client.V1VolumeMount(name="krr", mount_path="/data", read_only=True)],
+				)
+			],
+			volumes=[
+				client.V1Volume(
+					name="krr",
+					persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(claim_name=pvc, read_only=True),
+				)
+			],
+		),
+	)
+	pod_name = core.create_namespaced_pod(namespace, pod).metadata.name
+	try:
+		ready = False
+		w = watch.Watch()
+		for ev in w.stream(
+			core.list_namespaced_pod,
+			namespace,
+			field_selector=f"metadata.name={pod_name}",
+			timeout_seconds=max(1, int(pod_timeout)),
+		):
+			conds = ev["object"].status.conditions or []
+			if any(c.type == "Ready" and c.status == "True" for c in conds):
+				ready = True
+				w.stop()
+				break
+		if not ready:
+			print(f"ERROR: pod {pod_name} not ready within {pod_timeout:g}s", file=sys.stderr)
+			raise SystemExit(2)
+
+		resp = stream(
+			core.connect_get_namespaced_pod_exec,
+			pod_name,
+			namespace,
+			command=["cat", "/data/krr.json"],
+			container="krr",
+			stdin=False,
+			stdout=True,
+			stderr=True,
+			tty=False,
+			binary=True,
+			_preload_content=False,
+		)
+		reader = _ExecStdout(resp, timeout=read_timeout)
+		try:
+			yield io.BufferedReader(reader)
+		except TimeoutError as e:
+			print(f"ERROR: {e}: no output for {read_timeout:g}s (see --read-timeout)", file=sys.stderr)
+			raise SystemExit(2)
+		except Exception:
+			# a failed `cat` shows up as truncated/empty JSON; report its stderr instead
+			if not reader.stderr:
+				raise
+		finally:
+			resp.close()
+		if reader.stderr:
+			err = reader.stderr.decode("utf-8", "replace").strip()
+			print(f"ERROR: failed to read /data/krr.json from PVC {pvc} in namespace {namespace}: {err}", file=sys.stderr)
+			raise SystemExit(2)
+	finally:
+		with contextlib.suppress(ApiException):
+			core.delete_namespaced_pod(pod_name, namespace, grace_period_seconds=0)
+
+
+# -----------------------------
+# HelmRelease matching
+# -----------------------------
+
+def _is_helmrelease(doc: Any) -> bool:
+	if not isinstance(doc, dict):
+		return False
+	if str(doc.get("kind", "")) != "HelmRelease":
+		return False
+	api = str(doc.get("apiVersion", ""))
+	return api.startswith("helm.toolkit.fluxcd.io/")
+
+
+def _hr_doc_info(doc: Dict[str, Any], doc_index: int) -> HrDocInfo:
+	meta = doc.get("metadata") or {}
+	if not isinstance(meta, dict):
+		meta = {}
+	spec = doc.get("spec") or {}
+	if not isinstance(spec, dict):
+		spec = {}
+
+	chart_ref = spec.get("chartRef") or {}
+	if not isinstance(chart_ref, dict):
+		chart_ref = {}
+	chart = spec.get("chart") or {}
+	chart_spec = chart.get("spec") or {} if isinstance(chart, dict) else {}
+	if not isinstance(chart_spec, dict):
+		chart_spec = {}
+
+	return HrDocInfo(
+		doc_index=doc_index,
+		name=str(meta.get("name") or ""),
+		namespace=str(meta.get("namespace") or ""),
+		chartref_kind=str(chart_ref.get("kind") or ""),
+		chartref_name=str(chart_ref.get("name") or ""),
+		chart=str(chart_spec.get("chart") or ""),
+	)
+
+
+def _hr_ref_from_info(info: HrDocInfo) -> HrRef:
+	return HrRef(namespace=info.namespace or "default", name=info.name)
+
+
+def _infer_namespace_from_path(repo_root: Path, file_path: Path) -> Optional[str]:
+	"""
+	Heuristics for common homelab repo layouts:
+	- .../apps/<namespace>/<app>/...
+	- .../namespaces/<namespace>/...
+	"""
+	try:
+		rel = file_path.relative_to(repo_root)
+	except Exception:
+		rel = file_path
+
+	parts = list(rel.parts)
+	for i, p in enumerate(parts):
+		if p == "apps" and i + 1 < len(parts):
+			ns = parts[i + 1]
+			if ns and ns not in ("base", "common", "_templates", "templates"):
+				return ns
+		if p in ("namespace", "namespaces") and i + 1 < len(parts):
+			ns = parts[i + 1]
+			if ns:
+				return ns
+	return None
+
+
+def _is_app_template_hr(info: HrDocInfo, *, chart_name: str, chartref_kind: str, ocirepo_index: Optional[Dict[str, List[str]]] = None) -> bool:
+	"""
+	Determine if a HelmRelease doc uses the given app-template chart.
+	If the HelmRelease references an OCIRepository by name (common pattern where
+	each app has its own OCIRepository resource named after the app), we consult
+	`ocirepo_index` to see whether that OCIRepository points to an upstream
+	`app-template` chart URL.
+	"""
+	# chartRef style (your repo): spec.chartRef.kind/name
+	cr_kind = info.chartref_kind
+	cr_name = info.chartref_name
+	if cr_kind == chartref_kind and cr_name == chart_name:
+		return True
+	# If the chartRef references an OCIRepository named after the app, try
+	# to resolve that repo's URL and see if it points to the app-template
+	if cr_kind == chartref_kind and ocirepo_index is not None and cr_name:
+		urls = ocirepo_index.get(cr_name) or []
+		for u in urls:
+			if isinstance(u, str) and chart_name in u:
+				return True
+
+	# chart.spec.chart style: spec.chart.spec.chart
+	if info.chart == chart_name:
+		return True
+
+	return False
+
+
+# -----------------------------
+# app-template patching
+# -----------------------------
+
+def _cpu_qty(cores: float) -> str:
+	# cores -> millicores, round up to avoid undersizing
+	m = int(math.ceil(cores * 1000.0))
+	if m <= 0:
+		m = 1
+	if m % 1000 == 0:
+		return str(m // 1000)
+	return f"{m}m"
+
+
+def _mem_qty(bytes_val: float) -> str:
+	# bytes -> Mi, round up. Use Gi if divisible by 1024Mi.
+	mib = int(math.ceil(bytes_val / (1024.0 * 1024.0)))
+	if mib <= 0:
+		mib = 1
+	if mib % 1024 == 0:
+		return f"{mib // 1024}Gi"
+	return f"{mib}Mi"
+
+
+def _quantize_rec(rec: RecommendedResources) -> Dict[str, str]:
+	"""The quantities _apply_to_hr_doc would write, keyed by "section.field"."""
+	out: Dict[str, str] = {}
+	if rec.req_cpu_cores is not None:
+		out["requests.cpu"] = _cpu_qty(rec.req_cpu_cores)
+	if rec.req_mem_bytes is not None:
+		out["requests.memory"] = _mem_qty(rec.req_mem_bytes)
+	if rec.lim_cpu_cores is not None:
+		out["limits.cpu"] = _cpu_qty(rec.lim_cpu_cores)
+	if rec.lim_mem_bytes is not None:
+		out["limits.memory"] = _mem_qty(rec.lim_mem_bytes)
+	return out
+
+
+def _qty_value(qty: str) -> Optional[float]:
+	# Inverse of _cpu_qty/_mem_qty: cores, or MiB
+	q = str(qty).strip()
+	try:
+		if q.endswith("m"):
+			return float(q[:-1]) / 1000.0
+		if q.endswith("Gi"):
+			return float(q[:-2]) * 1024.0
+		if q.endswith("Mi"):
+			return float(q[:-2])
+		return float(q)
+	except ValueError:
+		return None
+
+
+def _within_hysteresis(old: Dict[str, str], new: Dict[str, str], *, pct: float) -> bool:
+	"""True if `new` matches `old` field for field, each within pct percent."""
+	if old.keys() != new.keys():
+		return False
+	for k, new_q in new.items():
+		old_q = old[k]
+		if old_q == new_q:
+			continue
+		ov, nv = _qty_value(old_q), _qty_value(new_q)
+		if ov is None or nv is None or ov <= 0:
+			return False
+		if abs(nv - ov) / ov * 100.0 >= pct:
+			return False
+	return True
+
+
+def _norm_name(s: str) -> str:
+	# Normalize common naming differences (case and '_' vs '-')
+	return str(s).strip().lower().replace("_", "-")
+
+
+class KeyMatchIndex:
+	"""
+	Lookup tables over one mapping's keys (controllers or containers), so the
+	pickers below resolve a wanted name without rescanning every key.
+	"""
+
+	def __init__(self, m: CommentedMap) -> None:
+		self.source = m
+		self.keys: List[Any] = list(m.keys())
+		# str(key) -> first key with that string form
+		self.exact: Dict[str, Any] = {}
+		# normalized name -> keys, in map order
+		self.norm: Dict[str, List[Any]] = {}
+		for k in self.keys:
+			self.exact.setdefault(str(k), k)
+			self.norm.setdefault(_norm_name(str(k)), []).append(k)
+		self.non_empty: List[Any] = [k for k in self.keys if str(k).strip()]
+
+	def suffix_matches(self, nw: str) -> List[Any]:
+		"""Keys whose normalized name nk satisfies nw.endswith(f"-{nk}")."""
+		out: List[Any] = []
+		i = nw.find("-")
+		while i != -1:
+			suffix = nw[i + 1:]
+			if suffix:
+				out.extend(self.norm.get(suffix) or [])
+			i = nw.find("-", i + 1)
+		return out
+
+
+class DocMatchIndex:
+	"""Per-HelmRelease-doc cache of KeyMatchIndex, one per controllers/containers map."""
+
+	def __init__(self) -> None:
+		self._by_map: Dict[int, KeyMatchIndex] = {}
+
+	def get(self, m: CommentedMap) -> KeyMatchIndex:
+		idx = self._by_map.get(id(m))
+		# keys are never added to these maps while patching, so the size check
+		# only guards against a map being replaced and its id reused
+		if idx is None or idx.source is not m or len(idx.keys) != len(m):
+			idx = self._by_map[id(m)] = KeyMatchIndex(m)
+		return idx
+
+
+def _pick_controller_key(controllers: CommentedMap, wanted: str, hr_name: str, index: Optional[KeyMatchIndex] = None) -> Optional[Any]:
+	idx = index if index is not None else KeyMatchIndex(controllers)
+	k = idx.exact.get(wanted)
+	if k is not None:
+		return k
+
+	# Prefer normalized exact match first (case and '_' vs '-').
+	nw = _norm_name(wanted)
+	exact_norm = idx.norm.get(nw) or []
+	if len(exact_norm) == 1:
+		return exact_norm[0]
+
+	# Support names like "<workload>-<controller>" when KRR/controller labels
+	# include prefixes but Helm values use short controller keys.
+	if nw:
+		suffix_matches = idx.suffix_matches(nw)
+		if len(suffix_matches) == 1:
+			return suffix_matches[0]
+
+	# If controller label equals HR name and there is exactly one explicit
+	# non-empty controller key, use it.
+	if nw and nw == _norm_name(hr_name):
+		if len(idx.non_empty) == 1:
+			return idx.non_empty[0]
+
+	# Only allow single-controller fallback. For multi-controller charts,
+	# forcing "main"/HR-name fallback can patch the wrong controller.
+	if len(idx.keys) == 1:
+		return idx.keys[0]
+	return None
+
+
+def _pick_container_key(containers: CommentedMap, wanted: str, index: Optional[KeyMatchIndex] = None) -> Optional[Any]:
+	idx = index if index is not None else KeyMatchIndex(containers)
+	k = idx.exact.get(wanted)
+	if k is not None:
+		return k
+
+	# Try normalized key matching and common KRR naming variants like
+	# "<workload>-<container>" (for example: "dispatcharr-celery" -> "celery").
+	nw = _norm_name(wanted)
+	exact_norm = idx.norm.get(nw) or []
+	if len(exact_norm) == 1:
+		return exact_norm[0]
+
+	if nw:
+		suffix_matches = idx.suffix_matches(nw)
+		if len(suffix_matches) == 1:
+			return suffix_matches[0]
+
+	# Only allow single-container fallback. For multi-container controllers,
+	# fallback-to-app/main is unsafe and can patch the wrong container.
+	if len(idx.keys) == 1:
+		return idx.keys[0]
+	return None
+
+
+def _apply_to_hr_doc(
+	doc: CommentedMap,
+	*,
+	target: TargetKey,
+	rec: RecommendedResources,
+	only_missing: bool,
+	match_index: Optional[DocMatchIndex] = None,
+) -> Tuple[str, List[str], bool]:
+	"""
+	Returns (status, notes, dirty) where status is 'changed', 'ok', or 'skip'.
+	dirty is True whenever the doc was mutated, which can also happen on
+	'skip' when missing spec/values/controllers maps were created first.
+	"""
+	changed = False
+	notes: List[str] = []
+
+	spec = doc.get("spec")
+	if not isinstance(spec, CommentedMap):
+		spec = CommentedMap()
+		doc["spec"] = spec
+		changed = True
+
+	values = spec.get("values")
+	if not isinstance(values, CommentedMap):
+		values = CommentedMap()
+		spec["values"] = values
+		changed = True
+
+	controllers = values.get("controllers")
+	if not isinstance(controllers, CommentedMap):
+		controllers = CommentedMap()
+		values["controllers"] = controllers
+		changed = True
+
+	if match_index is None:
+		match_index = DocMatchIndex()
+
+	ctrl_key = _pick_controller_key(controllers, target.controller, target.hr.name, match_index.get(controllers))
+	if ctrl_key is None:
+		notes.append(f"SKIP: controller {target.controller!r} not found (controllers: {[str(k) for k in controllers.keys()]})")
+		return "skip", notes, changed
+	if str(ctrl_key) != target.controller:
+		notes.append(f"NOTE: mapped controller {target.controller!r} -> {str(ctrl_key)!r}")
+
+	ctrl_def = controllers.get(ctrl_key)
+	if not isinstance(ctrl_def, CommentedMap):
+		ctrl_def = CommentedMap()
+		controllers[ctrl_key] = ctrl_def
+		changed = True
+
+	containers = ctrl_def.get("containers")
+	if not isinstance(containers, CommentedMap):
+		containers = CommentedMap()
+		_insert_if_missing(ctrl_def, "containers", containers, after_keys=["pod", "cronjob", "statefulset", "deployment", "type"])
+		changed = True
+
+	ctr_key = _pick_container_key(containers, target.container, match_index.get(containers))
+	if ctr_key is None:
+		notes.append(f"SKIP: container {target.container!r} not found (containers: {[str(k) for k in containers.keys()]})")
+		return "skip", notes, changed
+	if str(ctr_key) != target.container:
+		notes.append(f"NOTE: mapped container {target.container!r} -> {str(ctr_key)!r}")
+
+	ctr_def = containers.get(ctr_key)
+	if not isinstance(ctr_def, CommentedMap):
+		ctr_def = CommentedMap()
+		containers[ctr_key] = ctr_def
+		changed = True
+
+	resources = ctr_def.get("resources")
+	if not isinstance(resources, CommentedMap):
+		resources = CommentedMap()
+		_insert_if_missing(ctr_def, "resources", resources, after_keys=["securityContext", "probes", "envFrom", "env", "args", "command", "image"])
+		changed = True
+
+	def _set(section: str, field: str, new_val: str) -> None:
+		nonlocal changed
+		sec = resources.get(section)
+		if not isinstance(sec, CommentedMap):
+			sec = CommentedMap()
+			_insert_if_missing(resources, section, sec, after_keys=["requests" if section == "limits" else ""])
+			changed = True
+
+		old = sec.get(field)
+		if only_missing and old is not None:
+			notes.append(f"SKIP: {section}.{field} already set ({old!r})")
+			return
+
+		if old != new_val:
+			sec[field] = new_val
+			changed = True
+			notes.append(f"{section}.{field}: {old!r} -> {new_val!r}")
+
+	if rec.req_cpu_cores is not None:
+		_set("requests", "cpu", _cpu_qty(rec.req_cpu_cores))
+	if rec.req_mem_bytes is not None:
+		_set("requests", "memory", _mem_qty(rec.req_mem_bytes))
+	if rec.lim_cpu_cores is not None:
+		_set("limits", "cpu", _cpu_qty(rec.lim_cpu_cores))
+	if rec.lim_mem_bytes is not None:
+		_set("limits", "memory", _mem_qty(rec.lim_mem_bytes))
+
+	return ("changed" if changed else "ok"), notes, changed
+
+
+# -----------------------------
+# Repo indexing
+# -----------------------------
+
+def _report_phase(name: str, t0: float, **counts: Any) -> None:
+	dt = time.perf_counter() - t0
+	extra = " ".join(f"{k}={v}" for k, v in counts.items())
+	print(f"TIMING: {name}: {dt:.3f}s {extra}".rstrip(), file=sys.stderr)
+
+
+def _is_ocirepository(doc: Any) -> bool:
+	if not isinstance(doc, dict):
+		return False
+	if str(doc.get("kind", "")) != "OCIRepository":
+		return False
+	api = str(doc.get("apiVersion", ""))
+	return api.startswith("source.toolkit.fluxcd.io/")
+
+
+def _file_index_from_docs(docs: List[Any]) -> FileIndex:
+	out = FileIndex()
+	for i, doc in enumerate(docs):
+		if _is_ocirepository(doc):
+			meta = doc.get("metadata") or {}
+			name = str(meta.get("name") or "")
+			if not name:
+				continue
+			spec = doc.get("spec") or {}
+			url = spec.get("url") if isinstance(spec, dict) else None
+			if isinstance(url, str):
+				out.ocirepos.append((name, url))
+		elif _is_helmrelease(doc):
+			out.hrs.append(_hr_doc_info(doc, i))
+	return out
+
+
+def _parse_one_yaml_file(fp: Path) -> Tuple[Path, Optional[FileIndex]]:
+	"""Process-pool worker: returns only the small FileIndex, never the parsed tree."""
+	try:
+		_, docs, _ = _read_all_yaml_docs(fp)
+	except Exception:
+		return fp, None
+	return fp, _file_index_from_docs(docs)
+
+
+def _parse_yaml_files(
+	yaml_files: List[Path], *, jobs: int = 1
+) -> Tuple[Dict[Path, FileIndex], Dict[Path, Tuple[str, List[Any], YAML]], int]:
+	"""
+	Parse each file once, collecting OCIRepository URLs and HelmRelease docs
+	together. Returns (per-file index, parsed files holding a HelmRelease, failures).
+	Unparseable files get an empty FileIndex so they can be cached as such.
+
+	With jobs > 1 the files are parsed in a process pool. Only FileIndex records
+	come back, so no parsed files are returned; the ones that need patching are
+	re-loaded later by the caller.
+	"""
+	records: Dict[Path, FileIndex] = {}
+	loaded: Dict[Path, Tuple[str, List[Any], YAML]] = {}
+	failed = 0
+
+	if jobs > 1 and len(yaml_files) > 1:
+		chunksize = max(1, len(yaml_files) // (jobs * 4))
+		with ProcessPoolExecutor(max_workers=jobs) as pool:
+			for fp, rec in pool.map(_parse_one_yaml_file, yaml_files, chunksize=chunksize):
+				if rec is None:
+					failed += 1
+					rec = FileIndex()
+				records[fp] = rec
+		return records, loaded, failed
+
+	for fp in yaml_files:
+		try:
+			raw, docs, yaml = _read_all_yaml_docs(fp)
+		except Exception:
+			failed += 1
+			records[fp] = FileIndex()
+			continue
+		rec = _file_index_from_docs(docs)
+		records[fp] = rec
+		if rec.hrs:
+			loaded[fp] = (raw, docs, yaml)
+	return records, loaded, failed
+
+
+def _assemble_yaml_index(
+	repo_root: Path,
+	yaml_files: List[Path],
+	records: Dict[Path, FileIndex],
+	loaded: Dict[Path, Tuple[str, List[Any], YAML]],
+) -> YamlIndex:
+	"""Merge per-file records in tracked-file order, so cached and parsed runs index identically."""
+	out = YamlIndex(loaded=loaded)
+	for fp in yaml_files:
+		rec = records.get(fp)
+		if rec is None:
+			continue
+		for name, url in rec.ocirepos:
+			out.ocirepo_index.setdefault(name, []).append(url)
+		if rec.hrs:
+			ns_guess = _infer_namespace_from_path(repo_root, fp)
+			for info in rec.hrs:
+				out.hr_candidates.append((fp, info, ns_guess))
+	return out
+
+
+def _build_hr_index(
+	yaml_index: YamlIndex, *, chart_name: str, chartref_kind: str
+) -> Tuple[Dict[HrRef, List[HrDocLoc]], Dict[str, List[HrDocLoc]]]:
+	"""Filter indexed HelmReleases down to app-template ones, keyed by HrRef and by name."""
+	hr_index: Dict[HrRef, List[HrDocLoc]] = {}
+	hr_index_by_name: Dict[str, List[HrDocLoc]] = {}
+
+	for fp, info, ns_guess in yaml_index.hr_candidates:
+		if not _is_app_template_hr(info, chart_name=chart_name, chartref_kind=chartref_kind, ocirepo_index=yaml_index.ocirepo_index):
+			continue
+
+		ref = _hr_ref_from_info(info)
+		if not ref.name:
+			continue
+
+		# If metadata.namespace missing, infer from path to avoid "default/" mismatches
+		if (not info.namespace) and ns_guess:
+			ref = HrRef(namespace=ns_guess, name=ref.name)
+
+		loc = HrDocLoc(path=fp, doc_index=info.doc_index)
+		hr_index.setdefault(ref, []).append(loc)
+		hr_index_by_name.setdefault(ref.name, []).append(loc)
+
+	return hr_index, hr_index_by_name
+
+
+# -----------------------------
+# Index cache
+# -----------------------------
+
+# Bump whenever FileIndex/HrDocInfo or the extraction rules change shape.
+SCRIPT_VERSION = "1"
+
+
+def _default_cache_dir() -> Path:
+	base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+	return Path(base) / "apply-krr"
+
+
+def _cache_key(*, chart_name: str, chartref_kind: str) -> str:
+	h = hashlib.sha256()
+	for part in (SCRIPT_VERSION, chart_name, chartref_kind):
+		h.update(part.encode("utf-8"))
+		h.update(b"\0")
+	return h.hexdigest()
+
+
+def _file_index_to_json(rec: FileIndex) -> Dict[str, Any]:
+	return {
+		"ocirepos": [list(x) for x in rec.ocirepos],
+		"hrs": [
+			[h.doc_index, h.name, h.namespace, h.chartref_kind, h.chartref_name, h.chart]
+			for h in rec.hrs
+		],
+	}
+
+
+def _file_index_from_json(data: Dict[str, Any]) -> FileIndex:
+	return FileIndex(
+		ocirepos=[(str(n), str(u)) for n, u in data.get("ocirepos") or []],
+		hrs=[
+			HrDocInfo(int(i), str(n), str(ns), str(k), str(cn), str(ch))
+			for i, n, ns, k, cn, ch in data.get("hrs") or []
+		],
+	)
+
+
+def _load_index_cache(path: Path, key: str) -> Dict[str, FileIndex]:
+	"""Returns blob SHA -> FileIndex, or {} when the cache is missing, corrupt or stale."""
+	try:
+		data = json.loads(path.read_text(encoding="utf-8"))
+	except (OSError, ValueError):
+		return {}
+	if not isinstance(data, dict) or data.get("key") != key:
+		return {}
+	out: Dict[str, FileIndex] = {}
+	for sha, rec in (data.get("files") or {}).items():
+		try:
+			out[sha] = _file_index_from_json(rec)
+		except (TypeError, ValueError):
+			continue
+	return out
+
+
+def _save_index_cache(path: Path, key: str, entries: Dict[str, FileIndex]) -> None:
+	payload = {
+		"key": key,
+		"files": {sha: _file_index_to_json(rec) for sha, rec in sorted(entries.items())},
+	}
+	path.parent.mkdir(parents=True, exist_ok=True)
+	tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+	tmp.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+	os.replace(tmp, path)
+
+
+# -----------------------------
+# Applied snapshot
+# -----------------------------
+
+def _load_snapshot(path: Path) -> Dict[TargetKey, Dict[str, str]]:
+	"""Last applied quantities per target; {} when the snapshot does not exist yet."""
+	try:
+		data = json.loads(path.read_text(encoding="utf-8"))
+	except FileNotFoundError:
+		return {}
+	except (OSError, ValueError) as e:
+		print(f"WARNING: ignoring unreadable snapshot {path}: {e}", file=sys.stderr)
+		return {}
+
+	out: Dict[TargetKey, Dict[str, str]] = {}
+	for t in data.get("targets") or []:
+		try:
+			key = TargetKey(
+				hr=HrRef(namespace=str(t["namespace"]), name=str(t["name"])),
+				controller=str(t["controller"]),
+				container=str(t["container"]),
+			)
+		except (KeyError, TypeError):
+			continue
+		out[key] = {str(k): str(v) for k, v in (t.get("applied") or {}).items()}
+	return out
+
+
+def _render_snapshot(snapshot: Dict[TargetKey, Dict[str, str]]) -> str:
+	targets = [
+		{
+			"namespace": k.hr.namespace,
+			"name": k.hr.name,
+			"controller": k.controller,
+			"container": k.container,
+			"applied": dict(sorted(v.items())),
+		}
+		for k, v in sorted(snapshot.items(), key=lambda kv: (kv[0].hr.namespace, kv[0].hr.name, kv[0].controller, kv[0].container))
+	]
+	return json.dumps({"version": 1, "targets": targets}, indent=2) + "\n"
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+	ap = argparse.ArgumentParser(
+		description="Apply KRR resource recommendations to Flux HelmReleases using bjw-s app-template (git-aware).",
+	)
+	ap.add_argument("--krr-json", type=Path, help="Path to krr.json (KRR output JSON). Required unless --from-pvc or --prefilter-report.")
+	ap.add_argument("--from-pvc", action="store_true", help="Run the krr CronJob once and read krr.json straight from its PVC via the Kubernetes API.")
+	ap.add_argument("--krr-pvc", default="krr", help="PVC holding /data/krr.json for --from-pvc (default: krr).")
+	ap.add_argument("--krr-namespace", default="default", help="Namespace of the krr CronJob and PVC (default: default).")
+	ap.add_argument("--krr-cronjob", default="krr", help="CronJob to trigger before fetching; skipped if absent (default: krr).")
+	ap.add_argument("--job-timeout", type=float, default=300, help="Seconds to wait for the triggered krr Job (default: 300).")
+	ap.add_argument("--pod-timeout", type=float, default=30, help="Seconds to wait for the fetch pod to be Ready (default: 30).")
+	ap.add_argument("--read-timeout", type=float, default=60, help="Seconds without output from the fetch pod before reading krr.json fails (default: 60).")
+	ap.add_argument("--repo", default=".", type=Path, help="Path anywhere inside the git repo (default: .).")
+	ap.add_argument("--chart-name", default="app-template", help="Chart name to match (default: app-template).")
+	ap.add_argument("--chartref-kind", default="OCIRepository", help="chartRef.kind to match (default: OCIRepository).")
+	ap.add_argument("--min-severity", default="WARNING", help="Min severity: OK/GOOD/WARNING/CRITICAL (default: WARNING).")
+	ap.add_argument("--only-missing", action="store_true", help="Only set fields that are currently missing.")
+	ap.add_argument("--no-name-fallback", action="store_true", help="Disable unique name-only matching fallback.")
+	ap.add_argument("--exclude", action="append", default=[], help="HelmRelease names to exclude; repeatable or comma-separated.")
+	ap.add_argument("--write", action="store_true", help="Write changes (default: dry-run).")
+	ap.add_argument("--stage", action="store_true", help="git add changed files (implies --write).")
+	ap.add_argument("--commit", action="store_true", help="git commit changed files (implies --stage).")
+	ap.add_argument("--commit-message", default="chore: apply krr resource recommendations", help="Commit message.")
+	ap.add_argument("--stream-krr", action="store_true", help="Read krr.json incrementally (flat memory for very large files; needs ijson).")
+	ap.add_argument("--jobs", type=int, default=1, help="Parse YAML files in N worker processes (default: 1, serial).")
+	ap.add_argument("--cache-dir", type=Path, default=_default_cache_dir(), help="Directory for the per-blob YAML index cache (default: $XDG_CACHE_HOME/apply-krr).")
+	ap.add_argument("--no-cache", action="store_true", help="Ignore the index cache and rebuild it from scratch.")
+	ap.add_argument("--snapshot", type=Path, help="JSON file (relative to the repo root) recording the last applied recommendation per target; targets whose quantized values are unchanged are skipped.")
+	ap.add_argument("--hysteresis", type=float, default=0.0, metavar="PCT", help="With --snapshot, also skip targets whose every value moved less than PCT percent (default: 0).")
+	ap.add_argument("--prefilter-report", action="store_true", help="Only report how many tracked YAML files/bytes the raw prefilter skips, then exit.")
+	args = ap.parse_args(argv)
+	if args.krr_json is None and not args.from_pvc and not args.prefilter_report:
+		ap.error("--krr-json or --from-pvc is required")
+	if args.jobs < 1:
+		ap.error("--jobs must be >= 1")
+	if args.hysteresis < 0:
+		ap.error("--hysteresis must be >= 0")
+	if args.hysteresis and args.snapshot is None:
+		ap.error("--hysteresis requires --snapshot")
+
+	# Normalize exclude list into a set of names (supports repeated flags and comma-separated values)
+	exclude_names = set()
+	for ex in args.exclude:
+		for part in str(ex).split(","):
+			name = part.strip()
+			if name:
+				exclude_names.add(name)
+
+	if args.commit:
+		args.stage = True
+	if args.stage:
+		args.write = True
+
+	try:
+		repo_root = _git_root(args.repo)
+	except subprocess.CalledProcessError:
+		print("ERROR: not inside a git repo (or git unavailable).", file=sys.stderr)
+		return 2
+
+	t0 = time.perf_counter()
+	yaml_files = _git_ls_yaml_files(repo_root)
+	_report_phase("ls-files", t0, files=len(yaml_files))
+	if not yaml_files:
+		print("No tracked YAML files found in repo.", file=sys.stderr)
+		return 2
+
+	if args.prefilter_report:
+		_, prefilter_stats = _prefilter_yaml_files(yaml_files)
+		_print_prefilter_report(prefilter_stats)
+		return 0
+
+	t0 = time.perf_counter()
+	if args.from_pvc:
+		krr_source = _fetch_krr_from_pvc(
+			namespace=args.krr_namespace,
+			pvc=args.krr_pvc,
+			cronjob=args.krr_cronjob,
+			job_timeout=args.job_timeout,
+			pod_timeout=args.pod_timeout,
+			read_timeout=args.read_timeout,
+		)
+	else:
+		krr_source = contextlib.nullcontext(args.krr_json)
+	with krr_source as src:
+		krr_map, skipped_entries = _aggregate_krr(
+			src,
+			min_severity=args.min_severity,
+			stream=args.stream_krr,
+		)
+	_report_phase(
+		"aggregate",
+		t0,
+		targets=len(krr_map),
+		skipped=sum(skipped_entries.values()),
+		stream=args.stream_krr,
+	)
+	if not krr_map:
+		print("No applicable KRR entries found (after severity filter, or missing Flux labels).", file=sys.stderr)
+		return 2
+
+	# Files whose blob SHA is already in the cache skip prefiltering and parsing.
+	t0 = time.perf_counter()
+	cache_path = args.cache_dir / "index.json"
+	cache_key = _cache_key(chart_name=args.chart_name, chartref_kind=args.chartref_kind)
+	blob_shas = _git_yaml_blob_shas(repo_root)
+	cached = {} if args.no_cache else _load_index_cache(cache_path, cache_key)
+	records: Dict[Path, FileIndex] = {}
+	to_scan: List[Path] = []
+	for fp in yaml_files:
+		sha = blob_shas.get(fp)
+		rec = cached.get(sha) if sha else None
+		if rec is not None:
+			records[fp] = rec
+		else:
+			to_scan.append(fp)
+	_report_phase("cache", t0, hits=len(records), misses=len(to_scan), no_cache=args.no_cache)
+
+	t0 = time.perf_counter()
+	candidates, prefilter_stats = _prefilter_yaml_files(to_scan)
+	_report_phase(
+		"prefilter",
+		t0,
+		candidates=prefilter_stats.candidate_files,
+		skipped=prefilter_stats.skipped_files + prefilter_stats.excluded_files,
+		skipped_bytes=prefilter_stats.skipped_bytes + prefilter_stats.excluded_bytes,
+	)
+
+	# Single pass over the remaining YAML: collect OCIRepository URLs and
+	# HelmRelease docs together, keeping parsed HelmRelease files for patching.
+	t0 = time.perf_counter()
+	parsed, loaded, failed = _parse_yaml_files(candidates, jobs=args.jobs)
+	_report_phase("parse", t0, files=len(candidates), failed=failed, jobs=args.jobs)
+
+	# Prefiltered files are cached as empty so they are not even re-read next run.
+	for fp in to_scan:
+		records[fp] = parsed.get(fp) or FileIndex()
+
+	t0 = time.perf_counter()
+	entries = {blob_shas[fp]: records[fp] for fp in yaml_files if fp in blob_shas and fp in records}
+	try:
+		_save_index_cache(cache_path, cache_key, entries)
+	except OSError as e:
+		print(f"WARNING: failed to write index cache {cache_path}: {e}", file=sys.stderr)
+	_report_phase("cache-save", t0, entries=len(entries))
+
+	t0 = time.perf_counter()
+	yaml_index = _assemble_yaml_index(repo_root, yaml_files, records, loaded)
+	_report_phase(
+		"index",
+		t0,
+		ocirepos=len(yaml_index.ocirepo_index),
+		helmreleases=len(yaml_index.hr_candidates),
+	)
+
+	t0 = time.perf_counter()
+	hr_index, hr_index_by_name = _build_hr_index(
+		yaml_index,
+		chart_name=args.chart_name,
+		chartref_kind=args.chartref_kind,
+	)
+	_report_phase("match", t0, app_template_hrs=sum(len(v) for v in hr_index.values()))
+
+	if not hr_index:
+		print("No app-template HelmReleases found in repo (matching chartRef/chart name).", file=sys.stderr)
+		return 2
+
+	# Files are loaded lazily, reusing any documents parsed during indexing
+	changed_files: Dict[Path, Tuple[str, List[Any], YAML]] = {}
+	# doc indexes mutated by _apply_to_hr_doc, per file
+	dirty_docs: Dict[Path, set] = {}
+	# controller/container lookup tables, built once per HelmRelease doc
+	match_indexes: Dict[Tuple[Path, int], DocMatchIndex] = {}
+	total_changed_targets = 0
+	total_matched_targets = 0
+	total_already_ok_targets = 0
+	total_skipped_targets = 0
+	total_unchanged_targets = 0
+	unmatched: List[TargetKey] = []
+
+	# Last applied quantities; targets that still match are skipped before any
+	# HelmRelease file is loaded. Only targets still reported by KRR are kept.
+	snapshot_path = (repo_root / args.snapshot) if args.snapshot is not None else None
+	prev_snapshot = _load_snapshot(snapshot_path) if snapshot_path is not None else {}
+	new_snapshot: Dict[TargetKey, Dict[str, str]] = {}
+
+	def _ensure_loaded(fp: Path) -> Tuple[str, List[Any], YAML]:
+		if fp in changed_files:
+			return changed_files[fp]
+		loaded = yaml_index.loaded.get(fp)
+		if loaded is None:
+			loaded = _read_all_yaml_docs(fp)
+		raw, docs, yaml = loaded
+		changed_files[fp] = (raw, docs, yaml)
+		return raw, docs, yaml
+
+	t0 = time.perf_counter()
+	for target, rec in krr_map.items():
+		# Skip targets that the user requested to exclude by name
+		if target.hr.name in exclude_names:
+			print(f"NOTE: excluded {target.hr.namespace}/{target.hr.name} per --exclude")
+			continue
+
+		if snapshot_path is not None:
+			quantized = _quantize_rec(rec)
+			prev = prev_snapshot.get(target)
+			if prev is not None and _within_hysteresis(prev, quantized, pct=args.hysteresis):
+				new_snapshot[target] = prev
+				total_unchanged_targets += 1
+				continue
+
+		locs = hr_index.get(target.hr)
+
+		if not locs and not args.no_name_fallback:
+			cands = hr_index_by_name.get(target.hr.name, [])
+			if len(cands) == 1:
+				locs = cands
+				print(f"NOTE: matched {target.hr.namespace}/{target.hr.name} by name-only (manifest likely missing metadata.namespace).")
+			else:
+				locs = None
+
+		if not locs:
+			unmatched.append(target)
+			continue
+
+		total_matched_targets += 1
+		for loc in locs:
+			raw, docs, yaml = _ensure_loaded(loc.path)
+			doc = docs[loc.doc_index]
+			if not isinstance(doc, CommentedMap):
+				continue
+
+			status, notes, dirty = _apply_to_hr_doc(
+				doc,
+				target=target,
+				rec=rec,
+				only_missing=args.only_missing,
+				match_index=match_indexes.setdefault((loc.path, loc.doc_index), DocMatchIndex()),
+			)
+			if dirty:
+				dirty_docs.setdefault(loc.path, set()).add(loc.doc_index)
+
+			if notes:
+				print(f"- {target.hr.namespace}/{target.hr.name} controller={target.controller} container={target.container} @ {loc.path.relative_to(repo_root)}")
+				for n in notes:
+					print(f"\t{n}")
+
+			if status == "changed":
+				total_changed_targets += 1
+			elif status == "skip":
+				total_skipped_targets += 1
+			else:
+				total_already_ok_targets += 1
+
+			if snapshot_path is not None and status != "skip":
+				new_snapshot[target] = quantized
+
+	_report_phase("patch", t0, matched=total_matched_targets, files=len(changed_files))
+
+	if unmatched:
+		print("\nUnmatched KRR targets (no matching app-template HelmRelease found):", file=sys.stderr)
+		for t in unmatched[:200]:
+			print(f"\t- {t.hr.namespace}/{t.hr.name} controller={t.controller} container={t.container}", file=sys.stderr)
+		if len(unmatched) > 200:
+			print(f"\t… and {len(unmatched) - 200} more", file=sys.stderr)
+
+	# Filter skipped entries to only those whose HR is known to the index
+	# (i.e. is an app-template HR we can actually patch). Entries without
+	# Flux labels can never match and belong in the HR-matching bucket instead.
+	all_known_hr_names = set(hr_index_by_name.keys())
+	skipped_by_severity: Dict[str, int] = {}
+	for (sev, hr_ref), n in skipped_entries.items():
+		if hr_ref is None:
+			continue
+		if hr_ref in hr_index or hr_ref.name in all_known_hr_names:
+			skipped_by_severity[sev] = skipped_by_severity.get(sev, 0) + n
+
+	# Render files with at least one mutated doc once, keeping the text for the
+	# write step; the diff against the original raw text gives the summary
+	# accurate file counts. Files with no mutated doc are never dumped.
+	t0 = time.perf_counter()
+	rendered: Dict[Path, str] = {}
+	for fp, (raw, docs, yaml) in changed_files.items():
+		if fp not in dirty_docs:
+			continue
+		new_txt = _dump_all_yaml_docs(yaml, docs)
+		if new_txt != raw:
+			rendered[fp] = new_txt
+	actually_changed: List[Path] = list(rendered)
+	_report_phase("render", t0, files=len(dirty_docs), changed=len(actually_changed))
+
+	# ---- Summary ----
+	print(f"\nSummary")
+	print(f"  Severity filter (min: {args.min_severity.upper()})")
+	print(f"    Passed  : {len(krr_map)} target(s) at or above threshold")
+	for sev_label in ("OK", "GOOD", "UNKNOWN"):
+		count = skipped_by_severity.get(sev_label, 0)
+		if count:
+			print(f"    Skipped : {count} target(s) at severity {sev_label} → use --min-severity {sev_label} to include")
+	print(f"  HelmRelease matching")
+	print(f"    Matched : {total_matched_targets} target(s) to app-template HelmReleases")
+	if unmatched:
+		print(f"    No match: {len(unmatched)} target(s) (not app-template or missing Flux labels)")
+	print(f"  Resource values")
+	if total_unchanged_targets:
+		band = f" (within {args.hysteresis:g}%)" if args.hysteresis else ""
+		print(f"    Same    : {total_unchanged_targets} target(s) unchanged since last applied snapshot{band}")
+	print(f"    Changed : {total_changed_targets} target(s) need updates across {len(actually_changed)} file(s)")
+	if total_already_ok_targets:
+		print(f"    Already : {total_already_ok_targets} target(s) already at recommended values")
+	if total_skipped_targets:
+		print(f"    Skipped : {total_skipped_targets} target(s) — controller/container key not found in HelmRelease values")
+
+	# The snapshot records what the manifests hold now, so it is written on
+	# every --write run, including ones that change no manifest (the first
+	# run against an already-applied repo, and the steady state after it)
+	written: List[Path] = []
+	if args.write and snapshot_path is not None:
+		snapshot_txt = _render_snapshot(new_snapshot)
+		try:
+			old_txt = snapshot_path.read_text(encoding="utf-8")
+		except FileNotFoundError:
+			old_txt = None
+		if snapshot_txt != old_txt:
+			snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+			snapshot_path.write_text(snapshot_txt, encoding="utf-8")
+			written.append(snapshot_path)
+			print(f"\nWROTE: snapshot {args.snapshot} ({len(new_snapshot)} target(s)).")
+
+	if total_changed_targets == 0:
+		print("\nNo changes needed.")
+	elif not args.write:
+		print(f"\nDRY-RUN: would update {len(actually_changed)} file(s), {total_changed_targets} target(s). Use --write to apply.")
+		return 0
+	else:
+		for fp, new_txt in rendered.items():
+			fp.write_text(new_txt, encoding="utf-8")
+		written[:0] = actually_changed
+		print(f"\nWROTE: updated {len(actually_changed)} file(s).")
+
+	if args.stage and written:
+		rel_paths = [str(p.relative_to(repo_root)) for p in written]
+		_run(["git", "-C", str(repo_root), "add", "--", *rel_paths], cwd=repo_root)
+		print("STAGED: git add on changed files.")
+
+	if args.commit and written:
+		_run(["git", "-C", str(repo_root), "commit", "-m", args.commit_message], cwd=repo_root)
+		print("COMMITTED.")
+
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,503 @@
+"""
+Benchmark harness for apply_krr.py.
+
+Generates a synthetic git repo of app-template HelmReleases (several
+controllers and containers per release, laid out like kubernetes/apps/*)
+and a matching krr.json, runs apply_krr.main() against it in-process and
+reports time and peak traced memory per phase (the TIMING: phases of
+apply_krr), for a cold index cache and a warm one. The repo is reset to
+its generated commit before every run, so apply_krr arguments that change
+it (-- --write, --snapshot, --commit) do not alter later runs' workload:
+
+	scripts/apply-krr.sh bench --apps 200 --controllers 3 --containers 2
+
+--aggregate N and --match N instead time single stages on synthetic
+input: krr.json aggregation (json.loads vs streaming) and
+controller/container matching (per call vs per-doc tables).
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ruamel.yaml.comments import CommentedMap
+
+import apply_krr
+
+
+NAMESPACES = ("default", "media", "database", "observability", "network", "ai", "home", "security")
+
+SEVERITIES = ("CRITICAL", "WARNING", "WARNING", "OK", "GOOD")
+
+# Tag on the generated commit of the synthetic repo, which reset_repo() restores
+SYNTHETIC_TAG = "synthetic"
+
+
+@dataclass
+class Phase:
+	name: str
+	seconds: float
+	peak_bytes: Optional[int] = None
+	counts: Dict[str, Any] = field(default_factory=dict)
+
+
+# -----------------------------
+# Synthetic repo
+# -----------------------------
+
+def _app_shape(i: int, *, controllers: int, containers: int) -> List[Tuple[str, List[str]]]:
+	"""Controller keys and their container keys for app i; shapes cycle up to the maximums."""
+	n_ctrl = 1 + i % controllers
+	n_ctr = 1 + (i // controllers) % containers
+	names = ["main"] + [f"worker-{c}" for c in range(1, n_ctrl)]
+	ctrs = ["app"] + [f"sidecar-{c}" for c in range(1, n_ctr)]
+	return [(name, list(ctrs)) for name in names]
+
+
+def _helmrelease_yaml(app: str, namespace: Optional[str], shape: List[Tuple[str, List[str]]], *, direct_chartref: bool, with_resources: bool) -> str:
+	lines = [
+		"---",
+		"# yaml-language-server: $schema=https://raw.githubusercontent.com/bjw-s-labs/helm-charts/main/charts/other/app-template/schemas/helmrelease-helm-v2.schema.json",
+		"apiVersion: helm.toolkit.fluxcd.io/v2",
+		"kind: HelmRelease",
+		"metadata:",
+		f"  name: &app {app}",
+	]
+	if namespace:
+		lines.append(f"  namespace: {namespace}")
+	lines += [
+		"spec:",
+		"  interval: 1h",
+		"  chartRef:",
+		"    kind: OCIRepository",
+		"    name: app-template" if direct_chartref else "    name: *app",
+		"  values:",
+		"    controllers:",
+	]
+	for c, (controller, containers) in enumerate(shape):
+		lines += [
+			f"      {controller}:",
+			"        annotations:",
+			'          reloader.stakater.com/auto: "true"',
+			"        containers:",
+		]
+		for k, container in enumerate(containers):
+			# anchors are defined once, on the first container
+			first = c == 0 and k == 0
+			lines += [
+				f"          {container}:",
+				"            image:",
+				f"              repository: ghcr.io/example/{app}-{container}",
+				"              tag: 1.2.3@sha256:0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef",
+				"            env:",
+				"              TZ: America/Chicago",
+				"              # keep comments round-tripping",
+				f"              {container.upper().replace('-', '_')}_PORT: {'&port ' if first else ''}8080",
+				"            probes:",
+				"              liveness: &probes" if first else "              liveness: *probes",
+			]
+			if first:
+				lines += [
+					"                enabled: true",
+					"              readiness: *probes",
+				]
+			if with_resources:
+				lines += [
+					"            resources:",
+					"              requests:",
+					"                cpu: 10m",
+					"                memory: 128Mi",
+					"              limits:",
+					"                memory: 256Mi",
+				]
+	lines += [
+		"    service:",
+		"      app:",
+		"        ports:",
+		"          http:",
+		"            port: *port",
+		"",
+	]
+	return "\n".join(lines)
+
+
+def _ocirepository_yaml(app: str) -> str:
+	return "\n".join([
+		"---",
+		"apiVersion: source.toolkit.fluxcd.io/v1",
+		"kind: OCIRepository",
+		"metadata:",
+		f"  name: {app}",
+		"spec:",
+		"  interval: 15m",
+		"  layerSelector:",
+		"    mediaType: application/vnd.cncf.helm.chart.content.v1.tar+gzip",
+		"    operation: copy",
+		"  ref:",
+		"    tag: 4.4.0",
+		"  url: oci://ghcr.io/bjw-s-labs/helm/app-template",
+		"",
+	])
+
+
+def _kustomization_yaml(files: List[str]) -> str:
+	return "\n".join(["---", "apiVersion: kustomize.config.k8s.io/v1beta1", "kind: Kustomization", "resources:"] + [f"  - ./{f}" for f in files] + [""])
+
+
+def _flux_ks_yaml(app: str, namespace: str) -> str:
+	return "\n".join([
+		"---",
+		"apiVersion: kustomize.toolkit.fluxcd.io/v1",
+		"kind: Kustomization",
+		"metadata:",
+		f"  name: {app}",
+		"spec:",
+		f"  targetNamespace: {namespace}",
+		f"  path: ./kubernetes/apps/{namespace}/{app}/app",
+		"  prune: true",
+		"  sourceRef:",
+		"    kind: GitRepository",
+		"    name: flux-system",
+		"    namespace: flux-system",
+		"  interval: 1h",
+		"",
+	])
+
+
+def generate_repo(root: Path, *, apps: int, controllers: int, containers: int) -> List[apply_krr.TargetKey]:
+	"""
+	Write and commit a repo with `apps` app-template HelmReleases under
+	kubernetes/apps/<namespace>/<app>/ (helmrelease, per-app OCIRepository,
+	kustomization and Flux ks.yaml: four tracked YAML files per app).
+	Every third release points chartRef straight at app-template, every
+	fifth omits metadata.namespace, and every other one has no resources
+	yet. Returns the (HelmRelease, controller, container) targets.
+	"""
+	targets: List[apply_krr.TargetKey] = []
+	for i in range(apps):
+		app = f"app-{i:04d}"
+		namespace = NAMESPACES[i % len(NAMESPACES)]
+		shape = _app_shape(i, controllers=controllers, containers=containers)
+		app_dir = root / "kubernetes" / "apps" / namespace / app / "app"
+		app_dir.mkdir(parents=True, exist_ok=True)
+		(app_dir / "helmrelease.yaml").write_text(
+			_helmrelease_yaml(
+				app,
+				None if i % 5 == 4 else namespace,
+				shape,
+				direct_chartref=i % 3 == 2,
+				with_resources=i % 2 == 0,
+			),
+			encoding="utf-8",
+		)
+		(app_dir / "ocirepository.yaml").write_text(_ocirepository_yaml(app), encoding="utf-8")
+		(app_dir / "kustomization.yaml").write_text(_kustomization_yaml(["helmrelease.yaml", "ocirepository.yaml"]), encoding="utf-8")
+		(app_dir.parent / "ks.yaml").write_text(_flux_ks_yaml(app, namespace), encoding="utf-8")
+		for controller, ctrs in shape:
+			for container in ctrs:
+				targets.append(apply_krr.TargetKey(hr=apply_krr.HrRef(namespace=namespace, name=app), controller=controller, container=container))
+
+	git = ["git", "-C", str(root), "-c", "user.name=bench", "-c", "user.email=bench@localhost", "-c", "commit.gpgsign=false"]
+	subprocess.run(["git", "init", "-q", str(root)], check=True)
+	subprocess.run(git + ["add", "-A"], check=True)
+	subprocess.run(git + ["commit", "-q", "-m", "synthetic apps"], check=True)
+	subprocess.run(git + ["tag", SYNTHETIC_TAG], check=True)
+	return targets
+
+
+def reset_repo(root: Path) -> None:
+	"""
+	Put the generated repo back to its single commit, so every run sees the
+	same workload even when apply_krr arguments like --write, --snapshot or
+	--commit changed it.
+	"""
+	subprocess.run(["git", "-C", str(root), "reset", "-q", "--hard", SYNTHETIC_TAG], check=True)
+	subprocess.run(["git", "-C", str(root), "clean", "-qfdx"], check=True)
+
+
+def write_krr_json(path: Path, targets: List[apply_krr.TargetKey], *, pods: int = 2) -> int:
+	"""Write a krr.json with `pods` scans per target (KRR reports one per pod's container); returns the scan count."""
+	n = 0
+	with path.open("w", encoding="utf-8") as fh:
+		fh.write('{"scans": [')
+		for t, target in enumerate(targets):
+			for p in range(pods):
+				cpu = ((t * 7 + p) % 97 + 1) / 200.0
+				mem = 1048576 * ((t * 13 + p) % 383 + 32)
+				scan = {
+					"object": {
+						"cluster": "main",
+						"name": f"{target.hr.name}-{target.controller}",
+						"container": target.container,
+						"pods": [{"name": f"{target.hr.name}-{target.controller}-{p}", "deleted": False}],
+						"hpa": None,
+						"namespace": target.hr.namespace,
+						"kind": "Deployment",
+						"allocations": {"requests": {"cpu": 0.01, "memory": 134217728}, "limits": {"cpu": None, "memory": 268435456}},
+						"warnings": [],
+						"labels": {
+							"app.kubernetes.io/controller": target.controller,
+							"app.kubernetes.io/instance": target.hr.name,
+							"app.kubernetes.io/name": target.hr.name,
+							"helm.toolkit.fluxcd.io/name": target.hr.name,
+							"helm.toolkit.fluxcd.io/namespace": target.hr.namespace,
+						},
+					},
+					"recommended": {
+						"requests": {"cpu": {"value": cpu, "severity": "OK"}, "memory": {"value": mem, "severity": "OK"}},
+						"limits": {"cpu": {"value": "?", "severity": "UNKNOWN"}, "memory": {"value": mem, "severity": "OK"}},
+						"info": {"cpu": None, "memory": None},
+					},
+					"severity": SEVERITIES[(t + p) % len(SEVERITIES)],
+					"container": target.container,
+				}
+				fh.write(", " if n else "")
+				fh.write(json.dumps(scan))
+				n += 1
+		fh.write("]}")
+	return n
+
+
+# -----------------------------
+# Microbenchmarks
+# -----------------------------
+
+def _write_aggregate_krr(path: Path, n_scans: int) -> None:
+	"""Write a krr.json with n_scans scans shaped like real KRR output, one scan at a time."""
+	severities = ("OK", "GOOD", "WARNING", "CRITICAL")
+	with path.open("w", encoding="utf-8") as fh:
+		fh.write('{"scans": [')
+		for i in range(n_scans):
+			hr = f"app-{i % 500}"
+			scan = {
+				"object": {
+					"cluster": "main",
+					"name": hr,
+					"container": "app",
+					"pods": [{"name": f"{hr}-{i}-{p}", "deleted": False} for p in range(3)],
+					"hpa": None,
+					"namespace": "default",
+					"kind": "Deployment",
+					"allocations": {"requests": {"cpu": 0.01, "memory": 104857600}, "limits": {"cpu": None, "memory": 104857600}},
+					"warnings": [],
+					"labels": {
+						"app.kubernetes.io/controller": f"c{i % 7}",
+						"app.kubernetes.io/instance": hr,
+						"app.kubernetes.io/name": hr,
+						"helm.toolkit.fluxcd.io/name": hr,
+						"helm.toolkit.fluxcd.io/namespace": "default",
+					},
+				},
+				"recommended": {
+					"requests": {"cpu": {"value": (i % 97) / 100.0, "severity": "OK"}, "memory": {"value": 1048576 * (i % 251 + 1), "severity": "OK"}},
+					"limits": {"cpu": {"value": "?", "severity": "UNKNOWN"}, "memory": {"value": 1048576 * (i % 251 + 1), "severity": "OK"}},
+					"info": {"cpu": None, "memory": None},
+				},
+				"severity": severities[i % len(severities)],
+				"container": f"ctr{i % 3}",
+			}
+			if i:
+				fh.write(", ")
+			fh.write(json.dumps(scan))
+		fh.write("]}")
+
+
+def benchmark_aggregate(n_scans: int, *, min_severity: str) -> int:
+	"""Compare json.loads and streaming aggregation of a synthetic n_scans krr.json."""
+	with tempfile.TemporaryDirectory() as tmp:
+		path = Path(tmp) / "krr.json"
+		_write_aggregate_krr(path, n_scans)
+		size = path.stat().st_size
+		print(f"Synthetic krr.json: {n_scans} scan(s), {size / (1024 * 1024):.1f} MiB")
+
+		results = []
+		for label, stream in (("json.loads", False), ("stream", True)):
+			# Time without tracemalloc (it slows allocation-heavy code a lot),
+			# then repeat under tracemalloc for the peak.
+			t0 = time.perf_counter()
+			krr_map, skipped = apply_krr._aggregate_krr(path, min_severity=min_severity, stream=stream)
+			dt = time.perf_counter() - t0
+			tracemalloc.start()
+			apply_krr._aggregate_krr(path, min_severity=min_severity, stream=stream)
+			_, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			results.append((krr_map, skipped))
+			print(f"  {label:<10}: {dt:.3f}s, peak {peak / (1024 * 1024):.1f} MiB, {len(krr_map)} target(s)")
+
+	# compare item lists so a difference in target order also counts
+	(loaded, loaded_skipped), (streamed, streamed_skipped) = results
+	if list(streamed.items()) != list(loaded.items()) or streamed_skipped != loaded_skipped:
+		print("ERROR: stream aggregation differs from json.loads", file=sys.stderr)
+		return 1
+	return 0
+
+
+def benchmark_match(n_controllers: int) -> int:
+	"""Time controller/container picking per call (tables rebuilt) vs a per-doc DocMatchIndex."""
+	controllers = CommentedMap()
+	for c in range(n_controllers):
+		containers = CommentedMap()
+		for name in ("app", "sidecar", "init_db"):
+			containers[name] = CommentedMap()
+		controllers[f"worker-{c}"] = CommentedMap([("containers", containers)])
+
+	# exact, prefixed ("<workload>-<key>") and case/underscore variants
+	wanted: List[Tuple[str, str]] = []
+	for c in range(n_controllers):
+		wanted.append((f"worker-{c}", "app"))
+		wanted.append((f"bench-worker-{c}", "bench-sidecar"))
+		wanted.append((f"Worker_{c}", "INIT-DB"))
+
+	def _run_picks(make_index: bool) -> List[Tuple[Any, Any]]:
+		doc_index = apply_krr.DocMatchIndex() if make_index else None
+		out: List[Tuple[Any, Any]] = []
+		for ctrl, ctr in wanted:
+			ck = apply_krr._pick_controller_key(controllers, ctrl, "bench", doc_index.get(controllers) if doc_index else None)
+			containers = controllers[ck]["containers"] if ck is not None else CommentedMap()
+			out.append((ck, apply_krr._pick_container_key(containers, ctr, doc_index.get(containers) if doc_index else None)))
+		return out
+
+	print(f"Synthetic HelmRelease: {n_controllers} controller(s), {len(wanted)} target(s)")
+	results = []
+	for label, make_index in (("per-call", False), ("indexed", True)):
+		t0 = time.perf_counter()
+		results.append(_run_picks(make_index))
+		print(f"  {label:<10}: {time.perf_counter() - t0:.3f}s")
+
+	if results[0] != results[1]:
+		print("ERROR: indexed picking differs from per-call picking", file=sys.stderr)
+		return 1
+	return 0
+
+
+# -----------------------------
+# Harness
+# -----------------------------
+
+def run_pipeline(argv: List[str], *, trace: bool) -> Tuple[int, List[Phase]]:
+	"""
+	Run apply_krr.main(argv) with its stdout discarded, collecting one Phase
+	per _report_phase call. With trace=True each phase also records the peak
+	of memory traced by tracemalloc since the previous phase ended (timings
+	from a traced run are inflated, so take them from an untraced one).
+	"""
+	phases: List[Phase] = []
+	report = apply_krr._report_phase
+
+	def _collect(name: str, t0: float, **counts: Any) -> None:
+		phase = Phase(name=name, seconds=time.perf_counter() - t0, counts=counts)
+		if trace:
+			_, phase.peak_bytes = tracemalloc.get_traced_memory()
+			tracemalloc.reset_peak()
+		phases.append(phase)
+
+	apply_krr._report_phase = _collect
+	if trace:
+		tracemalloc.start()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			rc = apply_krr.main(argv)
+	finally:
+		if trace:
+			tracemalloc.stop()
+		apply_krr._report_phase = report
+	return rc, phases
+
+
+def _print_table(title: str, timed: List[Phase], traced: List[Phase]) -> None:
+	print(f"\n{title}")
+	print(f"  {'phase':<12} {'time':>9} {'peak':>11}  counts")
+	peaks = {p.name: p.peak_bytes for p in traced}
+	for p in timed:
+		peak = peaks.get(p.name)
+		peak_txt = f"{peak / (1024 * 1024):8.1f}MiB" if peak is not None else "-"
+		counts = " ".join(f"{k}={v}" for k, v in p.counts.items())
+		print(f"  {p.name:<12} {p.seconds:8.3f}s {peak_txt:>11}  {counts}")
+	total_peak = max((p.peak_bytes or 0) for p in traced) if traced else 0
+	print(f"  {'total':<12} {sum(p.seconds for p in timed):8.3f}s {total_peak / (1024 * 1024):8.1f}MiB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	ap = argparse.ArgumentParser(description="Benchmark apply_krr on a synthetic repo of app-template HelmReleases.")
+	ap.add_argument("--apps", type=int, default=200, help="HelmReleases to generate, four tracked YAML files each (default: 200).")
+	ap.add_argument("--controllers", type=int, default=3, help="Max controllers per HelmRelease (default: 3).")
+	ap.add_argument("--containers", type=int, default=2, help="Max containers per controller (default: 2).")
+	ap.add_argument("--pods", type=int, default=2, help="krr.json scans per target (default: 2).")
+	ap.add_argument("--jobs", type=int, default=1, help="Passed to apply_krr --jobs (default: 1).")
+	ap.add_argument("--keep", type=Path, help="Generate the repo in this (new) directory and keep it.")
+	ap.add_argument("--json", type=Path, help="Also write the results to this JSON file, for comparing runs.")
+	ap.add_argument("--aggregate", type=int, metavar="N", help="Instead, compare json.loads and streaming aggregation on a synthetic N-scan krr.json.")
+	ap.add_argument("--match", type=int, metavar="N", help="Instead, time controller/container matching on a synthetic N-controller HelmRelease.")
+	ap.add_argument("--min-severity", default="WARNING", help="Min severity for --aggregate (default: WARNING).")
+	ap.add_argument("apply_args", nargs=argparse.REMAINDER, help="Extra apply_krr arguments, after --.")
+	args = ap.parse_args(argv)
+	if args.aggregate is not None:
+		return benchmark_aggregate(args.aggregate, min_severity=args.min_severity)
+	if args.match is not None:
+		return benchmark_match(args.match)
+	if min(args.apps, args.controllers, args.containers, args.pods) < 1:
+		ap.error("--apps, --controllers, --containers and --pods must be >= 1")
+	extra = [a for a in args.apply_args if a != "--"]
+
+	with contextlib.ExitStack() as stack:
+		if args.keep is not None:
+			args.keep.mkdir(parents=True)
+			work = args.keep
+		else:
+			work = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="apply-krr-bench-")))
+		repo = work / "repo"
+		repo.mkdir()
+
+		t0 = time.perf_counter()
+		targets = generate_repo(repo, apps=args.apps, controllers=args.controllers, containers=args.containers)
+		krr_json = work / "krr.json"
+		scans = write_krr_json(krr_json, targets, pods=args.pods)
+		print(
+			f"Synthetic repo: {args.apps} HelmRelease(s), {args.apps * 4} YAML file(s), {len(targets)} target(s); "
+			f"krr.json: {scans} scan(s), {krr_json.stat().st_size / (1024 * 1024):.1f} MiB ({time.perf_counter() - t0:.1f}s)"
+		)
+
+		results: Dict[str, Any] = {"apps": args.apps, "targets": len(targets), "scans": scans, "runs": {}}
+		base = ["--repo", str(repo), "--krr-json", str(krr_json), "--jobs", str(args.jobs)] + extra
+		warm_cache = work / "cache-warm"
+		for label, cache_for in (
+			# a fresh cache directory per run: nothing cached, everything parsed
+			("cold cache", lambda run: work / f"cache-cold-{run}"),
+			# one shared directory, filled by a priming run
+			("warm cache", lambda run: warm_cache),
+		):
+			if label == "warm cache":
+				reset_repo(repo)
+				run_pipeline(base + ["--cache-dir", str(warm_cache)], trace=False)
+			reset_repo(repo)
+			rc, timed = run_pipeline(base + ["--cache-dir", str(cache_for("timed"))], trace=False)
+			reset_repo(repo)
+			_, traced = run_pipeline(base + ["--cache-dir", str(cache_for("traced"))], trace=True)
+			if rc != 0:
+				print(f"ERROR: apply_krr exited with {rc}", file=sys.stderr)
+				return rc
+			_print_table(label, timed, traced)
+			peaks = {p.name: p.peak_bytes for p in traced}
+			results["runs"][label] = [
+				{"phase": p.name, "seconds": round(p.seconds, 6), "peak_bytes": peaks.get(p.name), "counts": p.counts}
+				for p in timed
+			]
+
+	if args.json is not None:
+		args.json.write_text(json.dumps(results, indent=2, default=str) + "\n", encoding="utf-8")
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
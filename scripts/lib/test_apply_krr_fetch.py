@@ -0,0 +1,253 @@
+"""
+Tests for the --from-pvc fetch path of apply_krr.py (_run_cronjob_once,
+_fetch_krr_from_pvc and _ExecStdout) against an in-memory fake of the
+Kubernetes API: fake CoreV1Api/BatchV1Api objects, a scripted watch and a
+scripted exec stream. The kubernetes package supplies only the models.
+
+	cd scripts/lib && python -m unittest test_apply_krr_fetch
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import sys
+import unittest
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import apply_krr
+
+try:
+	from kubernetes import client
+	from kubernetes.client.rest import ApiException
+except ImportError:  # pragma: no cover - the fetch path itself needs kubernetes
+	client = ApiException = None
+
+
+# -----------------------------
+# Fake API
+# -----------------------------
+
+def _job_event(*conditions: str) -> Dict[str, Any]:
+	conds = [SimpleNamespace(type=c, status="True") for c in conditions]
+	return {"type": "MODIFIED", "object": SimpleNamespace(status=SimpleNamespace(conditions=conds))}
+
+
+def _pod_event(ready: bool) -> Dict[str, Any]:
+	conds = [SimpleNamespace(type="Ready", status="True" if ready else "False")]
+	return {"type": "MODIFIED", "object": SimpleNamespace(status=SimpleNamespace(conditions=conds))}
+
+
+class FakeWatch:
+	"""Stands in for kubernetes.watch.Watch: stream() replays scripted events, or raises them."""
+
+	def __init__(self, script: List[Any]) -> None:
+		self._script = script
+
+	def stream(self, func: Any, *args: Any, **kwargs: Any):
+		for ev in self._script.pop(0) if self._script else []:
+			if isinstance(ev, BaseException):
+				raise ev
+			yield ev
+
+	def stop(self) -> None:
+		pass
+
+
+class FakeBatch:
+	def __init__(self, cronjob_exists: bool = True) -> None:
+		self.cronjob_exists = cronjob_exists
+		self.created: List[Any] = []
+		self.deleted: List[str] = []
+
+	def read_namespaced_cron_job(self, name: str, namespace: str) -> Any:
+		if not self.cronjob_exists:
+			raise ApiException(status=404)
+		pod_spec = client.V1PodSpec(restart_policy="Never", containers=[client.V1Container(name="krr", image="krr")])
+		return client.V1CronJob(
+			metadata=client.V1ObjectMeta(name=name, namespace=namespace, uid="uid-1"),
+			spec=client.V1CronJobSpec(
+				schedule="0 0 * * 0",
+				job_template=client.V1JobTemplateSpec(
+					metadata=client.V1ObjectMeta(labels={"app": "krr"}, annotations={"a": "b"}),
+					spec=client.V1JobSpec(template=client.V1PodTemplateSpec(spec=pod_spec)),
+				),
+			),
+		)
+
+	def create_namespaced_job(self, namespace: str, job: Any) -> None:
+		self.created.append(job)
+
+	def list_namespaced_job(self, *args: Any, **kwargs: Any) -> None:
+		raise AssertionError("only called through the watch")
+
+	def delete_namespaced_job(self, name: str, namespace: str, **kwargs: Any) -> None:
+		self.deleted.append(name)
+
+
+class FakeCore:
+	def __init__(self, logs: Optional[Dict[str, str]] = None) -> None:
+		self.logs = logs or {}
+		self.created_pods: List[Any] = []
+		self.deleted_pods: List[str] = []
+
+	def list_namespaced_pod(self, namespace: str, label_selector: Optional[str] = None, **kwargs: Any) -> Any:
+		return SimpleNamespace(items=[SimpleNamespace(metadata=SimpleNamespace(name=n)) for n in self.logs])
+
+	def read_namespaced_pod_log(self, name: str, namespace: str) -> str:
+		return self.logs[name]
+
+	def create_namespaced_pod(self, namespace: str, pod: Any) -> Any:
+		self.created_pods.append(pod)
+		return SimpleNamespace(metadata=SimpleNamespace(name="krr-fetch-abc"))
+
+	def delete_namespaced_pod(self, name: str, namespace: str, **kwargs: Any) -> None:
+		self.deleted_pods.append(name)
+
+	def connect_get_namespaced_pod_exec(self, *args: Any, **kwargs: Any) -> None:
+		raise AssertionError("only called through stream()")
+
+
+class FakeExec:
+	"""An exec websocket that delivers scripted stdout/stderr chunks, then closes."""
+
+	def __init__(self, stdout: List[bytes], stderr: List[bytes] = (), stay_open: bool = False) -> None:
+		self._stdout = list(stdout)
+		self._stderr = list(stderr)
+		self._stay_open = stay_open
+		self.closed = False
+
+	def peek_stdout(self) -> bool:
+		return bool(self._stdout)
+
+	def read_stdout(self) -> bytes:
+		return self._stdout.pop(0)
+
+	def peek_stderr(self) -> bool:
+		return bool(self._stderr)
+
+	def read_stderr(self) -> bytes:
+		return self._stderr.pop(0)
+
+	def is_open(self) -> bool:
+		return self._stay_open or bool(self._stdout or self._stderr)
+
+	def update(self, timeout: float = 0) -> None:
+		pass
+
+	def close(self) -> None:
+		self.closed = True
+
+
+# -----------------------------
+# Tests
+# -----------------------------
+
+@unittest.skipIf(ApiException is None, "kubernetes package not installed")
+class RunCronjobOnceTest(unittest.TestCase):
+	def _run(self, batch: FakeBatch, core: FakeCore, script: List[Any]) -> None:
+		self.stderr = io.StringIO()
+		with mock.patch("kubernetes.watch.Watch", lambda: FakeWatch(script)), contextlib.redirect_stderr(self.stderr):
+			apply_krr._run_cronjob_once(core, batch, namespace="default", cronjob="krr", timeout=5)
+
+	def test_success_creates_and_deletes_job(self) -> None:
+		batch, core = FakeBatch(), FakeCore()
+		self._run(batch, core, [[_job_event(), _job_event("Complete")]])
+
+		self.assertEqual(len(batch.created), 1)
+		job = batch.created[0]
+		self.assertTrue(job.metadata.name.startswith("krr-manual-"))
+		self.assertEqual(job.metadata.annotations["cronjob.kubernetes.io/instantiate"], "manual")
+		self.assertEqual(job.metadata.owner_references[0].uid, "uid-1")
+		self.assertEqual(job.metadata.labels, {"app": "krr"})
+		self.assertEqual(job.spec.template.spec.containers[0].name, "krr")
+		self.assertEqual(batch.deleted, [job.metadata.name])
+
+	def test_failure_dumps_pod_logs_and_deletes_job(self) -> None:
+		batch, core = FakeBatch(), FakeCore(logs={"krr-manual-pod": "krr: prometheus unreachable"})
+		with self.assertRaises(SystemExit) as cm:
+			self._run(batch, core, [[_job_event("Failed")]])
+		self.assertEqual(cm.exception.code, 2)
+		self.assertIn("failed", self.stderr.getvalue())
+		self.assertIn("krr: prometheus unreachable", self.stderr.getvalue())
+		self.assertEqual(batch.deleted, [batch.created[0].metadata.name])
+
+	def test_watch_error_still_deletes_job(self) -> None:
+		batch, core = FakeBatch(), FakeCore()
+		with self.assertRaises(RuntimeError):
+			self._run(batch, core, [[RuntimeError("watch dropped")]])
+		self.assertEqual(batch.deleted, [batch.created[0].metadata.name])
+
+	def test_missing_cronjob_is_a_no_op(self) -> None:
+		batch, core = FakeBatch(cronjob_exists=False), FakeCore()
+		self._run(batch, core, [])
+		self.assertEqual(batch.created, [])
+		self.assertEqual(batch.deleted, [])
+
+
+class ExecStdoutTest(unittest.TestCase):
+	def test_reassembles_chunks_and_keeps_stderr(self) -> None:
+		resp = FakeExec([b'{"scans": ', b"[1, 2", b", 3]}"], stderr=[b"warn"])
+		reader = io.BufferedReader(apply_krr._ExecStdout(resp, timeout=5))
+		self.assertEqual(reader.read(), b'{"scans": [1, 2, 3]}')
+		self.assertEqual(reader.raw.stderr, b"warn")
+
+	def test_times_out_without_output(self) -> None:
+		reader = apply_krr._ExecStdout(FakeExec([], stay_open=True), timeout=0)
+		with self.assertRaises(TimeoutError):
+			reader.read(10)
+
+
+@unittest.skipIf(ApiException is None, "kubernetes package not installed")
+class FetchKrrFromPvcTest(unittest.TestCase):
+	def _open(self, core: FakeCore, batch: FakeBatch, resp: FakeExec, script: List[Any], read_timeout: float = 5) -> Any:
+		stack = contextlib.ExitStack()
+		stack.enter_context(mock.patch.object(apply_krr, "_kube_clients", lambda: (core, batch)))
+		stack.enter_context(mock.patch("kubernetes.watch.Watch", lambda: FakeWatch(script)))
+		stack.enter_context(mock.patch("kubernetes.stream.stream", lambda *a, **kw: resp))
+		stack.enter_context(contextlib.redirect_stderr(io.StringIO()))
+		return stack, apply_krr._fetch_krr_from_pvc(
+			namespace="default", pvc="krr", cronjob="krr", job_timeout=5, pod_timeout=5, read_timeout=read_timeout,
+		)
+
+	def test_streams_file_and_deletes_pod(self) -> None:
+		core, batch = FakeCore(), FakeBatch()
+		resp = FakeExec([b'{"scans": []}'])
+		stack, fetch = self._open(core, batch, resp, [[_job_event("Complete")], [_pod_event(False), _pod_event(True)]])
+		with stack, fetch as fh:
+			self.assertEqual(fh.read(), b'{"scans": []}')
+		self.assertTrue(resp.closed)
+		self.assertEqual(core.deleted_pods, ["krr-fetch-abc"])
+		self.assertEqual(len(batch.deleted), 1)
+
+	def test_cat_error_exits_and_deletes_pod(self) -> None:
+		core, batch = FakeCore(), FakeBatch()
+		resp = FakeExec([], stderr=[b"cat: can't open '/data/krr.json': No such file or directory"])
+		stack, fetch = self._open(core, batch, resp, [[_job_event("Complete")], [_pod_event(True)]])
+		with self.assertRaises(SystemExit) as cm, stack, fetch as fh:
+			fh.read()
+		self.assertEqual(cm.exception.code, 2)
+		self.assertEqual(core.deleted_pods, ["krr-fetch-abc"])
+
+	def test_read_timeout_exits_and_deletes_pod(self) -> None:
+		core, batch = FakeCore(), FakeBatch()
+		resp = FakeExec([], stay_open=True)
+		stack, fetch = self._open(core, batch, resp, [[_job_event("Complete")], [_pod_event(True)]], read_timeout=0)
+		with self.assertRaises(SystemExit) as cm, stack, fetch as fh:
+			fh.read()
+		self.assertEqual(cm.exception.code, 2)
+		self.assertTrue(resp.closed)
+		self.assertEqual(core.deleted_pods, ["krr-fetch-abc"])
+
+	def test_pod_never_ready_exits_and_deletes_pod(self) -> None:
+		core, batch = FakeCore(), FakeBatch()
+		stack, fetch = self._open(core, batch, FakeExec([]), [[_job_event("Complete")], [_pod_event(False)]])
+		with self.assertRaises(SystemExit), stack, fetch:
+			pass
+		self.assertEqual(core.deleted_pods, ["krr-fetch-abc"])
+
+
+if __name__ == "__main__":
+	sys.exit(unittest.main())
@@ -3,35 +3,102 @@ set -euo pipefail
 
 if [ "$#" -lt 1 ]; then
   echo "Usage: $0 <dashboard.json> [more-dashboard.json ...]" >&2
+  echo "       $0 --bulk [--jobs N] <dir|glob> [more ...]" >&2
+  echo "       $0 --benchmark [PANELS]" >&2
+  echo "Options: --map TYPE=UID (repeatable) sets the uid for another datasource type" >&2
   exit 1
 fi
 
 python3 - "$@" <<'PY'
 from __future__ import annotations
 
+import glob
 import json
+import multiprocessing
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 
 TARGET_UID = "${DS_PROMETHEUS}"
 
+# Datasource type -> uid set on every datasource reference of that type;
+# more types can be added with --map TYPE=UID
+TARGET_UIDS: dict[str, str] = {"prometheus": TARGET_UID}
+
+# Keys under which dashboards nest the objects that carry datasource
+# references: panels (also inside rows and library panel models), their
+# queries, annotations, template variables and the "dashboard" of an API
+# export. Nothing else (fieldConfig, options, gridPos, ...) is visited.
+CONTAINER_KEYS = ("panels", "rows", "targets", "annotations", "templating", "list", "model", "dashboard")
+
+# Keys whose value maps arbitrary names to such objects
+MAPPING_KEYS = ("__elements",)
+
+
+def rewrite_datasources(root: object, target_uids: dict[str, str] | None = None) -> int:
+    if target_uids is None:
+        target_uids = TARGET_UIDS
+
+    replacements = 0
+    stack = [root]
+    pop = stack.pop
+    push = stack.append
+    extend = stack.extend
+
+    while stack:
+        node = pop()
+        if type(node) is list:
+            extend(node)
+            continue
+        if type(node) is not dict:
+            continue
+
+        datasource = node.get("datasource")
+        if type(datasource) is dict:
+            datasource_type = datasource.get("type")
+            if type(datasource_type) is str:
+                uid = target_uids.get(datasource_type)
+                if uid is not None and datasource.get("uid") != uid:
+                    datasource["uid"] = uid
+                    replacements += 1
+
+        for key in CONTAINER_KEYS:
+            child = node.get(key)
+            if child is not None:
+                push(child)
+        for key in MAPPING_KEYS:
+            child = node.get(key)
+            if type(child) is dict:
+                extend(child.values())
+
+    return replacements
+
+
+# The previous engine: recurses into every dict and list. Kept as the
+# reference for --benchmark.
+def rewrite_datasources_everywhere(node: object, target_uids: dict[str, str] | None = None) -> int:
+    if target_uids is None:
+        target_uids = TARGET_UIDS
 
-def rewrite_datasources(node: object) -> int:
     replacements = 0
 
     if isinstance(node, dict):
         datasource = node.get("datasource")
         if isinstance(datasource, dict):
-            if datasource.get("type") == "prometheus" and datasource.get("uid") != TARGET_UID:
-                datasource["uid"] = TARGET_UID
+            datasource_type = datasource.get("type")
+            uid = target_uids.get(datasource_type) if isinstance(datasource_type, str) else None
+            if uid is not None and datasource.get("uid") != uid:
+                datasource["uid"] = uid
                 replacements += 1
 
         for value in node.values():
-            replacements += rewrite_datasources(value)
+            replacements += rewrite_datasources_everywhere(value, target_uids)
     elif isinstance(node, list):
         for item in node:
-            replacements += rewrite_datasources(item)
+            replacements += rewrite_datasources_everywhere(item, target_uids)
 
     return replacements
 
@@ -65,5 +132,190 @@ def main(paths: list[str]) -> int:
     return exit_code
 
 
-raise SystemExit(main(sys.argv[1:]))
+def expand_paths(patterns: list[str]) -> list[Path]:
+    paths: dict[Path, None] = {}
+
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = sorted(path.rglob("*.json"))
+        elif glob.has_magic(pattern):
+            matches = sorted(Path(match) for match in glob.glob(pattern, recursive=True))
+        else:
+            matches = [path]
+
+        for match in matches:
+            paths.setdefault(match, None)
+
+    return list(paths)
+
+
+def process_file(path: Path) -> tuple[Path, str, int, float, str]:
+    started = time.perf_counter()
+
+    def result(status: str, replacements: int = 0, message: str = "") -> tuple[Path, str, int, float, str]:
+        return path, status, replacements, time.perf_counter() - started, message
+
+    try:
+        raw = path.read_bytes()
+    except OSError as exc:
+        return result("error", message=f"cannot read {path}: {exc}")
+
+    # A datasource of a mapped type needs the type name in the raw bytes
+    # (or a \u escape spelling it); anything else has no uid to rewrite
+    if b"\\u" not in raw and not any(name in raw for name in TARGET_TYPE_BYTES):
+        return result("skipped")
+
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+        return result("error", message=f"invalid JSON in {path}: {exc}")
+
+    replacements = rewrite_datasources(data)
+    if not replacements:
+        return result("unchanged")
+
+    updated = (json.dumps(data, indent=2, ensure_ascii=False) + "\n").encode("utf-8")
+    if updated == raw:
+        return result("unchanged", replacements)
+
+    path.write_bytes(updated)
+    return result("updated", replacements)
+
+
+def bulk(patterns: list[str], jobs: int | None = None) -> int:
+    jobs = jobs or os.cpu_count() or 1
+
+    if not patterns:
+        print("error: --bulk needs at least one directory or glob", file=sys.stderr)
+        return 1
+
+    paths = expand_paths(patterns)
+    started = time.perf_counter()
+
+    # The workers run functions from this stdin script, which only a
+    # forked child can see
+    if jobs > 1 and len(paths) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(jobs, mp_context=context) as pool:
+            results = list(pool.map(process_file, paths, chunksize=max(1, len(paths) // (jobs * 8))))
+    else:
+        results = [process_file(path) for path in paths]
+
+    counts = {"updated": 0, "unchanged": 0, "skipped": 0, "error": 0}
+    for path, status, replacements, elapsed, message in results:
+        counts[status] += 1
+        if status == "error":
+            print(f"error: {message} ({elapsed * 1000:.1f} ms)", file=sys.stderr)
+        elif status != "skipped":
+            print(f"{path}: {status}, {replacements} datasource uid value(s) ({elapsed * 1000:.1f} ms)")
+
+    total = time.perf_counter() - started
+    slowest = sorted(results, key=lambda result: result[3], reverse=True)[:5]
+    print(
+        f"{len(paths)} file(s) in {total:.2f}s with {jobs} job(s): "
+        + ", ".join(f"{count} {status}" for status, count in counts.items())
+    )
+    for path, status, replacements, elapsed, message in slowest:
+        print(f"  slowest: {path} {elapsed * 1000:.1f} ms ({status})")
+
+    return 1 if counts["error"] else 0
+
+
+def synthetic_dashboard(panel_count: int) -> dict:
+    # Rows of 50 panels, every other row collapsed (its panels nested in
+    # the row), with the usual bulky fieldConfig/options subtrees
+    datasources = [
+        {"type": "prometheus", "uid": "P1809F7CD0C75ACF3"},
+        {"type": "prometheus", "uid": TARGET_UID},
+        {"type": "loki", "uid": "P8E80F9AEF21F6940"},
+        {"type": "datasource", "uid": "-- Mixed --"},
+    ]
+    panels: list[dict] = []
+    for index in range(panel_count):
+        if index % 50 == 0:
+            row = {"type": "row", "title": f"Row {index // 50}", "collapsed": index % 100 == 0, "panels": []}
+            panels.append(row)
+        datasource = datasources[index % len(datasources)]
+        panel = {
+            "id": index + 1,
+            "type": "timeseries",
+            "title": f"Panel {index}",
+            "datasource": dict(datasource),
+            "gridPos": {"h": 8, "w": 12, "x": (index % 2) * 12, "y": index * 8},
+            "fieldConfig": {
+                "defaults": {
+                    "color": {"mode": "palette-classic"},
+                    "thresholds": {"mode": "absolute", "steps": [{"color": "green", "value": None}, {"color": "red", "value": 80}]},
+                    "mappings": [{"type": "value", "options": {str(n): {"text": f"state {n}"} for n in range(4)}}],
+                    "unit": "short",
+                },
+                "overrides": [
+                    {"matcher": {"id": "byName", "options": f"series {n}"}, "properties": [{"id": "color", "value": {"mode": "fixed", "fixedColor": "blue"}}]}
+                    for n in range(3)
+                ],
+            },
+            "options": {"legend": {"calcs": ["mean", "max"], "displayMode": "table", "placement": "bottom"}, "tooltip": {"mode": "multi"}},
+            "targets": [
+                {"refId": ref, "expr": f'sum(rate(http_requests_total{{job="app{index}"}}[5m])) by (instance)', "datasource": dict(datasource)}
+                for ref in ("A", "B")
+            ],
+        }
+        (row["panels"] if row["collapsed"] else panels).append(panel)
+
+    variable = {"name": "datasource", "type": "datasource", "query": "prometheus", "datasource": dict(datasources[0])}
+    return {
+        "annotations": {"list": [{"name": "Annotations", "datasource": dict(datasources[0]), "enable": True}]},
+        "panels": panels,
+        "templating": {"list": [variable]},
+        "title": "synthetic",
+    }
+
+
+def benchmark(panel_count: int) -> int:
+    source = json.dumps(synthetic_dashboard(panel_count), indent=2, ensure_ascii=False) + "\n"
+    print(f"synthetic dashboard: {panel_count} panels, {len(source) / 1e6:.1f} MB")
+
+    outputs = []
+    for name, engine in (("recursive, every node", rewrite_datasources_everywhere), ("explicit stack, pruned", rewrite_datasources)):
+        data = json.loads(source)
+        started = time.perf_counter()
+        replacements = engine(data)
+        elapsed = time.perf_counter() - started
+        outputs.append(json.dumps(data, indent=2, ensure_ascii=False) + "\n")
+        print(f"  {name:<24} {elapsed * 1000:8.1f} ms  {replacements} replacement(s)")
+
+    identical = outputs[0] == outputs[1]
+    print(f"  output byte-identical: {identical}")
+    return 0 if identical else 1
+
+
+def parse_options(args: list[str]) -> tuple[dict, list[str]]:
+    options: dict = {"bulk": False, "jobs": None, "benchmark": None}
+    while args and args[0].startswith("--"):
+        option = args.pop(0)
+        if option == "--bulk":
+            options["bulk"] = True
+        elif option == "--jobs" and args:
+            options["jobs"] = int(args.pop(0))
+        elif option == "--map" and args and "=" in args[0]:
+            datasource_type, uid = args.pop(0).split("=", 1)
+            TARGET_UIDS[datasource_type] = uid
+        elif option == "--benchmark":
+            options["benchmark"] = int(args.pop(0)) if args and args[0].isdigit() else 50_000
+        else:
+            raise SystemExit(f"error: unknown or incomplete option: {option}")
+    return options, args
+
+
+options, arguments = parse_options(sys.argv[1:])
+TARGET_TYPE_BYTES = [datasource_type.encode("utf-8") for datasource_type in TARGET_UIDS]
+
+if options["benchmark"] is not None:
+    raise SystemExit(benchmark(options["benchmark"]))
+
+if options["bulk"]:
+    raise SystemExit(bulk(arguments, options["jobs"]))
+
+raise SystemExit(main(arguments))
 PY